@@ -29,6 +29,7 @@ See the website at www.piborg.org/thunderborg for more details
 # Import the libraries we need
 import io
 import fcntl
+import threading
 import types
 import time
 
@@ -194,6 +195,10 @@ bus                     the smbus object used to talk to the I²C bus
 i2cAddress              The I²C address of the ThunderBorg chip to control
 foundChip               True if the ThunderBorg chip can be seen, False otherwise
 printFunction           Function reference to call when printing text, if None "print" is used
+busLock                 Lock held for each transaction, so threads sharing the bus do not interleave, unused with busManager
+busManager              i2cbus.BusManager to queue transactions through, if None the bus is opened directly
+busWritePriority        Queue priority of writes through busManager, motor commands by default
+busReadPriority         Queue priority of reads through busManager, telemetry by default
     """
 
     # Shared values used by this class
@@ -203,6 +208,10 @@ printFunction           Function reference to call when printing text, if None "
     printFunction           = None
     i2cWrite                = None
     i2cRead                 = None
+    busLock                 = threading.RLock()     # shared by every instance, as they share the bus
+    busManager              = None
+    busWritePriority        = 0                     # i2cbus.PRIORITY_MOTOR
+    busReadPriority         = 2                     # i2cbus.PRIORITY_TELEMETRY
 
 
     def RawWrite(self, command, data):
@@ -217,7 +226,12 @@ Under most circumstances you should use the appropriate function instead of RawW
         rawOutput = [command]
         rawOutput.extend(data)
         rawOutput = bytes(rawOutput)
-        self.i2cWrite.write(rawOutput)
+        if self.busManager:
+            # the manager serialises transactions itself, in priority order
+            self.busManager.write(self.i2cAddress, rawOutput, self.busWritePriority)
+        else:
+            with self.busLock:
+                self.i2cWrite.write(rawOutput)
 
 
     def RawRead(self, command, length, retryCount = 3):
@@ -233,8 +247,13 @@ If it does not it will retry the request until retryCount is exhausted (default
 Under most circumstances you should use the appropriate function instead of RawRead
         """
         while retryCount > 0:
-            self.RawWrite(command, [])
-            rawReply = self.i2cRead.read(length)
+            if self.busManager:
+                # one transaction, so the request and its reply stay together
+                rawReply = self.busManager.transfer(self.i2cAddress, bytes([command]), length, self.busReadPriority)
+            else:
+                with self.busLock:  # keep the request and its reply together
+                    self.RawWrite(command, [])
+                    rawReply = self.i2cRead.read(length)
             reply = []
             for singleByte in rawReply:
                 reply.append(singleByte)
@@ -257,6 +276,8 @@ This call does not check the board is present or working, under most circumstanc
         """
         self.busNumber = busNumber
         self.i2cAddress = address
+        if self.busManager:
+            return  # the manager owns the bus
         self.i2cRead = io.open("/dev/i2c-" + str(self.busNumber), "rb", buffering = 0)
         fcntl.ioctl(self.i2cRead, I2C_SLAVE, self.i2cAddress)
         self.i2cWrite = io.open("/dev/i2c-" + str(self.busNumber), "wb", buffering = 0)
@@ -297,11 +318,12 @@ If tryOtherBus is True, this function will attempt to use the other bus if the T
         """
         self.Print('Loading ThunderBorg on bus %d, address %02X' % (self.busNumber, self.i2cAddress))
 
-        # Open the bus
-        self.i2cRead = io.open("/dev/i2c-" + str(self.busNumber), "rb", buffering = 0)
-        fcntl.ioctl(self.i2cRead, I2C_SLAVE, self.i2cAddress)
-        self.i2cWrite = io.open("/dev/i2c-" + str(self.busNumber), "wb", buffering = 0)
-        fcntl.ioctl(self.i2cWrite, I2C_SLAVE, self.i2cAddress)
+        # Open the bus, unless a bus manager already owns it
+        if not self.busManager:
+            self.i2cRead = io.open("/dev/i2c-" + str(self.busNumber), "rb", buffering = 0)
+            fcntl.ioctl(self.i2cRead, I2C_SLAVE, self.i2cAddress)
+            self.i2cWrite = io.open("/dev/i2c-" + str(self.busNumber), "wb", buffering = 0)
+            fcntl.ioctl(self.i2cWrite, I2C_SLAVE, self.i2cAddress)
 
         # Check for ThunderBorg
         try:
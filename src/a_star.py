@@ -7,7 +7,10 @@ import ThunderBorg3 as ThunderBorg  # conversion for python 3
 from algorithms.algorithm import Algorithm
 #from hcsr04 import HCSR04
 from mpu6050 import MPU6050
-from robot.drive import follow, pathing
+from robot.calibration import load_calibration
+from robot.compiler import TimeModel, compile_lattice, compile_path
+from robot.drive import follow
+from robot.trajectory import follow_trajectory
 
 import logging
 
@@ -47,6 +50,12 @@ mpu.start()
 #hcsr.setName("HCSR04")
 #hcsr.start()
 
+# drive the path as one continuous curve, instead of stopping to spin at each corner
+TRAJECTORY = False
+
+# plan over (x, y, heading) with motion primitives, so turn time shapes the route
+LATTICE = False
+
 def main(TB, mpu):
     """Main function used to run the application
     Key variables:
@@ -68,26 +77,27 @@ def main(TB, mpu):
     # Power settings
     VOLTAGE_IN = 9.6  # Total battery voltage to the ThunderBorg
 
-    # NOTE: limiter has lower bound to power motors, ~0.4 experimental lower bound
-    LIMITER = 0.85  # utilise only <limiter>% of power, to slow down actions
-
-    VOLTAGE_OUT = (
-        12.0 * LIMITER
-    )  # Maximum motor voltage, we limit it to 95% to allow the RPi to get uninterrupted power
-
-    # Setup the power limits
-    if VOLTAGE_OUT > VOLTAGE_IN:
-        max_power = 1.0
-    else:
-        max_power = VOLTAGE_OUT / float(VOLTAGE_IN)
+    # power limits, spin/drive powers and motor balance all come from the calibration,
+    # see robot.calibration to fit them
+    calibration = load_calibration()
+    max_power = calibration.max_power(VOLTAGE_IN)
 
     algorithm = Algorithm(matrix=input_matrix, start_node=start_node, end_node=end_node)
     path = algorithm.use_a_star()
 
-    instructions = pathing(path, 1)
-    logging.debug(instructions)
+    if LATTICE:
+        steps = algorithm.use_lattice(TimeModel.from_calibration(calibration, max_power))
+        instructions = compile_lattice(steps, 1)
+        logging.debug(instructions)
+
+        follow(instructions, TB, mpu, max_power)
+    elif TRAJECTORY:
+        follow_trajectory(path, 1, TB, mpu, max_power, logging.getLogger())
+    else:
+        instructions = compile_path(path, 1)
+        logging.debug(instructions)
 
-    follow(instructions, TB, mpu, max_power)
+        follow(instructions, TB, mpu, max_power)
 
 if __name__ == "__main__":
     # enable debug logging
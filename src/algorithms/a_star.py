@@ -7,17 +7,21 @@ from pathfinding.finder.a_star import AStarFinder
 
 import logging
 
-def a_star(matrix, start_node, end_node):
+def a_star(matrix, start_node, end_node, costmap=None):
     """A function that returns a path using the A* algorithm
 
     Args:
         matrix (list): a matrix representing the space the robot is in
         start_node (tuple): the node the robot is starting from
         end_node (tuple): the node the robot is trying to reach
+        costmap (Costmap, optional): clearance costs to weight each cell by, defaults to None
 
     Returns:
         path (list) : a list of nodes representing the path the robot should take
     """
+    if costmap:
+        matrix = costmap.weights(matrix)
+
     grid = Grid(matrix=matrix)
 
     start = grid.node(*start_node)
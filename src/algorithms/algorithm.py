@@ -1,7 +1,10 @@
 """A Class used for selecting which algorithm to use
 """
 from algorithms.a_star import a_star
-from algorithms.d_star_lite import D_Star_Lite, Node, Graph, Grid
+from algorithms.costmap import Costmap
+from algorithms.d_star_lite import D_Star_Lite, Node, Graph, Grid, PlannerStats
+from algorithms.lattice import LatticePlanner
+from algorithms.renderer import GridRenderer
 
 class Algorithm:
     """A Class used for selecting which algorithm to use
@@ -10,15 +13,18 @@ class Algorithm:
         matrix: a matrix representing the space the robot is in
         start_node: the node the robot is starting from
         end_node: the node the robot is trying to reach
+        costmap: clearance costs to weight cells by, built from the matrix if not given
 
     Methods:
         use_a_star: a function that returns a path using the A* algorithm
+        use_lattice: a function that returns the quickest motion primitives over (x, y, heading)
     """
 
-    def __init__(self, matrix, start_node, end_node):
+    def __init__(self, matrix, start_node, end_node, costmap=None):
         self.matrix = matrix
         self.start_node = start_node
         self.end_node = end_node
+        self.costmap = costmap if costmap else Costmap.from_matrix(matrix)
 
     def use_a_star(self):
         """A function that returns a path using the A* algorithm
@@ -26,4 +32,20 @@ class Algorithm:
         Returns:
             path: a list of nodes representing the path the robot should take
         """
-        return a_star(self.matrix, self.start_node, self.end_node)
+        return a_star(self.matrix, self.start_node, self.end_node, self.costmap)
+
+    def use_lattice(self, model, unit_size=1, start_heading=0, goal_heading=None):
+        """A function that returns the quickest motion primitives using the state-lattice planner
+
+        Args:
+            model (TimeModel): time model to cost primitives with, see robot.compiler.TimeModel
+            unit_size (float, optional): the size of one grid cell, in drive units
+            start_heading (float, optional): heading at the start in degrees, defaults to 0 (North)
+            goal_heading (float, optional): heading required at the goal, defaults to None for any
+
+        Returns:
+            steps: a list of primitives the robot should perform, see robot.compiler.compile_lattice
+        """
+        cells = [[0 if cell >= 1 else -1 for cell in row] for row in self.matrix]
+        planner = LatticePlanner(cells, model, unit_size, self.costmap)
+        return planner.plan(self.start_node, self.end_node, start_heading, goal_heading)
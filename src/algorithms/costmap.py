@@ -0,0 +1,137 @@
+"""Configuration-space inflation and clearance-cost layer for the planners.
+
+Obstacles are inflated by the robot footprint, so cells the robot cannot
+occupy without touching an obstacle become impassable, and cells near
+obstacles carry a cost that decays with clearance. Planners add this cost to
+every edge entering a cell, so paths keep away from walls.
+"""
+
+import math
+
+import numpy as np
+
+from algorithms.distance_map import distance_transform
+
+
+class Costmap:
+    """Clearance cost for each cell of an occupancy grid.
+
+    Constructor Arguments:
+        cells: occupancy grid indexed cells[y][x], where cells < 0 are obstacles
+        footprint_radius: robot radius in cells, cells closer than this to an obstacle are impassable
+        inflation_radius: clearance in cells beyond which cells carry no extra cost
+        clearance_weight: extra cost of a cell just outside the footprint
+        decay: exponential decay rate of the cost with clearance, per cell
+        border_is_wall: treat the edge of the map as an obstacle when measuring clearance
+
+    Methods:
+        from_matrix: build from an A* walkability matrix, where cells >= 1 are walkable
+        update_cells: incrementally update the costs around changed cells
+        edge_cost: cost of moving into a cell
+        weights: integer weight matrix for the pathfinding A* finder
+    """
+
+    def __init__(self, cells, footprint_radius=0.5, inflation_radius=2.5, clearance_weight=4.0, decay=1.5, border_is_wall=True):
+        self.footprint_radius = footprint_radius
+        self.inflation_radius = inflation_radius
+        self.clearance_weight = clearance_weight
+        self.decay = decay
+
+        grid = np.asarray(cells) < 0
+        self.height, self.width = grid.shape
+
+        # pad with a ring of cells standing in for the map border, so indexes are offset by one
+        self.occupied = np.pad(grid, 1, constant_values=border_is_wall)
+
+        self.distance = distance_transform(self.occupied)[1:-1, 1:-1]
+        self.cost = self._cost_from_distance(self.distance)
+
+    @classmethod
+    def from_matrix(cls, matrix, **kwargs):
+        """Build a costmap from an A* walkability matrix.
+
+        Args:
+            matrix (list): walkability matrix indexed matrix[y][x], cells >= 1 are walkable
+
+        Returns:
+            Costmap: costmap for the matrix
+        """
+        return cls(np.where(np.asarray(matrix) >= 1, 0, -1), **kwargs)
+
+    def _cost_from_distance(self, distance):
+        cost = self.clearance_weight * np.exp(-self.decay * (distance - self.footprint_radius))
+        cost[distance >= self.inflation_radius] = 0.0
+        cost[distance <= self.footprint_radius] = float("inf")
+        return cost
+
+    def update_cells(self, cells, changed):
+        """Update costs around cells whose occupancy changed.
+
+        Only a window of inflation_radius around each changed cell is recomputed,
+        so the update cost does not grow with the map size.
+
+        Args:
+            cells (list): current occupancy grid indexed cells[y][x]
+            changed (list): (x, y) coordinates of cells whose occupancy changed
+
+        Returns:
+            set: (x, y) coordinates of cells whose cost changed
+        """
+        grid = np.asarray(cells) < 0
+        reach = int(math.ceil(self.inflation_radius))
+        updated = set()
+
+        for x, y in changed:
+            self.occupied[y + 1, x + 1] = grid[y, x]
+
+        for x, y in changed:
+            # window whose costs may change, and the wider region holding every obstacle that can affect it
+            x0, x1 = max(x - reach, 0), min(x + reach + 1, self.width)
+            y0, y1 = max(y - reach, 0), min(y + reach + 1, self.height)
+            ox0, ox1 = max(x0 - reach, -1), min(x1 + reach, self.width + 1)
+            oy0, oy1 = max(y0 - reach, -1), min(y1 + reach, self.height + 1)
+
+            local = distance_transform(self.occupied[oy0 + 1:oy1 + 1, ox0 + 1:ox1 + 1])
+            distance = local[y0 - oy0:y1 - oy0, x0 - ox0:x1 - ox0]
+            # distances beyond the region may be overestimated, but are past the inflation radius either way
+            distance = np.minimum(distance, self.inflation_radius)
+
+            cost = self._cost_from_distance(distance)
+            diff = cost != self.cost[y0:y1, x0:x1]
+
+            self.distance[y0:y1, x0:x1] = distance
+            self.cost[y0:y1, x0:x1] = cost
+
+            for j, i in zip(*np.nonzero(diff)):
+                updated.add((int(x0 + i), int(y0 + j)))
+
+        return updated
+
+    def edge_cost(self, x, y):
+        """Cost of moving one cell into cell (x, y).
+
+        Args:
+            x (int): x coordinate of the cell entered
+            y (int): y coordinate of the cell entered
+
+        Returns:
+            float: 1 plus the clearance cost, inf if the cell is impassable
+        """
+        return 1 + float(self.cost[y, x])
+
+    def weights(self, matrix):
+        """Integer weight matrix for the pathfinding A* finder.
+
+        Args:
+            matrix (list): walkability matrix, cells >= 1 are walkable
+
+        Returns:
+            list: weights >= 1 for passable cells, 0 for impassable cells
+        """
+        walkable = np.asarray(matrix) >= 1
+        cost = self.cost
+        passable = walkable & np.isfinite(cost)
+
+        weights = np.zeros(cost.shape, dtype=int)
+        weights[passable] = 1 + np.rint(cost[passable]).astype(int)
+        return weights.tolist()
@@ -1,4 +1,13 @@
 import heapq
+import time
+
+from profiler import profile
+
+
+def stateNameToCoords(name):
+    """Coordinates [x, y] of a node named "x{x}y{y}"."""
+    x, y = name[1:].split("y")
+    return [int(x), int(y)]
 
 
 class Node:
@@ -22,6 +31,7 @@ class Node:
 class Graph:
     def __init__(self):
         self.graph = {}
+        self.changed = set()
 
     def __str__(self):
         msg = "Graph:"
@@ -62,6 +72,7 @@ class Grid(Graph):
         for i in range(y_dim):
             self.cells[i] = [0] * x_dim
         self.graph = {}
+        self.changed = set()  # nodes whose cell or g value changed since last rendered, see GridRenderer
 
         self.generateGraphFromGrid()
         # self.printGrid()
@@ -84,65 +95,50 @@ class Grid(Graph):
     def __repr__(self):
         return self.__str__()
 
+    def markers(self, start, end, current=None, symbols=("S", "E", "X")):
+        """Symbols to draw over the start, end and current cells, later ones on top."""
+        markers = {}
+        for name, symbol in zip((start, end, current), symbols):
+            if name is not None:
+                markers[tuple(stateNameToCoords(name))] = symbol
+        return markers
+
     def printGrid(self, start, end, current=None):
-        d = D_Star_Lite()
-        test = [0] * len(self.cells)
-        for i in range(len(self.cells)):
-            test[i] = [0] * len(self.cells[0])
-        
-        for i in range(len(self.cells)):
-            for j in range(len(self.cells[i])):
-                test[i][j] = self.cells[i][j]
-        start = d.stateNameToCoords(start)
-        end = d.stateNameToCoords(end)
-        current = d.stateNameToCoords(current)
-        test[start[1]][start[0]] = "S"
-        test[end[1]][end[0]] = "E"
-        test[current[1]][current[0]] = "X"
-        for row in test:
-            string = ""
-            for col in row:
-                string += f'{col:>3}'
-            print(string)
+        markers = self.markers(start, end, current)
+        for y, row in enumerate(self.cells):
+            print("".join(f'{markers.get((x, y), col):>3}' for x, col in enumerate(row)))
 
     def printGValues(self, start, end, current=None):
-        d = D_Star_Lite()
-        tmp = [0] * len(self.cells)
-        for i in range(len(self.cells)):
-           tmp[i] = [0] * len(self.cells[0])
-           
-        for i in range(len(self.cells)):        
-            for j in range(len(self.cells[i])):
-                tmp[i][j] = self.cells[i][j]        
-        start = d.stateNameToCoords(start)
-        end = d.stateNameToCoords(end)
-        current = d.stateNameToCoords(current)
-        for j in range(len(self.cells)):
-            str_msg = ""
-            for i in range(len(self.cells[0])):
-                node_id = "x" + str(i) + "y" + str(j)
-                node = self.graph[node_id]
-                if tmp[j][i] == 0:
-                    if node.g == float("inf"):
-                        tmp[j][i] = "-"
-                    else:
-                        tmp[j][i] = str(node.g)
-                if tmp[j][i] == -2:
-                    tmp[j][i] = "⬛"
-                    
-        tmp[start[1]][start[0]] = "🟢"
-        tmp[end[1]][end[0]] = "🔴"
-        tmp[current[1]][current[0]] = "🚗"
-        for row in tmp:
-            string = ""
-            for col in row:
-                if col != "⬛" and col != "🟢" and col != "🔴" and col != "🚗":
-                    string += f'{col:>3}'
-                else:
-                    string += f'{col:>2}'
-            print(string)
+        markers = self.markers(start, end, current, ("🟢", "🔴", "🚗"))
+        tmp = []
+        for y, row in enumerate(self.cells):
+            labels = []
+            for x, col in enumerate(row):
+                if (x, y) in markers:
+                    col = markers[(x, y)]
+                elif col == 0:
+                    g = self.graph["x" + str(x) + "y" + str(y)].g
+                    col = "-" if g == float("inf") else str(g)
+                elif col == -2:
+                    col = "⬛"
+                labels.append(col)
+            tmp.append(labels)
+
+            print("".join(f'{col:>2}' if col in ("⬛", "🟢", "🔴", "🚗") else f'{col:>3}' for col in labels))
         return tmp
 
+    def applyCostmap(self, costmap):
+        """Weight every edge by the clearance cost of the cell it enters.
+
+        Edges into obstacles are left to updateObsticles, which blocks them outright.
+        """
+        for id in self.graph:
+            x, y = stateNameToCoords(id)
+            cost = costmap.edge_cost(x, y)
+            for neighbor in self.graph[id].children:
+                if self.graph[neighbor].children[id] != float("inf"):
+                    self.graph[neighbor].children[id] = cost
+
     def generateGraphFromGrid(self):
         edge = 1
         for i in range(len(self.cells)):
@@ -165,9 +161,69 @@ class Grid(Graph):
                 self.graph["x" + str(i) + "y" + str(j)] = node
 
 
+class PlannerStats:
+    """Counters of the work D* Lite has done, for telling full searches from incremental repairs.
+
+    Constructor Arguments:
+        replans: computeShortestPath calls
+        expansions: vertices made consistent, i.e. whose g value was changed
+        pushes: vertices pushed onto the queue
+        pops: vertices popped off the top of the queue
+        removals: vertices removed from the middle of the queue by updateVertex
+        vertex_updates: updateVertex calls
+        changed_edges: edges whose cost changed, from updateObsticles and updateCosts
+        replan_ms: time spent in computeShortestPath, in milliseconds
+        max_replan_ms: slowest computeShortestPath call, in milliseconds
+
+    Methods:
+        copy: an independent copy of the counters
+        as_dict: the counters as a dict, e.g. for JSON telemetry
+    """
+
+    def __init__(self, replans=0, expansions=0, pushes=0, pops=0, removals=0, vertex_updates=0, changed_edges=0, replan_ms=0.0, max_replan_ms=0.0):
+        self.replans = replans
+        self.expansions = expansions
+        self.pushes = pushes
+        self.pops = pops
+        self.removals = removals
+        self.vertex_updates = vertex_updates
+        self.changed_edges = changed_edges
+        self.replan_ms = replan_ms
+        self.max_replan_ms = max_replan_ms
+
+    def copy(self):
+        return PlannerStats(**self.as_dict())
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return f"PlannerStats({', '.join(f'{key}={value}' for key, value in vars(self).items())})"
+
+
 class D_Star_Lite:
-    def __init__(self):
-        pass
+    """D* Lite incremental planner, counting its work as it goes.
+
+    Constructor Arguments:
+        telemetry: function called with the PlannerStats of each computeShortestPath call, None for none
+
+    Methods:
+        snapshot: copy of the counters accumulated since construction
+    """
+
+    def __init__(self, telemetry=None):
+        self.telemetry = telemetry
+        self.stats = PlannerStats()  # accumulated since construction
+        self.last = PlannerStats()  # of the latest computeShortestPath call
+        self.mark = PlannerStats()  # self.stats as of the latest computeShortestPath call
+
+    def snapshot(self):
+        """Copy of the counters accumulated since construction.
+
+        Returns:
+            PlannerStats: the counters, unaffected by later planning
+        """
+        return self.stats.copy()
 
     def topKey(self, queue):
         queue.sort()
@@ -192,6 +248,7 @@ class D_Star_Lite:
         )
 
     def updateVertex(self, graph, queue, id, s_current, k_m):
+        self.stats.vertex_updates += 1
         s_goal = graph.goal
         if id != s_goal:
             min_rhs = float("inf")
@@ -203,10 +260,15 @@ class D_Star_Lite:
             if len(id_in_queue) != 1:
                 raise ValueError("more than one " + id + " in the queue!")
             queue.remove(id_in_queue[0])
+            self.stats.removals += 1
         if graph.graph[id].rhs != graph.graph[id].g:
             heapq.heappush(queue, self.calculateKey(graph, id, s_current, k_m) + (id,))
+            self.stats.pushes += 1
 
+    @profile("computeShortestPath")
     def computeShortestPath(self, graph, queue, s_start, k_m):
+        start = time.perf_counter()
+
         while (graph.graph[s_start].rhs != graph.graph[s_start].g) or (
             self.topKey(queue) < self.calculateKey(graph, s_start, s_start, k_m)
         ):
@@ -217,18 +279,36 @@ class D_Star_Lite:
             # print(calculateKey(graph, s_start, 0))
             k_old = self.topKey(queue)
             u = heapq.heappop(queue)[2]
+            self.stats.pops += 1
             if k_old < self.calculateKey(graph, u, s_start, k_m):
                 heapq.heappush(queue, self.calculateKey(graph, u, s_start, k_m) + (u,))
+                self.stats.pushes += 1
             elif graph.graph[u].g > graph.graph[u].rhs:
+                self.stats.expansions += 1
                 graph.graph[u].g = graph.graph[u].rhs
+                graph.changed.add(u)
                 for i in graph.graph[u].parents:
                     self.updateVertex(graph, queue, i, s_start, k_m)
             else:
+                self.stats.expansions += 1
                 graph.graph[u].g = float("inf")
+                graph.changed.add(u)
                 self.updateVertex(graph, queue, u, s_start, k_m)
                 for i in graph.graph[u].parents:
                     self.updateVertex(graph, queue, i, s_start, k_m)
 
+        duration = (time.perf_counter() - start) * 1000
+        self.stats.replans += 1
+        self.stats.replan_ms += duration
+        self.stats.max_replan_ms = max(self.stats.max_replan_ms, duration)
+
+        # this call repaired everything changed since the previous one, e.g. by updateObsticles
+        self.last = PlannerStats(**{key: value - getattr(self.mark, key) for key, value in vars(self.stats).items()})
+        self.last.max_replan_ms = duration
+        self.mark = self.stats.copy()
+        if self.telemetry:
+            self.telemetry(self.last)
+
     def nextInShortestPath(self, graph, s_current):
         min_rhs = float("inf")
         s_next = None
@@ -274,19 +354,66 @@ class D_Star_Lite:
             return s_new, k_m
 
     def stateNameToCoords(self, name):
-        return [
-            int(name.split("x")[1].split("y")[0]),
-            int(name.split("x")[1].split("y")[1]),
-        ]
+        return stateNameToCoords(name)
 
     def initDStarLite(self, graph, queue, s_start, s_goal, k_m):
         graph.graph[s_goal].rhs = 0
         heapq.heappush(
             queue, self.calculateKey(graph, s_goal, s_start, k_m) + (s_goal,)
         )
+        self.stats.pushes += 1
         self.computeShortestPath(graph, queue, s_start, k_m)
         return (graph, queue, k_m)
 
+    def updateCosts(self, graph, queue, s_current, k_m, costmap, changed):
+        """Reweight edges entering cells whose clearance cost changed.
+
+        Args:
+            changed: (x, y) coordinates of cells whose cost changed, see Costmap.update_cells
+        """
+        for x, y in changed:
+            id = "x" + str(x) + "y" + str(y)
+            if graph.cells[y][x] < 0:  # obstacles stay blocked
+                continue
+            cost = costmap.edge_cost(x, y)
+            for neighbor in graph.graph[id].children:
+                # edges blocked by updateObsticles stay blocked, as in Grid.applyCostmap
+                if graph.graph[neighbor].children[id] == float("inf"):
+                    continue
+                if graph.graph[neighbor].children[id] != cost:
+                    graph.graph[neighbor].children[id] = cost
+                    self.stats.changed_edges += 1
+                    self.updateVertex(graph, queue, neighbor, s_current, k_m)
+
+    def clearObstacles(self, graph, queue, s_current, k_m, cells):
+        """Reopen cells found to be free after all, restoring the edges updateObsticles blocked.
+
+        Reopened edges get the default cost, see updateCosts to weight them by clearance.
+
+        Args:
+            cells (list): (x, y) coordinates of the cells, already set free in graph.cells
+
+        Returns:
+            bool: whether any edge was reopened
+        """
+        reopened = False
+        for x, y in cells:
+            id = "x" + str(x) + "y" + str(y)
+            for neighbor in graph.graph[id].children:
+                neighbor_x, neighbor_y = stateNameToCoords(neighbor)
+                if graph.cells[neighbor_y][neighbor_x] < 0:
+                    continue  # still blocked from the other side
+                for a, b in ((id, neighbor), (neighbor, id)):
+                    if graph.graph[a].children[b] == float("inf"):
+                        graph.graph[a].children[b] = 1  # as in generateGraphFromGrid
+                        self.stats.changed_edges += 1
+                        reopened = True
+                self.updateVertex(graph, queue, neighbor, s_current, k_m)
+            self.updateVertex(graph, queue, id, s_current, k_m)
+            graph.changed.add(id)
+        return reopened
+
+    @profile("updateObsticles")
     def updateObsticles(self, graph, queue, s_current, k_m, scan_range=20):
         states_to_update = {}
         range_checked = 0
@@ -321,8 +448,10 @@ class D_Star_Lite:
                     if graph.graph[state].children[neighbor] != float("inf"):
                         neighbor_coords = self.stateNameToCoords(state)
                         graph.cells[neighbor_coords[1]][neighbor_coords[0]] = -2
+                        graph.changed.add(state)
                         graph.graph[neighbor].children[state] = float("inf")
                         graph.graph[state].children[neighbor] = float("inf")
+                        self.stats.changed_edges += 2
                         self.updateVertex(graph, queue, state, s_current, k_m)
                         new_obstacle = True
             # elif states_to_update[state] == 0: #cell without obstacle
@@ -0,0 +1,238 @@
+"""Precomputed distance transform and ray-distance lookup tables for a map.
+
+Building the tables is done once per map and cached to disk, keyed by a hash
+of the occupancy grid, so that expected-range queries for the HC-SR04 (or a
+lidar) become a single array read instead of marching a ray cell by cell.
+Only the most recently used maps are kept in the cache.
+
+Coordinates and headings follow algorithms.particle_filter: grid cells centred
+on integer coordinates, indexed [y][x], headings in degrees clockwise from North.
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+
+
+def distance_transform(occupied):
+    """Exact Euclidean distance transform of an occupancy grid.
+
+    Args:
+        occupied (np.ndarray): boolean grid, True for obstacles, indexed [y][x]
+
+    Returns:
+        np.ndarray: distance (in cells) from each cell centre to the nearest obstacle centre,
+            inf everywhere if the grid has no obstacles
+    """
+    occupied = np.asarray(occupied, dtype=bool)
+    height, width = occupied.shape
+
+    # 1D pass along each row, sweeping left then right
+    row = np.where(occupied, 0.0, np.inf)
+    for j in range(1, width):
+        row[:, j] = np.minimum(row[:, j], row[:, j - 1] + 1)
+    for j in range(width - 2, -1, -1):
+        row[:, j] = np.minimum(row[:, j], row[:, j + 1] + 1)
+
+    # combine rows, minimising squared row distance plus squared column offset
+    squared = row ** 2
+    offsets = np.arange(height, dtype=float)
+    distance = np.empty((height, width))
+    for i in range(height):
+        distance[i] = np.min(squared + ((offsets - i) ** 2)[:, None], axis=0)
+
+    return np.sqrt(distance)
+
+
+class DistanceMap:
+    """Distance transform and per-angle ray-distance tables for a single map.
+
+    Constructor Arguments:
+        occupied: boolean grid, True for obstacles, indexed [y][x]
+        n_angles: number of headings to tabulate, evenly spaced over 360 degrees
+        max_range: longest ray to trace, in cells
+        subdivisions: table samples per cell along each axis
+        cache_dir: directory to cache tables in, None to disable caching
+        max_cached: most maps kept in the cache, the least recently used are removed first
+
+    Methods:
+        from_cells: build from a D* Lite grid, where cells < 0 are obstacles
+        from_occupancy: build from a lidar occupancy map, see lidar.generate_ray_casting_grid_map
+        expected_range: look up the distance to the first obstacle along a heading
+        clearance: look up the distance to the nearest obstacle
+    """
+
+    def __init__(self, occupied, n_angles=72, max_range=4.0, subdivisions=4, cache_dir=CACHE_PATH, max_cached=8):
+        self.occupied = np.asarray(occupied, dtype=bool)
+        self.height, self.width = self.occupied.shape
+        self.n_angles = n_angles
+        self.max_range = max_range
+        self.subdivisions = subdivisions
+
+        self.key = self.map_hash()
+
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, f"distance_map_{self.key}.npz")
+
+        if path and os.path.exists(path):
+            with np.load(path) as cached:
+                self.distance = cached["distance"]
+                self.rays = cached["rays"]
+            os.utime(path)  # mark as recently used, so pruning keeps it
+            logging.debug(f"Loaded distance map {self.key} from cache")
+        else:
+            self.distance = distance_transform(self.occupied)
+            self.rays = self._build_ray_tables()
+
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez_compressed(path, distance=self.distance, rays=self.rays)
+                logging.debug(f"Cached distance map {self.key} to {path}")
+                self._prune(cache_dir, max_cached)
+
+    @staticmethod
+    def _prune(cache_dir, max_cached):
+        cached = [
+            os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+            if name.startswith("distance_map_") and name.endswith(".npz")
+        ]
+        cached.sort(key=os.path.getmtime, reverse=True)
+        for path in cached[max_cached:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # already removed, e.g. by another process
+
+    @classmethod
+    def from_cells(cls, cells, **kwargs):
+        """Build tables from a D* Lite grid.
+
+        Args:
+            cells (list): occupancy grid indexed cells[y][x], where cells < 0 are obstacles
+
+        Returns:
+            DistanceMap: tables for the grid
+        """
+        return cls(np.asarray(cells) < 0, **kwargs)
+
+    @classmethod
+    def from_occupancy(cls, occupancy_map, threshold=0.5, **kwargs):
+        """Build tables from a lidar occupancy map.
+
+        Args:
+            occupancy_map (np.ndarray): occupancy probabilities indexed [x][y], as returned by
+                lidar.generate_ray_casting_grid_map (0.0 free, 0.5 unknown, 1.0 occupied)
+            threshold (float): probability above which a cell is an obstacle
+
+        Returns:
+            DistanceMap: tables for the map, in grid cells of the map's xy_resolution
+        """
+        return cls(np.asarray(occupancy_map).T > threshold, **kwargs)
+
+    def map_hash(self):
+        """Hash the map and table parameters, used as the cache key.
+
+        Returns:
+            str: hex digest identifying these tables
+        """
+        h = hashlib.sha1()
+        h.update(np.packbits(self.occupied).tobytes())
+        h.update(repr((self.occupied.shape, self.n_angles, self.max_range, self.subdivisions)).encode())
+        return h.hexdigest()[:16]
+
+    def expected_range(self, x, y, heading):
+        """Look up the distance to the first obstacle along a heading.
+
+        Args:
+            x (np.ndarray): x coordinates in cells
+            y (np.ndarray): y coordinates in cells
+            heading (np.ndarray): headings in degrees
+
+        Returns:
+            np.ndarray: distance in cells, 0 outside the map, max_range if nothing is hit
+        """
+        ix, iy, inside = self._sample_index(x, y)
+        ia = np.rint(np.asarray(heading) * (self.n_angles / 360.0)).astype(int) % self.n_angles
+
+        ranges = np.zeros(ix.shape, dtype=self.rays.dtype)
+        ranges[inside] = self.rays[ia[inside], iy[inside], ix[inside]]
+        return ranges
+
+    def clearance(self, x, y):
+        """Look up the distance to the nearest obstacle.
+
+        Args:
+            x (np.ndarray): x coordinates in cells
+            y (np.ndarray): y coordinates in cells
+
+        Returns:
+            np.ndarray: distance in cells, 0 outside the map
+        """
+        ix = np.rint(np.asarray(x, dtype=float)).astype(int)
+        iy = np.rint(np.asarray(y, dtype=float)).astype(int)
+        inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+
+        distance = np.zeros(ix.shape)
+        distance[inside] = self.distance[iy[inside], ix[inside]]
+        return distance
+
+    def _sample_index(self, x, y):
+        sub = self.subdivisions
+        # table sample (0, 0) sits on the corner of cell (0, 0), half a cell from its centre
+        ix = np.floor((np.asarray(x, dtype=float) + 0.5) * sub).astype(int)
+        iy = np.floor((np.asarray(y, dtype=float) + 0.5) * sub).astype(int)
+        inside = (ix >= 0) & (ix < self.width * sub) & (iy >= 0) & (iy < self.height * sub)
+        return ix, iy, inside
+
+    def _build_ray_tables(self):
+        """Trace a ray from every table sample at every heading.
+
+        Rays are sphere traced over the distance transform, so each step skips the
+        free space known to surround the current cell instead of marching cell by cell.
+        """
+        sub = self.subdivisions
+        ys, xs = np.mgrid[0:self.height * sub, 0:self.width * sub]
+        shape = xs.shape
+        xs = (xs.ravel() + 0.5) / sub - 0.5
+        ys = (ys.ravel() + 0.5) / sub - 0.5
+
+        # a point this far from any obstacle centre cannot lie in an obstacle's cell,
+        # and the map edge counts as an obstacle too
+        row, col = np.mgrid[0:self.height, 0:self.width]
+        border = np.minimum.reduce([col, row, self.width - 1 - col, self.height - 1 - row]) + 0.5
+        safe = np.minimum(self.distance - np.sqrt(2), border - 0.5)
+        min_step = 0.5 / sub
+
+        rays = np.empty((self.n_angles,) + shape, dtype=np.float32)
+
+        for a in range(self.n_angles):
+            rad = np.radians(a * 360.0 / self.n_angles)
+            dx, dy = np.sin(rad), -np.cos(rad)
+
+            t = np.zeros(xs.shape)
+            active = np.arange(xs.size)  # indexes of rays still being traced
+
+            while active.size:
+                t_active = t[active]
+                px = np.rint(xs[active] + dx * t_active).astype(int)
+                py = np.rint(ys[active] + dy * t_active).astype(int)
+                inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+
+                hit = ~inside
+                hit[inside] = self.occupied[py[inside], px[inside]]
+
+                step = np.full(px.shape, min_step)
+                step[inside] = np.maximum(safe[py[inside], px[inside]], min_step)
+
+                t_active[~hit] += step[~hit]
+                t[active] = np.minimum(t_active, self.max_range)
+                active = active[~(hit | (t_active >= self.max_range))]
+
+            rays[a] = t.reshape(shape)
+
+        return rays
@@ -0,0 +1,338 @@
+"""State-lattice planner over (x, y, heading) with precomputed motion primitives.
+
+The robot's heading is discretised into 8 directions, 45 degrees apart, and the
+search expands a fixed set of motion primitives from each state: straight runs
+forwards and in reverse, spins in place and quarter-circle arcs. Each primitive
+is costed in seconds by a time model (see robot.compiler.TimeModel), so the
+planner minimises travel time, including turns, rather than cell count.
+
+Primitives depend only on the time model, so are built once and cached. The
+heuristic is a table of exact costs to go in obstacle-free space, computed once
+per primitive set and cached to disk, which never overestimates with obstacles.
+
+Coordinates follow algorithms.d_star_lite: cells indexed cells[y][x], cells < 0
+are obstacles, headings clockwise from North (decreasing y).
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+import os
+
+import numpy as np
+
+from algorithms.distance_map import CACHE_PATH
+
+N_HEADINGS = 8
+
+# unit step for each heading index, North first and clockwise
+STEPS = [(0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)]
+
+
+def heading_index(degrees):
+    """Snap a heading in degrees to the nearest lattice heading.
+
+    Args:
+        degrees (float): heading in degrees, clockwise from North
+
+    Returns:
+        int: lattice heading index, 0 (North) to 7 (North-West)
+    """
+    return int(round(degrees / 45.0)) % N_HEADINGS
+
+
+def heading_degrees(index):
+    """Convert a lattice heading to degrees within [-180, 180).
+
+    Args:
+        index (int): lattice heading index
+
+    Returns:
+        float: heading in degrees, clockwise from North
+    """
+    return (index * 45.0 + 180.0) % 360.0 - 180.0
+
+
+class Primitive:
+    """A single motion from a lattice state, relative to the start cell.
+
+    Constructor Arguments:
+        kind: "forward", "reverse", "spin" or "arc"
+        heading: lattice heading at the start
+        end_heading: lattice heading at the end
+        dx: change in x, in cells
+        dy: change in y, in cells
+        swept: (dx, dy) offsets of every cell passed through, excluding the start cell
+        distance: distance driven in cells, negative when reversing
+        angle: angle turned in degrees, positive clockwise
+        time: estimated duration in seconds
+    """
+
+    def __init__(self, kind, heading, end_heading, dx, dy, swept, distance, angle, time):
+        self.kind = kind
+        self.heading = heading
+        self.end_heading = end_heading
+        self.dx = dx
+        self.dy = dy
+        self.swept = swept
+        self.distance = distance
+        self.angle = angle
+        self.time = time
+
+    def __repr__(self):
+        return f"Primitive({self.kind}, {self.heading}->{self.end_heading}, ({self.dx}, {self.dy}), {self.time:.2f}s)"
+
+
+_primitive_cache = {}
+
+
+def build_primitives(model, unit_size, max_run=4, allow_reverse=True):
+    """Build the motion primitives available from each lattice heading.
+
+    Args:
+        model (TimeModel): time model used to cost each primitive
+        unit_size (float): the size of one grid cell, in drive units
+        max_run (int, optional): longest straight run as a single primitive, in cells
+        allow_reverse (bool, optional): include reverse runs, defaults to True
+
+    Returns:
+        list: for each heading index, the list of primitives starting from it
+    """
+    key = primitives_key(model, unit_size, max_run, allow_reverse)
+    if key in _primitive_cache:
+        return _primitive_cache[key]
+
+    primitives = []
+
+    for h in range(N_HEADINGS):
+        sx, sy = STEPS[h]
+        step = math.hypot(sx, sy)
+        options = []
+
+        # straight runs, each paying the drive settle time once
+        for direction in (1, -1) if allow_reverse else (1,):
+            for n in range(1, max_run + 1):
+                swept = []
+                for i in range(1, n + 1):
+                    cx, cy = direction * sx * i, direction * sy * i
+                    if sx and sy:
+                        # moving diagonally passes the corners of both neighbouring cells
+                        swept += [(cx - direction * sx, cy), (cx, cy - direction * sy)]
+                    swept.append((cx, cy))
+
+                distance = direction * n * step
+                options.append(Primitive(
+                    "forward" if direction > 0 else "reverse", h, h,
+                    direction * sx * n, direction * sy * n, swept, distance, 0.0,
+                    model.drive_time(distance * unit_size),
+                ))
+
+        # spins in place, each the quickest way round
+        for turn in (1, -1, 2, -2, 3, -3, 4):
+            angle = turn * 45.0
+            if turn == 4:
+                angle = min((180.0, -180.0), key=model.spin_time)
+            options.append(Primitive(
+                "spin", h, (h + turn) % N_HEADINGS, 0, 0, [], 0.0, angle, model.spin_time(angle)
+            ))
+
+        # quarter-circle arcs of one cell radius, from cardinal headings only so they end on the lattice
+        if h % 2 == 0:
+            for turn in (2, -2):
+                rx, ry = STEPS[(h + turn) % N_HEADINGS]
+                swept = [(sx, sy), (sx + rx, sy + ry)]
+                length = math.pi / 2
+                options.append(Primitive(
+                    "arc", h, (h + turn) % N_HEADINGS, sx + rx, sy + ry, swept,
+                    length, turn * 45.0, model.drive_time(length * unit_size),
+                ))
+
+        primitives.append(options)
+
+    _primitive_cache[key] = primitives
+    return primitives
+
+
+def primitives_key(model, unit_size, max_run, allow_reverse):
+    """Hash the time model and primitive parameters, used as a cache key.
+
+    Returns:
+        str: hex digest identifying the primitive set
+    """
+    h = hashlib.sha1()
+    h.update(repr((sorted(vars(model).items()), unit_size, max_run, allow_reverse)).encode())
+    return h.hexdigest()[:16]
+
+
+class LatticePlanner:
+    """Minimum-time planner over (x, y, heading) states.
+
+    Constructor Arguments:
+        cells: occupancy grid indexed cells[y][x], where cells < 0 are obstacles
+        model: time model to cost primitives with, see robot.compiler.TimeModel
+        unit_size: the size of one grid cell, in drive units
+        costmap: clearance costs, cells it marks impassable are avoided too
+        max_run: longest straight run as a single primitive, in cells
+        allow_reverse: plan reverse runs, defaults to True
+        heuristic_radius: half-width in cells of the free-space heuristic table
+        cache_dir: directory to cache the heuristic table in, None to disable caching
+
+    Methods:
+        set_map: replace the occupancy grid
+        heuristic: lower bound on the time from a state to the goal
+        plan: find the quickest sequence of primitives between two poses
+    """
+
+    def __init__(self, cells, model, unit_size=1, costmap=None, max_run=4, allow_reverse=True, heuristic_radius=10, cache_dir=CACHE_PATH):
+        self.model = model
+        self.unit_size = unit_size
+        self.primitives = build_primitives(model, unit_size, max_run, allow_reverse)
+        self.key = primitives_key(model, unit_size, max_run, allow_reverse)
+
+        self.radius = heuristic_radius
+        self.table = self._load_heuristic_table(cache_dir)
+
+        self.set_map(cells, costmap)
+
+    def set_map(self, cells, costmap=None):
+        """Replace the occupancy grid, e.g. after new obstacles are found.
+
+        Args:
+            cells (list): occupancy grid indexed cells[y][x]
+            costmap (Costmap, optional): clearance costs, cells it marks impassable are avoided
+        """
+        self.blocked = np.asarray(cells) < 0
+        if costmap is not None:
+            self.blocked = self.blocked | ~np.isfinite(costmap.cost)
+        self.height, self.width = self.blocked.shape
+
+    def _load_heuristic_table(self, cache_dir):
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, f"lattice_heuristic_{self.key}_{self.radius}.npy")
+
+        if path and os.path.exists(path):
+            logging.debug(f"Loaded lattice heuristic {self.key} from cache")
+            return np.load(path)
+
+        table = self._build_heuristic_table()
+
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(path, table)
+            logging.debug(f"Cached lattice heuristic {self.key} to {path}")
+
+        return table
+
+    def _build_heuristic_table(self):
+        """Exact time to reach the centre cell, at any heading, in obstacle-free space.
+
+        Dijkstra runs backwards from the goal over the primitive graph within the table window.
+
+        Returns:
+            np.ndarray: times indexed [heading][dy + radius][dx + radius], where (dx, dy)
+                is the offset of a state from the goal, inf if unreachable within the window
+        """
+        r = self.radius
+        size = 2 * r + 1
+
+        # predecessors of each state, found by applying every primitive forwards
+        predecessors = {}
+        for y in range(-r, r + 1):
+            for x in range(-r, r + 1):
+                for h in range(N_HEADINGS):
+                    for p in self.primitives[h]:
+                        x_, y_ = x + p.dx, y + p.dy
+                        if abs(x_) <= r and abs(y_) <= r:
+                            predecessors.setdefault((x_, y_, p.end_heading), []).append(((x, y, h), p.time))
+
+        table = np.full((N_HEADINGS, size, size), np.inf)
+        open_list = [(0.0, (0, 0, h)) for h in range(N_HEADINGS)]
+        for h in range(N_HEADINGS):
+            table[h, r, r] = 0.0
+
+        while open_list:
+            cost, (x, y, h) = heapq.heappop(open_list)
+            if cost > table[h, y + r, x + r]:
+                continue
+            for (x_, y_, h_), time in predecessors.get((x, y, h), []):
+                if cost + time < table[h_, y_ + r, x_ + r]:
+                    table[h_, y_ + r, x_ + r] = cost + time
+                    heapq.heappush(open_list, (cost + time, (x_, y_, h_)))
+
+        return table
+
+    def heuristic(self, state, goal):
+        """Lower bound on the time from a state to the goal cell.
+
+        Args:
+            state (tuple): (x, y, heading index)
+            goal (tuple): (x, y) of the goal cell
+
+        Returns:
+            float: time in seconds
+        """
+        x, y, h = state
+        dx, dy = x - goal[0], y - goal[1]
+
+        if abs(dx) <= self.radius and abs(dy) <= self.radius:
+            return self.table[h, dy + self.radius, dx + self.radius]
+
+        # beyond the table, straight-line distance at cruising speed
+        return math.hypot(dx, dy) * self.unit_size / self.model.drive_speed
+
+    def _free(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and not self.blocked[y, x]
+
+    def plan(self, start, goal, start_heading=0, goal_heading=None):
+        """Find the quickest sequence of primitives between two poses.
+
+        Args:
+            start (tuple): (x, y) of the start cell
+            goal (tuple): (x, y) of the goal cell
+            start_heading (float, optional): heading at the start in degrees, defaults to 0 (North)
+            goal_heading (float, optional): heading required at the goal in degrees,\
+                defaults to None for any heading
+
+        Returns:
+            list: primitives to perform in order, None if the goal is unreachable
+        """
+        start_state = (start[0], start[1], heading_index(start_heading))
+        goal = tuple(goal)
+        goal_h = None if goal_heading is None else heading_index(goal_heading)
+
+        g = {start_state: 0.0}
+        came_from = {start_state: None}
+        counter = 0  # tie-breaker, so states themselves are never compared
+        open_list = [(self.heuristic(start_state, goal), counter, start_state)]
+        closed = set()
+
+        while open_list:
+            _, _, state = heapq.heappop(open_list)
+            if state in closed:
+                continue
+            closed.add(state)
+
+            x, y, h = state
+            if (x, y) == goal and (goal_h is None or h == goal_h):
+                steps = []
+                while came_from[state] is not None:
+                    state, p = came_from[state]
+                    steps.append(p)
+                return steps[::-1]
+
+            for p in self.primitives[h]:
+                if not all(self._free(x + sx, y + sy) for sx, sy in p.swept):
+                    continue
+
+                successor = (x + p.dx, y + p.dy, p.end_heading)
+                cost = g[state] + p.time
+                if cost < g.get(successor, math.inf):
+                    g[successor] = cost
+                    came_from[successor] = (state, p)
+                    counter += 1
+                    heapq.heappush(open_list, (cost + self.heuristic(successor, goal), counter, successor))
+
+        logging.warning(f"No lattice path from {start} to {goal}")
+        return None
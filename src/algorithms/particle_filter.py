@@ -0,0 +1,254 @@
+"""Monte Carlo localisation (particle filter) over the occupancy grid.
+
+Particles are kept as flat NumPy arrays so that prediction, ray casting and
+resampling are each a handful of vectorised operations, cheap enough to run
+after every ultrasonic reading on the Raspberry Pi.
+
+Coordinates are in grid cells, with cell (x, y) centred on integer coordinates
+and indexed as cells[y][x]. Headings are in degrees, 0 facing map North
+(decreasing y) and increasing clockwise, matching robot.drive.calculate_angle.
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from algorithms.distance_map import CACHE_PATH, DistanceMap
+
+
+class ParticleFilter:
+    """Particle filter tracking the robot pose against an occupancy grid.
+
+    Constructor Arguments:
+        cells: occupancy grid, any cell < 0 is treated as an obstacle
+        n_particles: number of particles to track
+        cell_size_cm: physical size of one grid cell in centimetres
+        max_range_cm: furthest range the ultrasonic sensor reports, beyond which it returns -1
+        step: ray marching step in cells
+        use_tables: look expected ranges up in precomputed DistanceMap tables instead of ray marching
+
+    Methods:
+        initialise: scatter particles around a known pose
+        initialise_uniform: scatter particles over every free cell
+        predict: propagate particles through the spin/drive motion model
+        update: weight particles by a range measurement, resampling if needed
+        estimate: return the mean pose and its spread
+    """
+
+    def __init__(self, cells, n_particles=2000, cell_size_cm=50.0, max_range_cm=60.0, step=0.05, use_tables=False, seed=None):
+        self.n_particles = n_particles
+        self.cell_size_cm = cell_size_cm
+        self.max_range_cm = max_range_cm
+        self.max_range = max_range_cm / cell_size_cm  # in cells
+
+        # motion noise, as fractions of the commanded motion plus a constant floor
+        self.drive_noise = 0.1
+        self.spin_noise = 0.1
+        self.spin_noise_floor = 2.0  # degrees
+        self.drift_noise = 0.05  # cells of sideways slip per cell driven
+
+        # sensor model
+        self.range_sigma_cm = 5.0
+        self.p_random = 0.05    # chance of a spurious echo anywhere in range
+        self.p_no_echo = 0.2    # chance of no valid echo when an obstacle is in range
+
+        self.rng = np.random.default_rng(seed)
+
+        # distances sampled along each ray, shared by all particles
+        self.steps = np.arange(0.0, self.max_range + step, step)
+
+        self.use_tables = use_tables
+        self.distance_map = None
+
+        self.x = np.zeros(n_particles)
+        self.y = np.zeros(n_particles)
+        self.heading = np.zeros(n_particles)
+        self.weights = np.full(n_particles, 1.0 / n_particles)
+
+        self.set_map(cells)
+
+    def set_map(self, cells):
+        """Replace the occupancy grid, e.g. after new obstacles are found.
+
+        Args:
+            cells (list): occupancy grid, indexed cells[y][x]
+        """
+        grid = np.asarray(cells)
+        self.occupied = grid < 0
+        self.height, self.width = self.occupied.shape
+
+        if self.use_tables:
+            # trace slightly past max range, so rays with no hit still read as out of range.
+            # Only the starting map is cached to disk, maps edited at run time are rarely seen again
+            self.distance_map = DistanceMap(
+                self.occupied, max_range=self.steps[-1] + self.steps[1],
+                cache_dir=CACHE_PATH if self.distance_map is None else None,
+            )
+
+    def initialise(self, x, y, heading, position_sigma=0.1, heading_sigma=5.0):
+        """Scatter particles around a known pose.
+
+        Args:
+            x (float): x coordinate in cells
+            y (float): y coordinate in cells
+            heading (float): heading in degrees
+            position_sigma (float): standard deviation of position in cells
+            heading_sigma (float): standard deviation of heading in degrees
+        """
+        n = self.n_particles
+        self.x = x + self.rng.normal(0.0, position_sigma, n)
+        self.y = y + self.rng.normal(0.0, position_sigma, n)
+        self.heading = heading + self.rng.normal(0.0, heading_sigma, n)
+        self.weights = np.full(n, 1.0 / n)
+
+    def initialise_uniform(self):
+        """Scatter particles uniformly over every free cell, with random headings.
+
+        Used for global relocalisation once the pose estimate has been lost.
+        """
+        free_y, free_x = np.nonzero(~self.occupied)
+        if len(free_x) == 0:
+            raise ValueError("no free cells to localise in")
+
+        n = self.n_particles
+        picks = self.rng.integers(0, len(free_x), n)
+        self.x = free_x[picks] + self.rng.uniform(-0.5, 0.5, n)
+        self.y = free_y[picks] + self.rng.uniform(-0.5, 0.5, n)
+        self.heading = self.rng.uniform(0.0, 360.0, n)
+        self.weights = np.full(n, 1.0 / n)
+
+    def predict(self, distance, delta_angle):
+        """Propagate particles by a spin followed by a straight drive.
+
+        Args:
+            distance (float): distance driven in cells, negative for reverse
+            delta_angle (float): angle spun in degrees, positive clockwise
+        """
+        n = self.n_particles
+
+        if delta_angle != 0:
+            sigma = self.spin_noise * abs(delta_angle) + self.spin_noise_floor
+            self.heading += delta_angle + self.rng.normal(0.0, sigma, n)
+
+        if distance != 0:
+            travelled = distance * (1.0 + self.rng.normal(0.0, self.drive_noise, n))
+            slip = self.rng.normal(0.0, self.drift_noise * abs(distance), n)
+
+            rad = np.radians(self.heading)
+            sin, cos = np.sin(rad), np.cos(rad)
+            self.x += sin * travelled + cos * slip
+            self.y += -cos * travelled + sin * slip
+
+        self.heading %= 360.0
+
+        # particles that drove into walls or off the map are implausible
+        self.weights[~self._in_free_space(self.x, self.y)] = 0.0
+        self._normalise()
+
+    def expected_range(self, x, y, heading):
+        """Ray cast from each pose to the first obstacle, in a single vectorised pass.
+
+        Args:
+            x (np.ndarray): x coordinates in cells
+            y (np.ndarray): y coordinates in cells
+            heading (np.ndarray): headings in degrees
+
+        Returns:
+            np.ndarray: distance to the nearest obstacle in cells, capped at just beyond max range
+        """
+        if self.distance_map:
+            return self.distance_map.expected_range(x, y, heading)
+
+        rad = np.radians(heading)
+        px = x[:, None] + np.sin(rad)[:, None] * self.steps
+        py = y[:, None] - np.cos(rad)[:, None] * self.steps
+
+        hit = ~self._in_free_space(px, py)
+
+        # argmax finds the first hit along each ray, rays with no hit run past max range
+        first = np.argmax(hit, axis=1)
+        ranges = self.steps[first]
+        ranges[~hit.any(axis=1)] = self.steps[-1] + self.steps[1]
+        return ranges
+
+    def update(self, distance_cm):
+        """Weight particles by an ultrasonic range measurement.
+
+        Args:
+            distance_cm (float): measured range in cm, or -1 if no valid echo was received
+
+        Returns:
+            float: effective sample size after weighting
+        """
+        expected_cm = self.expected_range(self.x, self.y, self.heading) * self.cell_size_cm
+
+        if distance_cm < 0:
+            # no echo, likely nothing within range
+            likelihood = np.where(expected_cm > self.max_range_cm, 1.0, self.p_no_echo)
+        else:
+            error = (distance_cm - expected_cm) / self.range_sigma_cm
+            likelihood = np.exp(-0.5 * error * error) + self.p_random
+
+        self.weights *= likelihood
+        self._normalise()
+
+        n_eff = 1.0 / np.sum(self.weights ** 2)
+        if n_eff < self.n_particles / 2:
+            self.resample()
+
+        return n_eff
+
+    def resample(self):
+        """Low-variance (systematic) resampling, O(n) with a single random draw."""
+        n = self.n_particles
+        positions = (self.rng.uniform() + np.arange(n)) / n
+        cumulative = np.cumsum(self.weights)
+        cumulative[-1] = 1.0  # guard against rounding error
+        indexes = np.searchsorted(cumulative, positions)
+
+        self.x = self.x[indexes]
+        self.y = self.y[indexes]
+        self.heading = self.heading[indexes]
+        self.weights = np.full(n, 1.0 / n)
+
+    def estimate(self):
+        """Return the weighted mean pose and its spread.
+
+        Returns:
+            tuple: x, y (cells), heading (degrees) and position standard deviation (cells)
+        """
+        x = np.average(self.x, weights=self.weights)
+        y = np.average(self.y, weights=self.weights)
+
+        rad = np.radians(self.heading)
+        heading = math.degrees(
+            math.atan2(
+                np.average(np.sin(rad), weights=self.weights),
+                np.average(np.cos(rad), weights=self.weights),
+            )
+        ) % 360.0
+
+        spread = math.sqrt(
+            np.average((self.x - x) ** 2 + (self.y - y) ** 2, weights=self.weights)
+        )
+
+        return float(x), float(y), heading, spread
+
+    def _in_free_space(self, x, y):
+        ix = np.rint(x).astype(int)
+        iy = np.rint(y).astype(int)
+        inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+
+        free = np.zeros(ix.shape, dtype=bool)
+        free[inside] = ~self.occupied[iy[inside], ix[inside]]
+        return free
+
+    def _normalise(self):
+        total = self.weights.sum()
+        if total <= 0 or not np.isfinite(total):
+            # every particle is implausible, the robot has been kidnapped (or bumped)
+            logging.warning("Particle filter lost track, relocalising over free space")
+            self.initialise_uniform()
+        else:
+            self.weights /= total
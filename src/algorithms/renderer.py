@@ -0,0 +1,114 @@
+"""Incremental rendering of a D* Lite grid, redrawing only the cells that changed.
+
+A frame buffer holds the label last drawn in each cell. Each update relabels
+only the cells D* Lite reported changed (see Grid.changed) and the cells the
+markers moved to or from, so its cost follows the number of changes rather
+than the size of the map. Changes are returned as (x, y, label) deltas, e.g.
+for the web UI, and `draw` writes them to a terminal as ANSI cursor moves.
+"""
+
+import sys
+
+from algorithms.d_star_lite import stateNameToCoords
+
+OBSTACLE = "#"
+UNKNOWN = "-"
+
+
+class GridRenderer:
+    """Keep a rendered copy of a grid up to date, one changed cell at a time.
+
+    Constructor Arguments:
+        graph: the Grid being planned over
+        values: label free cells with their g value (rounded), rather than 0
+        width: characters per cell on the console
+        stream: text stream the console rendering is written to
+
+    Methods:
+        update: relabel changed cells, returning the (x, y, label) deltas
+        frame: every row of the frame buffer, for new viewers
+        draw: update and write the changes to the console as ANSI cursor moves
+    """
+
+    def __init__(self, graph, values=False, width=3, stream=sys.stdout):
+        self.graph = graph
+        self.values = values
+        self.width = width
+        self.stream = stream
+
+        self.buffer = None  # labels last rendered, indexed [y][x]
+        self.markers = {}  # (x, y) of the start, goal and current cells, to their symbols
+
+    def label(self, x, y):
+        if (x, y) in self.markers:
+            return self.markers[(x, y)]
+
+        cell = self.graph.cells[y][x]
+        if cell < 0:
+            return OBSTACLE
+        if not self.values:
+            return str(cell)
+
+        g = self.graph.graph["x" + str(x) + "y" + str(y)].g
+        return UNKNOWN if g == float("inf") else str(round(g))
+
+    def update(self, start, goal, current):
+        """Relabel the cells that changed since the last update.
+
+        Args:
+            start (str): start node, drawn as S
+            goal (str): goal node, drawn as E
+            current (str): node the robot is in, drawn as X
+
+        Returns:
+            list: (x, y, label) of each cell whose label changed, every cell on the first update
+        """
+        markers = {}
+        for name, symbol in ((start, "S"), (goal, "E"), (current, "X")):
+            markers[tuple(stateNameToCoords(name))] = symbol  # later markers drawn on top
+
+        dirty = {tuple(stateNameToCoords(name)) for name in self.graph.changed}
+        self.graph.changed.clear()
+        dirty.update(self.markers, markers)
+        self.markers = markers
+
+        if self.buffer is None:
+            self.buffer = [[None] * len(row) for row in self.graph.cells]
+            dirty = {(x, y) for y, row in enumerate(self.graph.cells) for x in range(len(row))}
+
+        changes = []
+        for x, y in sorted(dirty, key=lambda cell: (cell[1], cell[0])):
+            label = self.label(x, y)
+            if label != self.buffer[y][x]:
+                self.buffer[y][x] = label
+                changes.append((x, y, label))
+        return changes
+
+    def frame(self):
+        return ["".join(f"{label:>{self.width}}"[-self.width:] for label in row) for row in self.buffer or []]
+
+    def draw(self, start, goal, current):
+        """Update and redraw only the changed cells on the console.
+
+        The first call clears the screen and draws the whole grid, later calls
+        move the cursor to each changed cell, then back below the grid.
+
+        Returns:
+            list: the (x, y, label) deltas drawn
+        """
+        first = self.buffer is None
+        changes = self.update(start, goal, current)
+
+        if first:
+            output = "\x1b[2J\x1b[H" + "\n".join(self.frame())
+        else:
+            # ANSI rows and columns count from 1
+            output = "".join(
+                f"\x1b[{y + 1};{x * self.width + 1}H" + f"{label:>{self.width}}"[-self.width:]
+                for x, y, label in changes
+            )
+        output += f"\x1b[{len(self.buffer) + 1};1H"
+
+        self.stream.write(output)
+        self.stream.flush()
+        return changes
@@ -8,15 +8,32 @@ import time
 from os.path import abspath, dirname
 
 import ThunderBorg3 as ThunderBorg  # conversion for python 3
-from algorithms.algorithm import D_Star_Lite, Graph, Grid, Node
-from hcsr04 import HCSR04
+from algorithms.algorithm import D_Star_Lite, Graph, Grid, GridRenderer, Node
+from algorithms.costmap import Costmap
+from algorithms.particle_filter import ParticleFilter
+from hcsr04 import HCSR04, Ranger
+from i2cbus import BusManager, LinuxBus
 from mpu6050 import MPU6050
+from profiler import phase, profile, profiler
 from robot.accelerometer import perform_drive
+from robot.battery import BatteryMonitor
+from robot.calibration import load_calibration
+from robot.compiler import TimeModel, choose_direction
+from robot.door import DoorInspector
 from robot.drive import calculate_angle, follow, pathing
-from robot.gyroscope import perform_spin
+from robot.gyroscope import perform_spin, smallestAngle
+from robot.health import HealthMonitor
+from robot.pipeline import MotionQueue, PlannerWorker
+from vision import GroundProjection, ObstacleWorker, PiCameraCapture
+
+# Share the I2C bus between the ThunderBorg and MPU6050, motor commands first
+bus = BusManager(LinuxBus(1))
+bus.setName("I2C")
+bus.start()
 
 # Setup the ThunderBorg
 TB = ThunderBorg.ThunderBorg()
+TB.busManager = bus
 
 i2cAddress = TB.i2cAddress
 
@@ -57,14 +74,26 @@ setup_logger('mpu6050', r'mpu6050.log')
 setup_logger('hcsr04', r'hcsr04.log')
 setup_logger('d_star', r'd_star.log')
 setup_logger('velocity', r'velocity.log')
+setup_logger('battery', r'battery.log')
+setup_logger('health', r'health.log')
+setup_logger('vision', r'vision.log')
+setup_logger('door', r'door.log')
+setup_logger('profile', r'profile.log')
+setup_logger('planner', r'planner.log')
 
 mpu6050_log = logging.getLogger('mpu6050')
 hcsr04_log = logging.getLogger('hcsr04')
 d_star_log = logging.getLogger('d_star')
 velocity_log = logging.getLogger('velocity')
+battery_log = logging.getLogger('battery')
+health_log = logging.getLogger('health')
+vision_log = logging.getLogger('vision')
+door_log = logging.getLogger('door')
+profile_log = logging.getLogger('profile')
+planner_log = logging.getLogger('planner')
 
 # initialise mpu6050 thread
-mpu = MPU6050(rotation_log=mpu6050_log, velocity_log=velocity_log)
+mpu = MPU6050(rotation_log=mpu6050_log, velocity_log=velocity_log, bus=bus, fifo=True)
 mpu.setName("MPU6050")
 mpu.start()
 
@@ -73,22 +102,36 @@ hcsr = HCSR04(
     trigger=12, echo=24, echo_timeout_ns=3000000000, logger=hcsr04_log
 )  # timeout 3 seconds (in nanoseconds)
 
-def main(TB, mpu, d_star_log, hcsr04_log, mpu6050_log, velocity_log):
-    # Power settings
-    VOLTAGE_IN = 12.0  # Total battery voltage to the ThunderBorg
+# range continuously in the background, instead of a fresh burst before every move
+ranger = Ranger(hcsr)
+ranger.setName("HCSR04")
+ranger.start()
 
-    # NOTE: limiter has lower bound to power motors, ~0.4 experimental lower bound
-    LIMITER = 1  # utilise only <limiter>% of power, to slow down actions
+SETTLE_NS = 100000000  # ignore ranger samples for 0.1s after the robot stops moving
+SNAPSHOT_EVERY = 0  # print and log the grid's g-values every N steps, 0 for never
+RENDER_CONSOLE = False  # redraw the cells that changed on the console every step, for watching a mission live
 
-    VOLTAGE_OUT = (
-        12.0 * LIMITER
-    )  # Maximum motor voltage, we limit it to 95% to allow the RPi to get uninterrupted power
+# track the pack voltage, so motor power can be raised to keep speeds constant as it drains
+battery = BatteryMonitor(TB, load_calibration(), logger=battery_log)
 
-    # Setup the power limits
-    if VOLTAGE_OUT > VOLTAGE_IN:
-        max_power = 1.0
-    else:
-        max_power = VOLTAGE_OUT / float(VOLTAGE_IN)
+# poll motor faults and the battery, and watch for stalls, stopping motions as soon as one is seen
+health = HealthMonitor(TB, mpu, battery, logger=health_log)
+health.setName("Health")
+health.start()
+
+# classify the cells ahead from the camera, so obstacles are found cells before the ultrasonic sensor reaches them
+camera = PiCameraCapture()
+vision = ObstacleWorker(camera, GroundProjection(), logger=vision_log)
+vision.setName("Vision")
+vision.start()
+
+# classify doors against what each looked like on earlier visits, stopping as soon as the evidence is decisive
+inspector = DoorInspector(ranger, camera, logger=door_log)
+
+def main(TB, mpu, d_star_log, hcsr04_log, mpu6050_log, velocity_log):
+    # power limits, spin/drive powers and motor balance all come from the calibration,
+    # see robot.calibration to fit them, and are compensated for the battery voltage
+    max_power = battery.max_power
 
     print("1")
 
@@ -102,27 +145,73 @@ def main(TB, mpu, d_star_log, hcsr04_log, mpu6050_log, velocity_log):
         unit_size = data['unit_size']
         s_current = data['start']
 
+    vision.cell_size = unit_size
+
+    # walls in the map, as opposed to obstacles found during the mission, which may be reopened
+    walls = {(x, y) for y, row in enumerate(input_matrix) for x, cell in enumerate(row) if cell < 0}
+
     print("2")
 
-    for instruction in instructions:
+    curr_angle = 0
+    profiler.reset()  # time this mission only
+
+    for i, instruction in enumerate(instructions):
         s_goal = instruction['goal']
         final_rotation = instruction['final_rotation']
 
-        s_current = navigate(input_matrix, s_current, s_goal, TB, mpu, unit_size, max_power, d_star_log, hcsr04_log, mpu6050_log, velocity_log)
-        time.sleep(0.3)
-        perform_spin(final_rotation, 270, TB, mpu, max_power, mpu6050_log)  # perform spin from 0 to N degrees
-
-        if door_state_closed():
+        # estimate the rest of the mission from the grid distance between goals
+        remaining = 0
+        s_from = s_current
+        for leg in instructions[i:]:
+            x, y = D_Star_Lite().stateNameToCoords(s_from)
+            x_, y_ = D_Star_Lite().stateNameToCoords(leg['goal'])
+            remaining += (abs(x_ - x) + abs(y_ - y)) * unit_size
+            s_from = leg['goal']
+        drive_time, battery_time = battery.remaining_time(remaining)
+        logging.info(f"Remaining mission: {remaining} units, drive time {drive_time}s, battery time {battery_time}s")
+
+        # finish each leg facing the door, and start the next leg from there instead of
+        # spinning back to North in between
+        with phase("navigate"):
+            s_current, curr_angle = navigate(
+                input_matrix, s_current, s_goal, TB, mpu, unit_size, max_power, d_star_log, hcsr04_log, mpu6050_log, velocity_log,
+                curr_angle=curr_angle, final_heading=final_rotation, walls=walls
+            )
+        with phase("settle"):
+            time.sleep(0.3)
+
+        door = instruction.get('door', f"{s_goal}_{final_rotation}")  # the same door on every visit
+        with phase("inspect_door"):
+            closed = inspector.inspect(door, time.time_ns() + SETTLE_NS)
+        if closed:
             logging.info("Door is closed")
         else:
             logging.info("Door is open")
-        
-        perform_spin(-final_rotation, 0, TB, mpu, max_power, mpu6050_log)  # perform spin from N to 0 degrees
 
+    # per-phase breakdown, and collapsed stacks for a flame graph, of where the mission's time went
+    profile_log.info("\n" + profiler.summary())
+    profiler.export("profile.folded")
+
+
+def navigate(input_matrix, s_start, s_goal, TB, mpu, unit_size, max_power, d_star_log, hcsr04_log, mpu6050_log, velocity_log, curr_angle=0, final_heading=None, walls=None):
+    """Drive from the start node to the goal node, replanning around obstacles as they are found.
+
+    Args:
+        curr_angle (float, optional): heading the robot starts at, defaults to 0 (North)
+        final_heading (float, optional): heading to finish facing, defaults to None\
+            which leaves the robot facing along its last move
+        walls (set, optional): (x, y) cells that are walls in the map, so never reopened,\
+            defaults to every obstacle in input_matrix
+
+    Returns:
+        tuple: the node reached and the heading the robot finished facing
+    """
+    if walls is None:
+        walls = {(x, y) for y, row in enumerate(input_matrix) for x, cell in enumerate(row) if cell < 0}
 
-def navigate(input_matrix, s_start, s_goal, TB, mpu, unit_size, max_power, d_star_log, hcsr04_log, mpu6050_log, velocity_log):    
     graph = Grid(len(input_matrix), len(input_matrix[0]))
-    d_star_lite = D_Star_Lite()
+    # stream the work done by each replan, to see how incremental the repairs are
+    d_star_lite = D_Star_Lite(telemetry=lambda stats: planner_log.debug(json.dumps(stats.as_dict())))
 
     logging.info("Created D* and Grid")
 
@@ -134,10 +223,13 @@ def navigate(input_matrix, s_start, s_goal, TB, mpu, unit_size, max_power, d_sta
     graph.setStart(s_start)
     graph.setGoal(s_goal)
 
+    # weight edges by clearance, so paths keep away from walls
+    costmap = Costmap(graph.cells)
+    graph.applyCostmap(costmap)
+
     logging.info(f"Start: {s_start}, Goal: {s_goal}")
 
     k_m = 0
-    s_last = s_start
     queue = []
     graph, queue, k_m = d_star_lite.initDStarLite(graph, queue, s_start, s_goal, k_m)
     s_current = s_start
@@ -148,66 +240,275 @@ def navigate(input_matrix, s_start, s_goal, TB, mpu, unit_size, max_power, d_sta
         max_dim = len(input_matrix[0])
     
     d_star_lite.updateObsticles(graph, queue, s_current, k_m, max_dim)
-    curr_angle = 0
-    s_new = None
+
+    # track pose against the map, so bumps and mis-estimated spins can be recovered from
+    localiser = ParticleFilter(graph.cells, cell_size_cm=unit_size * 100, use_tables=True)
+    localiser.initialise(pos_coords[0], pos_coords[1], curr_angle)
+    vision.pose = (pos_coords[0], pos_coords[1], curr_angle)
     #logging.info("Initialised D*")
 
     d_star_lite.computeShortestPath(graph, queue, s_current, k_m)
-    g = graph.printGValues(s_start, s_goal, s_current)
-    d_star_log.debug(g)
-    d_star_log.debug('------')
+    snapshot(graph, s_start, s_goal, s_current, 0)
     #logging.info("Found initial shortest path")
 
-    while s_new != s_goal:
+    # sensing, planning and driving each run on their own thread, so a cell costs
+    # roughly its slowest stage rather than the sum of them all
+    planner = PlannerWorker(graph, queue, d_star_lite, k_m, s_start, d_star_log)
+    planner.setName("Planner")
+    planner.start()
+
+    motion = MotionQueue()
+    motion.setName("Motion")
+    motion.start()
+    health.cancel.append(motion.cancel)  # faults and stalls stop the running motion
+
+    planner.replan(s_current)
+    facing_since = time.time_ns()
+
+    # cells already driven through are known free, so may be reversed into blind
+    visited = {s_current}
+    model = TimeModel.from_calibration(load_calibration(), max_power)
+    step = 0
+    renderer = GridRenderer(graph) if RENDER_CONSOLE else None
+
+    while s_current != s_goal:
         #TB.SetLeds(1.0, 1.0, 1.0)
-        s_new, x_, y_, distance, curr_angle = scan_next(max_power, graph, d_star_lite, s_current, curr_angle, mpu6050_log)
+        max_power = battery.max_power  # compensate for the battery draining during the mission
+        with phase("wait_planner"):
+            s_new = planner.next_step()
+
+        # replan around cells the camera has seen blocked, before turning towards any of them
+        seen = [
+            (x, y) for x, y in vision.obstacles()
+            if 0 <= y < len(graph.cells) and 0 <= x < len(graph.cells[0]) and graph.cells[y][x] >= 0
+            and "x" + str(x) + "y" + str(y) not in visited and "x" + str(x) + "y" + str(y) != s_goal
+        ]
+        if seen:
+            with phase("add_obstacles"):
+                add_obstacles(graph, queue, d_star_lite, planner, costmap, localiser, s_current, seen)
+            planner.replan(s_current)
+            continue
+
+        # reopen cells blocked during the mission that the camera has since seen free
+        freed = [
+            (x, y) for x, y in vision.free_cells()
+            if 0 <= y < len(graph.cells) and 0 <= x < len(graph.cells[0]) and graph.cells[y][x] < 0
+            and (x, y) not in walls
+        ]
+        if freed:
+            with phase("clear_obstacles"):
+                clear_obstacles(graph, queue, d_star_lite, planner, costmap, localiser, s_current, freed)
+            planner.replan(s_current)
+            continue
+
+        vision.pose = None  # frames taken mid-spin do not match any heading
+        x_, y_, distance, curr_angle, facing_since, direction = scan_next(
+            max_power, d_star_lite, s_current, s_new, curr_angle, mpu6050_log, motion, facing_since, localiser,
+            reversible=s_new in visited, model=model, unit_size=unit_size
+        )
+        vision.pose = (*d_star_lite.stateNameToCoords(s_current), curr_angle)
+
+        if recover(health.events(), motion):
+            planner.replan(s_current)  # the spin was stopped short, curr_angle is where it got to
+            continue
 
         # logical bounds checking
         if distance < 40 and distance != -1 and s_new != s_goal:
             #TB.SetLeds(1.0, 0.0, 0.0)
-            s_new = s_current
-            graph.cells[y_][x_] = -2
-            d_star_lite.updateObsticles(graph, queue, s_current, k_m, 2)
+            add_obstacle(graph, queue, d_star_lite, planner, costmap, localiser, s_current, x_, y_)
+            planner.replan(s_current)
             #logging.info(f"Found obstacle at {x_},{y_}")
 
         else:
             #TB.SetLeds(0.0, 1.0, 0.0)
             #logging.info(f"Moving to {x_}, {y_}")
-            time.sleep(0.2)
-            perform_drive(unit_size, TB, mpu, max_power, velocity_log)
-            s_current = s_new  # update current position with new position
-            
-        graph.printGrid(s_start, s_goal, s_current)
-        # position of these two lines will need testing
-        k_m += d_star_lite.heuristic_from_s(graph, s_last, s_new)
-        d_star_lite.computeShortestPath(graph, queue, s_current, k_m)
-        d_star_lite.updateObsticles(graph, queue, s_current, k_m, 2)
+            drive_start = time.time_ns()
+            vision.pose = None
+            motion.submit(perform_drive, (direction * unit_size, TB, mpu, max_power, velocity_log))
+
+            # plan the following cell while the motors drive to this one
+            planner.replan(s_new)
+            with phase("wait_drive"):
+                motion.wait()
+            facing_since = motion.finished_ns + SETTLE_NS
+
+            if recover(health.events(), motion):
+                # stopped short of the next cell, most likely against something the
+                # ultrasonic sensor missed, so block it (unless it is the goal) and replan from here
+                if s_new != s_goal:
+                    add_obstacle(graph, queue, d_star_lite, planner, costmap, localiser, s_current, x_, y_)
+                planner.replan(s_current)
+            else:
+                s_current = s_new  # update current position with new position
+                visited.add(s_current)
+                battery.record_drive(unit_size, (motion.finished_ns - drive_start) / 1e9)
+                localiser.predict(direction, 0)  # each drive covers a single cell
+
+        s_relocalised, curr_angle = relocalise(graph, localiser, s_current, curr_angle)
+        if s_relocalised != s_current:
+            s_current = s_relocalised
+            planner.replan(s_current)  # the last plan was made from the wrong cell
+        vision.pose = (*d_star_lite.stateNameToCoords(s_current), curr_angle)  # stationary until the next spin
+
+        step += 1
+        with planner.lock:
+            snapshot(graph, s_start, s_goal, s_current, step)
+            if renderer:
+                with phase("print"):
+                    renderer.draw(s_start, s_goal, s_current)
         print(s_current)
 
-    # once reached goal, align self to 0 degrees (map North)
-    perform_spin(curr_angle, 0, TB, mpu, max_power, mpu6050_log)
+    health.cancel.remove(motion.cancel)
+    vision.pose = None
+    planner.terminated = True
+    motion.terminated = True
+    planner.join()
+    motion.join()
+    planner_log.info(f"{s_start} -> {s_goal}: {d_star_lite.snapshot()}")
+
+    # once reached goal, turn to the final heading the shortest way round
+    if final_heading is not None:
+        delta_angle = smallestAngle(curr_angle, final_heading)
+        if delta_angle != 0:
+            perform_spin(delta_angle, final_heading, TB, mpu, max_power, mpu6050_log)
+        curr_angle = final_heading
     #TB.SetLeds(1.0, 1.0, 1.0)
     #logging.info("Found goal!")
 
-    return s_current
+    return s_current, curr_angle
 
 
-def smallestAngle(currentAngle, targetAngle):
-    # Subtract the angles, constraining the value to [0, 360)
-    diff = ( targetAngle - currentAngle) % 360
+def snapshot(graph, s_start, s_goal, s_current, step):
+    """Print and log the grid's g-values, if the step is sampled, see SNAPSHOT_EVERY.
 
-    # If we are more than 180 we're taking the long way around.
-    # Let's instead go in the shorter, negative direction
-    if diff > 180 :
-        diff = -(360 - diff)
+    Args:
+        step (int): steps taken so far this leg
+    """
+    if not SNAPSHOT_EVERY or step % SNAPSHOT_EVERY:
+        return
+
+    with phase("print"):
+        g = graph.printGValues(s_start, s_goal, s_current)
+    d_star_log.debug(g)
+    d_star_log.debug('------')
+
+
+def add_obstacle(graph, queue, d_star_lite, planner, costmap, localiser, s_current, x, y):
+    """Mark a cell as an obstacle, updating the planner, costmap and localiser."""
+    add_obstacles(graph, queue, d_star_lite, planner, costmap, localiser, s_current, [(x, y)])
+
+
+def add_obstacles(graph, queue, d_star_lite, planner, costmap, localiser, s_current, cells):
+    """Mark several cells as obstacles at once, such as those seen by the camera.
+
+    Args:
+        cells (list): (x, y) coordinates of the cells, which may be several cells away
+    """
+    x0, y0 = d_star_lite.stateNameToCoords(s_current)
+    scan_range = max(2, max(abs(x - x0) + abs(y - y0) for x, y in cells) + 1)
 
-    return diff
+    with planner.lock:
+        for x, y in cells:
+            graph.cells[y][x] = -2
+        d_star_lite.updateObsticles(graph, queue, s_current, planner.k_m, scan_range)
+        changed = costmap.update_cells(graph.cells, cells)
+        d_star_lite.updateCosts(graph, queue, s_current, planner.k_m, costmap, changed)
+    localiser.set_map(graph.cells)
 
 
-def scan_next(max_power, graph, d_star_lite, s_current, curr_angle, mpu6050_log):
-    next_location = d_star_lite.nextInShortestPath(graph, s_current)
+def clear_obstacles(graph, queue, d_star_lite, planner, costmap, localiser, s_current, cells):
+    """Reopen cells wrongly marked as obstacles, such as those the camera has since seen free.
+
+    Args:
+        cells (list): (x, y) coordinates of the cells
+    """
+    with planner.lock:
+        for x, y in cells:
+            graph.cells[y][x] = 0
+        d_star_lite.clearObstacles(graph, queue, s_current, planner.k_m, cells)
+        changed = costmap.update_cells(graph.cells, cells)
+
+        # weight the reopened edges, into the cells and out to their neighbours, by clearance
+        for x, y in cells:
+            changed.update((x + dx, y + dy) for dx, dy in ((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)))
+        changed = {(x, y) for x, y in changed if 0 <= y < len(graph.cells) and 0 <= x < len(graph.cells[0])}
+        d_star_lite.updateCosts(graph, queue, s_current, planner.k_m, costmap, changed)
+    localiser.set_map(graph.cells)
+
+
+def recover(events, motion):
+    """Stop and recover from health events raised during a motion.
+
+    Args:
+        events (list): HealthEvent objects, see robot.health
+        motion (MotionQueue): the motion queue the events interrupted
+
+    Returns:
+        bool: whether a fault or stall interrupted the motion
+    """
+    interrupted = [event for event in events if event.kind != "battery"]
+    if not interrupted:
+        return False
+
+    motion.preempt()  # drop queued motions and clear the cancel set by the monitor
+
+    if any(event.kind == "fault" for event in interrupted):
+        # faults self-clear once the motors have stopped, see ThunderBorg.GetDriveFault1
+        time.sleep(1)
+
+    return True
+
+
+def relocalise(graph, localiser, s_current, curr_angle, max_spread=0.5):
+    """Correct the assumed pose if the localiser confidently disagrees with it.
+
+    Args:
+        graph (Grid): the grid being navigated
+        localiser (ParticleFilter): pose tracker for the robot
+        s_current (str): the node the robot believes it is in
+        curr_angle (float): the heading the robot believes it faces
+        max_spread (float): largest particle spread (in cells) trusted for a correction
+
+    Returns:
+        tuple: corrected node and heading
+    """
+    x, y, heading, spread = localiser.estimate()
+
+    if spread > max_spread:
+        return s_current, curr_angle
+
+    s_estimate = "x" + str(int(round(x))) + "y" + str(int(round(y)))
+    heading = smallestAngle(0, round(heading / 90) * 90)  # snap to a grid direction
+
+    if s_estimate in graph.graph and graph.cells[int(round(y))][int(round(x))] >= 0:
+        if s_estimate != s_current or heading != smallestAngle(0, curr_angle):
+            logging.warning(
+                f"Relocalised from {s_current} facing {curr_angle} to {s_estimate} facing {heading}"
+            )
+            return s_estimate, heading
+
+    return s_current, curr_angle
+
+
+@profile("scan_next")
+def scan_next(max_power, d_star_lite, s_current, s_next, curr_angle, mpu6050_log, motion, facing_since, localiser=None, reversible=False, model=None, unit_size=1):
+    """Face the next cell and range it, using samples from the background ranger.
+
+    If the next cell is known to be free and behind the robot, it may instead face
+    away from it and reverse in, when that is quicker than spinning round.
+
+    Args:
+        reversible (bool, optional): whether the next cell is known free, so can be reversed into
+        model (TimeModel, optional): time model used to choose between forwards and reverse
+        unit_size (float, optional): size of one cell in drive units
+
+    Returns:
+        tuple: next cell coordinates, distance to any obstacle, new heading,
+            the time from which ranger samples reflect the new heading, and the
+            drive direction (1 forwards, -1 reverse)
+    """
     current = d_star_lite.stateNameToCoords(s_current)
-    next = d_star_lite.stateNameToCoords(next_location)
+    next = d_star_lite.stateNameToCoords(s_next)
 
     #logging.info(f"Next in shortest path: {next}")
 
@@ -219,40 +520,43 @@ def scan_next(max_power, graph, d_star_lite, s_current, curr_angle, mpu6050_log)
 
     #delta_angle = target_angle - mpu.orientation   # perform spin based on exact angle
     #delta_angle = target_angle - curr_angle # perform spin based on approx angle
-    delta_angle = smallestAngle(curr_angle, target_angle)
+    # the sensor faces forwards, so only reverse into cells already known to be free
+    target_angle, delta_angle, direction = choose_direction(
+        curr_angle, target_angle, unit_size, model, allow_reverse=reversible
+    )
     
     #logging.info(
     #    f"Rotating approx {delta_angle} degrees from {mpu.orientation} degrees"
     #)
     #print("Facing " + str(target_angle) + " || Turn " + str(delta_angle))
- 
-    time.sleep(0.4)
-    
-    if delta_angle != 0:
-        perform_spin(delta_angle, target_angle, TB, mpu, max_power, mpu6050_log)
-
-    avg_distance, confidence = hcsr.get_distance()
 
-    #logging.info(
-    #    f"Average distance of {avg_distance}cm, confidence of {confidence}"
-    #)
+    if delta_angle != 0:
+        start_orientation = mpu.orientation  # only integrated while spinning, so its change is the rotation made
+        motion.submit(perform_spin, (delta_angle, target_angle, TB, mpu, max_power, mpu6050_log))
+        with phase("wait_spin"):
+            motion.wait()
+        facing_since = motion.finished_ns + SETTLE_NS  # samples taken mid-spin are meaningless
 
-    return next_location, x_, y_, avg_distance, target_angle
+        if motion.cancel.is_set():
+            # stopped short by a fault or stall, so the robot faces wherever the gyroscope says it got to,
+            # and the next scan turns the rest of the way
+            delta_angle = round(smallestAngle(start_orientation, mpu.orientation))
+            target_angle = (curr_angle + delta_angle) % 360
 
+    avg_distance, confidence = ranger.get_distance(facing_since)
 
-def door_state_closed():
-    """ Assumes agent is oriented to face door, with door being inside next cell. """
-    
-    avg_distance, confidence = hcsr.get_distance()
+    if localiser:
+        localiser.predict(0, delta_angle)
+        localiser.update(avg_distance)
 
     #logging.info(
     #    f"Average distance of {avg_distance}cm, confidence of {confidence}"
     #)
 
-    if avg_distance < 60 and avg_distance > 0:   # if obstable, then door closed
-        return True
-    else:   # no obstacle, door open
-        return False
+    if direction < 0:
+        avg_distance = -1  # ranged away from the next cell, which is already known free
+
+    return x_, y_, avg_distance, target_angle, facing_since, direction
 
 
 def healthcheck(TB):
@@ -272,7 +576,7 @@ if __name__ == "__main__":
     # enable info logging
     #logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
-    # startup healthcheck
+    # startup healthcheck, ongoing checks are made by the health monitor
     #healthcheck(TB)
 
     try:
@@ -290,7 +594,18 @@ if __name__ == "__main__":
         #TB.SetLeds(0, 0, 0)
         TB.MotorsOff()
 
-        # end sensor thread
+        # end sensor threads
+        ranger.terminated = True
+        ranger.join()
+        health.terminated = True
+        health.join()
+        vision.terminated = True
+        vision.join()
+        camera.close()
+
+        logging.info(f"I2C latency: {bus.stats()}")
+        bus.terminated = True
+        bus.join()
         mpu.join()
 
         # exit program
@@ -1 +1 @@
-from hcsr04.hcsr04 import HCSR04
\ No newline at end of file
+from hcsr04.hcsr04 import HCSR04, Ranger
\ No newline at end of file
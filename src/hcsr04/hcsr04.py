@@ -1,8 +1,12 @@
+from collections import deque
 from math import dist
+from threading import Condition, Thread
 import RPi.GPIO as GPIO
 import time
 import logging
 
+from profiler import profile
+
 class HCSR04():
     def __init__(self, trigger=12, echo=24, echo_timeout_ns=3000000000, logger=None):
         self.trigger = trigger
@@ -57,6 +61,7 @@ class HCSR04():
     def cleanup(self):
         GPIO.cleanup()  # reset pins
 
+    @profile("get_distance")
     def get_distance(self):
         if self.logger:
             self.logger.debug("-----")
@@ -90,6 +95,88 @@ class HCSR04():
         
         return avg_distance, confidence
 
+class Ranger(Thread):
+    """ Continuously pulse an HCSR04 in the background, keeping the most recent samples.
+
+    Readings are then available as soon as the robot is facing the right way,
+    rather than waiting on a fresh burst of pulses after every move.
+    """
+
+    def __init__(self, sensor, poll=0.05, history=40):
+        Thread.__init__(self)
+
+        self.sensor = sensor
+        self.poll = poll  # pause between pulses, in seconds
+
+        self.samples = deque(maxlen=history)  # (timestamp_ns, distance) pairs
+        self.new_sample = Condition()
+        self.terminated = False
+
+    def run(self):
+        self.sensor.setup()  # setup sensor and settle once, not per reading
+
+        while not self.terminated:
+            distance = self.sensor.pulse()
+            timestamp = time.time_ns()
+
+            with self.new_sample:
+                self.samples.append((timestamp, distance))
+                self.new_sample.notify_all()
+
+            time.sleep(self.poll)
+
+        self.sensor.cleanup()
+
+    def next_sample(self, since_ns=0, timeout=2.0):
+        """ Wait for the first sample taken at or after since_ns, for deciding one sample at a time.
+
+        Args:
+            since_ns (int): ignore samples taken before this time.time_ns() timestamp
+            timeout (float): longest to wait for a sample, in seconds
+
+        Returns:
+            tuple: timestamp (ns) and distance (cm, -1 on timeout) of the sample, None if none arrived
+        """
+        with self.new_sample:
+            self.new_sample.wait_for(lambda: any(t >= since_ns for t, _ in self.samples), timeout)
+            for t, d in self.samples:
+                if t >= since_ns:
+                    return t, d
+        return None
+
+    @profile("get_distance")
+    def get_distance(self, since_ns=0, N=5, timeout=2.0):
+        """ Average the first N samples taken after since_ns, filtered as in HCSR04.get_distance.
+
+        Args:
+            since_ns (int): ignore samples taken before this time.time_ns() timestamp
+            N (int): number of samples to average
+            timeout (float): longest to wait for samples, in seconds
+
+        Returns:
+            tuple: average distance in cm (-1 if no valid samples) and confidence
+        """
+        with self.new_sample:
+            self.new_sample.wait_for(
+                lambda: sum(1 for t, _ in self.samples if t >= since_ns) >= N, timeout
+            )
+            distances = [d for t, d in self.samples if t >= since_ns][:N]
+
+        valid = [d for d in distances if d <= 60 and d > 0]  # if within 0-60cm range
+
+        if valid:
+            avg_distance = round(sum(valid) / len(valid), 3)
+        else:
+            avg_distance = -1
+
+        confidence = len(valid) / float(N)
+
+        if self.sensor.logger:
+            self.sensor.logger.debug(f"{avg_distance} ({confidence})")
+
+        return avg_distance, confidence
+
+
 if __name__ == "__main__":
     # enable debug logging
     logging.basicConfig(filename="logging_mpu6050", filemode="a", format='%(asctime)s - %(message)s', level=logging.INFO)
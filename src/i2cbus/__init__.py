@@ -0,0 +1,9 @@
+from i2cbus.fake import FakeBus, FakeDevice
+from i2cbus.i2cbus import (
+    PRIORITY_CONTROL,
+    PRIORITY_MOTOR,
+    PRIORITY_TELEMETRY,
+    BusManager,
+    I2CProxy,
+    LinuxBus,
+)
@@ -0,0 +1,88 @@
+"""In-memory I2C backend, so bus users can be exercised without hardware.
+
+Example, a register device and a ThunderBorg-style command device:
+
+    bus = FakeBus()
+    bus.attach(0x68, FakeDevice())
+    bus.attach(0x15, FakeDevice(respond=lambda command, length: bytes([command[0], 0x15]).ljust(length, b"\\0")))
+
+    manager = BusManager(bus)
+    manager.start()
+"""
+
+import time
+
+
+class FakeDevice:
+    """A device with 256 byte-wide registers, or a custom command handler.
+
+    By default the first byte written selects a register and any further bytes
+    are written from there, and reads continue from the selected register, as
+    the MPU6050 does.
+
+    Constructor Arguments:
+        registers: initial register values, defaults to all zero
+        respond: function(last_write, length) returning the bytes to read,\
+            used instead of registers for command-style devices
+    """
+
+    def __init__(self, registers=None, respond=None):
+        self.registers = bytearray(registers or bytes(256))
+        self.respond = respond
+        self.pointer = 0
+        self.last_write = b""
+
+    def write(self, data):
+        self.last_write = bytes(data)
+        if data:
+            self.pointer = data[0]
+            for i, value in enumerate(data[1:]):
+                self.registers[(self.pointer + i) % 256] = value
+
+    def read(self, length):
+        if self.respond:
+            return bytes(self.respond(self.last_write, length))
+        data = bytes(self.registers[(self.pointer + i) % 256] for i in range(length))
+        self.pointer = (self.pointer + length) % 256
+        return data
+
+
+class FakeBus:
+    """In-memory bus backend with simulated transfer time.
+
+    Constructor Arguments:
+        latency: time each write or read takes, in seconds
+
+    Methods:
+        attach: add a device at an address
+        write: write bytes to a device
+        read: read bytes from a device
+        scan: list attached addresses
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.devices = {}
+        self.log = []  # (operation, address, bytes) of every transfer, in order
+
+    def attach(self, address, device):
+        self.devices[address] = device
+
+    def _device(self, address):
+        if address not in self.devices:
+            raise OSError(f"No device at {address:#04x}")
+        if self.latency:
+            time.sleep(self.latency)
+        return self.devices[address]
+
+    def write(self, address, data):
+        self._device(address).write(data)
+        self.log.append(("write", address, bytes(data)))
+
+    def read(self, address, length):
+        data = self._device(address).read(length)
+        self.log.append(("read", address, data))
+        return data
+
+    def scan(self):
+        return sorted(self.devices)
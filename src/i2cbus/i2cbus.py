@@ -0,0 +1,281 @@
+"""Single owner of the I2C bus, serialising and prioritising every transaction.
+
+The ThunderBorg and MPU6050 share one bus but are driven from different
+threads. Routing both through a BusManager means transactions never
+interleave, motor commands are sent ahead of queued telemetry reads, and
+latency is measured per device.
+"""
+
+import fcntl
+import io
+import itertools
+import logging
+import time
+from queue import Empty, PriorityQueue
+from threading import Event, Lock, Thread, current_thread
+
+I2C_SLAVE = 0x0703  # ioctl to select the device address, see linux/i2c-dev.h
+
+# lower runs first
+PRIORITY_MOTOR = 0
+PRIORITY_CONTROL = 1
+PRIORITY_TELEMETRY = 2
+
+
+class LinuxBus:
+    """Raw /dev/i2c-N backend, as used by the ThunderBorg driver.
+
+    Constructor Arguments:
+        bus_number: I2C bus to open, 1 on every recent Raspberry Pi
+
+    Methods:
+        write: write bytes to a device
+        read: read bytes from a device
+        scan: list addresses which acknowledge a read
+    """
+
+    def __init__(self, bus_number=1):
+        self.bus_number = bus_number
+        self.i2c_read = io.open("/dev/i2c-" + str(bus_number), "rb", buffering=0)
+        self.i2c_write = io.open("/dev/i2c-" + str(bus_number), "wb", buffering=0)
+        self.address = None
+
+    def _select(self, address):
+        if address != self.address:
+            fcntl.ioctl(self.i2c_read, I2C_SLAVE, address)
+            fcntl.ioctl(self.i2c_write, I2C_SLAVE, address)
+            self.address = address
+
+    def write(self, address, data):
+        self._select(address)
+        self.i2c_write.write(bytes(data))
+
+    def read(self, address, length):
+        self._select(address)
+        return self.i2c_read.read(length)
+
+    def scan(self):
+        found = []
+        for address in range(0x03, 0x78):
+            try:
+                self.read(address, 1)
+                found.append(address)
+            except OSError:
+                pass
+        return found
+
+
+class Transaction:
+    """A write, a read, or a write followed by a read, executed without interruption.
+
+    Constructor Arguments:
+        address: 7-bit device address
+        data: bytes to write first, may be empty
+        length: number of bytes to read after writing, 0 for a write only
+        priority: PRIORITY_MOTOR, PRIORITY_CONTROL or PRIORITY_TELEMETRY
+    """
+
+    def __init__(self, address, data, length, priority):
+        self.address = address
+        self.data = bytes(data)
+        self.length = length
+        self.priority = priority
+
+        self.queued_ns = time.perf_counter_ns()
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class BusManager(Thread):
+    """Own the bus, executing transactions in priority order on a dedicated thread.
+
+    Constructor Arguments:
+        backend: bus implementation, LinuxBus or i2cbus.fake.FakeBus
+        timeout: longest to wait for a transaction, in seconds
+
+    Methods:
+        transfer: write and/or read a device as one transaction
+        write: write bytes to a device
+        read_registers: burst read consecutive registers from a device
+        scan: list addresses present on the bus
+        stats: per-device transaction count and latency
+    """
+
+    def __init__(self, backend, timeout=1.0):
+        Thread.__init__(self)
+        self.daemon = True  # never hold up interpreter exit on a blocked queue
+
+        self.backend = backend
+        self.timeout = timeout
+
+        self.queue = PriorityQueue()
+        self.order = itertools.count()  # keeps equal priorities first-in first-out
+
+        self.stats_lock = Lock()
+        self.device_stats = {}
+
+        self.terminated = False
+
+    def transfer(self, address, data=b"", length=0, priority=PRIORITY_TELEMETRY):
+        """Write and/or read a device as one transaction, blocking until it completes.
+
+        Args:
+            address (int): 7-bit device address
+            data (bytes, optional): bytes to write first
+            length (int, optional): number of bytes to read afterwards
+            priority (int, optional): queue priority, lower runs first
+
+        Returns:
+            bytes: bytes read, empty for a write only
+        """
+        transaction = Transaction(address, data, length, priority)
+
+        if current_thread() is self:
+            self._execute(transaction)  # called from a transaction, already own the bus
+        else:
+            if self.terminated or not self.is_alive():
+                raise IOError(f"I2C bus manager is not running, cannot reach {address:#04x}")
+            self.queue.put((priority, next(self.order), transaction))
+            if not transaction.done.wait(self.timeout):
+                raise IOError(f"I2C transaction with {address:#04x} timed out")
+
+        if transaction.error:
+            raise transaction.error
+        return transaction.result
+
+    def write(self, address, data, priority=PRIORITY_MOTOR):
+        """Write bytes to a device.
+
+        Args:
+            address (int): 7-bit device address
+            data (bytes): bytes to write
+            priority (int, optional): queue priority, defaults to PRIORITY_MOTOR
+        """
+        self.transfer(address, data, 0, priority)
+
+    def read_registers(self, address, register, length, priority=PRIORITY_TELEMETRY):
+        """Burst read consecutive registers, so related values arrive in one transaction.
+
+        Args:
+            address (int): 7-bit device address
+            register (int): first register to read
+            length (int): number of registers to read
+            priority (int, optional): queue priority, defaults to PRIORITY_TELEMETRY
+
+        Returns:
+            bytes: register values
+        """
+        return self.transfer(address, bytes([register]), length, priority)
+
+    def scan(self):
+        """List addresses present on the bus.
+
+        Returns:
+            list: 7-bit addresses
+        """
+        return self.backend.scan()
+
+    def stats(self):
+        """Per-device transaction count and latency.
+
+        Returns:
+            dict: for each device address, count, errors, mean queue wait,
+                mean transfer time and worst total latency (in ms)
+        """
+        with self.stats_lock:
+            return {
+                f"{address:#04x}": {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "mean_wait_ms": s["wait_ns"] / s["count"] / 1e6,
+                    "mean_transfer_ms": s["transfer_ns"] / s["count"] / 1e6,
+                    "max_latency_ms": s["max_ns"] / 1e6,
+                }
+                for address, s in self.device_stats.items()
+            }
+
+    def _execute(self, transaction):
+        start = time.perf_counter_ns()
+        try:
+            if transaction.data:
+                self.backend.write(transaction.address, transaction.data)
+            if transaction.length:
+                transaction.result = bytes(self.backend.read(transaction.address, transaction.length))
+            else:
+                transaction.result = b""
+        except Exception as e:
+            transaction.error = e
+        end = time.perf_counter_ns()
+
+        with self.stats_lock:
+            s = self.device_stats.setdefault(
+                transaction.address,
+                {"count": 0, "errors": 0, "wait_ns": 0, "transfer_ns": 0, "max_ns": 0},
+            )
+            s["count"] += 1
+            s["errors"] += transaction.error is not None
+            s["wait_ns"] += start - transaction.queued_ns
+            s["transfer_ns"] += end - start
+            s["max_ns"] = max(s["max_ns"], end - transaction.queued_ns)
+
+        transaction.done.set()
+
+    def run(self):
+        while not self.terminated:
+            try:
+                _, _, transaction = self.queue.get(timeout=0.1)
+            except Empty:
+                continue
+            self._execute(transaction)
+
+        # fail anything still queued, rather than leave callers waiting out the timeout
+        while True:
+            try:
+                _, _, transaction = self.queue.get_nowait()
+            except Empty:
+                break
+            transaction.error = IOError("I2C bus manager stopped")
+            transaction.done.set()
+
+        logging.debug(f"I2C bus manager stopped: {self.stats()}")
+
+
+class I2CProxy:
+    """An adafruit busio.I2C compatible view of a BusManager.
+
+    Lets CircuitPython drivers, such as adafruit_mpu6050, share the managed bus.
+
+    Constructor Arguments:
+        manager: BusManager to route transactions through
+        priority: queue priority for every transaction through this proxy
+    """
+
+    def __init__(self, manager, priority=PRIORITY_TELEMETRY):
+        self.manager = manager
+        self.priority = priority
+
+    def try_lock(self):
+        return True  # the manager already serialises transactions
+
+    def unlock(self):
+        pass
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        return self.manager.scan()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self.manager.transfer(address, bytes(buffer[start:end]), 0, self.priority)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self.manager.transfer(address, b"", end - start, self.priority)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = self.manager.transfer(
+            address, bytes(buffer_out[out_start:out_end]), in_end - in_start, self.priority
+        )
@@ -1,20 +1,51 @@
 # create a singleton sensor class to house gyroscope instance and provide data as thread
 import logging
 import math
+import struct
 import time
 from threading import Thread
 
 import adafruit_mpu6050
 import board
+import numpy as np
+
+from i2cbus import PRIORITY_TELEMETRY, I2CProxy
+
+# registers, see the MPU-6000/MPU-6050 register map
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+FIFO_EN = 0x23
+INT_ENABLE = 0x38
+ACCEL_XOUT_H = 0x3B  # first of 14 registers: accelerometer, temperature, then gyroscope
+USER_CTRL = 0x6A
+FIFO_COUNT_H = 0x72
+FIFO_R_W = 0x74
+
+FIFO_EN_GYRO_ACCEL = 0x78   # gyroscope x, y, z and accelerometer into the FIFO
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RESET = 0x04
+INT_ENABLE_DATA_RDY = 0x01
+CONFIG_DLPF_184HZ = 0x01    # low pass filter on, gyroscope sampled at 1kHz
+
+FIFO_SIZE = 1024
+FIFO_SAMPLE = 12  # bytes per sample, accelerometer x, y, z then gyroscope x, y, z, big-endian int16
+
+STANDARD_GRAVITY = 9.80665
 
 
 class MPU6050(Thread):
-    def __init__(self, rotation_log=None, velocity_log=None):
+    def __init__(self, rotation_log=None, velocity_log=None, bus=None, fifo=False, sample_rate=200, buffer_size=1024):
         Thread.__init__(self)
 
-        # initialise gyroscope board
-        i2c = board.I2C()  # uses board.SCL and board.SDA
+        # initialise gyroscope board, through the shared bus manager if there is one
+        self.bus = bus
+        i2c = I2CProxy(bus) if bus else board.I2C()  # board.I2C uses board.SCL and board.SDA
         self.mpu = adafruit_mpu6050.MPU6050(i2c)
+        self.address = self.mpu.i2c_device.device_address
+
+        # raw reading to SI unit scales, for the configured ranges
+        self.accel_scale = STANDARD_GRAVITY * (2 ** self.mpu.accelerometer_range) / 16384
+        self.gyro_scale = math.radians(1) * (2 ** self.mpu.gyro_range) / 131
 
         self.gyro = None
         self.acceleration = None
@@ -29,20 +60,141 @@ class MPU6050(Thread):
         self.rotation_log = rotation_log
         self.velocity_log = velocity_log
 
+        # every FIFO sample as a ring buffer of rows: time, acceleration x, y, z (m/s^2), gyro x, y, z (rad/s)
+        self.samples = np.zeros((buffer_size, 7))
+        self.sample_count = 0
+        self.tick_z = None  # z rates drained this tick, for integrating orientation at the full sample rate
+
+        self.fifo = fifo
+        if fifo:
+            self.enable_fifo(sample_rate)
+
+    def _read_registers(self, register, length):
+        if self.bus:
+            return self.bus.read_registers(self.address, register, length)
+
+        data = bytearray(length)
+        with self.mpu.i2c_device as device:
+            device.write_then_readinto(bytes([register]), data)
+        return bytes(data)
+
+    def _write_register(self, register, value):
+        if self.bus:
+            self.bus.write(self.address, bytes([register, value]), PRIORITY_TELEMETRY)
+            return
+
+        with self.mpu.i2c_device as device:
+            device.write(bytes([register, value]))
+
+    def enable_fifo(self, sample_rate=200):
+        """ Buffer gyro and accelerometer samples on the chip, to be drained once per poll.
+
+        Args:
+            sample_rate (int, optional): samples per second, 4 to 1000
+        """
+
+        divider = min(max(round(1000 / sample_rate) - 1, 0), 255)
+        self.sample_period = (divider + 1) / 1000
+
+        self._write_register(CONFIG, CONFIG_DLPF_184HZ)
+        self._write_register(SMPLRT_DIV, divider)
+        self._write_register(INT_ENABLE, INT_ENABLE_DATA_RDY)
+        self._write_register(FIFO_EN, FIFO_EN_GYRO_ACCEL)
+        self.reset_fifo()
+
+        self.fifo = True
+
+    def reset_fifo(self):
+        """ Empty the FIFO and start buffering again.
+        
+        """
+
+        self._write_register(USER_CTRL, USER_CTRL_FIFO_RESET)
+        self._write_register(USER_CTRL, USER_CTRL_FIFO_EN)
+
+    def drain_fifo(self):
+        """ Read every buffered sample in one block read, decoding into the sample buffer.
+
+        Returns:
+            int: number of samples read
+        """
+
+        count, = struct.unpack(">H", self._read_registers(FIFO_COUNT_H, 2))
+
+        if count >= FIFO_SIZE - FIFO_SAMPLE:
+            # full, so the chip may have overwritten samples and lost alignment, start again rather than decode garbage
+            logging.warning(f"MPU6050 FIFO overflow at {count} bytes, resetting")
+            self.reset_fifo()
+            self.tick_z = None
+            return 0
+
+        # a sample still being written leaves a partial one at the end, read it on the next drain
+        n = count // FIFO_SAMPLE
+        if n == 0:
+            self.tick_z = None
+            return 0
+
+        now = time.time()
+        raw = np.frombuffer(self._read_registers(FIFO_R_W, n * FIFO_SAMPLE), dtype=">i2").reshape(n, 6)
+
+        samples = np.empty((n, 7))
+        samples[:, 0] = now - self.sample_period * np.arange(n - 1, -1, -1)  # oldest first, newest read now
+        samples[:, 1:4] = raw[:, :3] * self.accel_scale
+        samples[:, 4:] = raw[:, 3:] * self.gyro_scale
+
+        index = (self.sample_count + np.arange(n)) % len(self.samples)
+        self.samples[index] = samples
+        self.sample_count += n
+
+        self.acceleration = tuple(samples[-1, 1:4].tolist())
+        self.gyro = tuple(samples[-1, 4:].tolist())
+        self.tick_z = samples[:, 6]
+
+        return n
+
+    def recent(self, n):
+        """ Latest FIFO samples, oldest first.
+
+        Args:
+            n (int): number of samples
+
+        Returns:
+            np.ndarray: rows of time, acceleration x, y, z and gyro x, y, z
+        """
+
+        n = min(n, self.sample_count, len(self.samples))
+        return self.samples[(self.sample_count - n + np.arange(n)) % len(self.samples)]
+
     def run(self):
         """ Update loop to poll MPU sensor for gyro and accelerometer data.
         
         """
         
         while True:
-            self.gyro = self.mpu.gyro
-            self.acceleration = self.mpu.acceleration
+            if self.fifo:
+                self.drain_fifo()
+            elif self.bus:
+                self.burst_read()
+            else:
+                self.gyro = self.mpu.gyro
+                self.acceleration = self.mpu.acceleration
             
             if self.orientation_flag:
                 self.gyroscopic()
 
             time.sleep(self.poll)
 
+    def burst_read(self):
+        """ Read accelerometer and gyroscope in one bus transaction, so both are from the same sample.
+        
+        """
+
+        data = self._read_registers(ACCEL_XOUT_H, 14)
+        ax, ay, az, _, gx, gy, gz = struct.unpack(">7h", data)
+
+        self.acceleration = (ax * self.accel_scale, ay * self.accel_scale, az * self.accel_scale)
+        self.gyro = (gx * self.gyro_scale, gy * self.gyro_scale, gz * self.gyro_scale)
+
     def gyroscopic(self):
         """ Update internal orientation, for calculating future rotations.
         
@@ -50,17 +202,24 @@ class MPU6050(Thread):
 
         if self.rotation_log:
             self.rotation_log.debug(self.orientation)
+
+        if self.gyro is None:
+            return  # FIFO has not produced a sample yet
         
-        x, y, z = self.mpu.gyro
+        x, y, z = self.gyro  # reuse this poll's reading, rather than another bus transaction
         self.abs_z = abs(math.degrees(z))
         self.z = math.degrees(z)
         
-        self.orientation += -self.z * self.poll
+        if self.fifo:
+            if self.tick_z is not None:
+                self.orientation += -math.degrees(float(np.sum(self.tick_z))) * self.sample_period  # every sample this tick
+        else:
+            self.orientation += -self.z * self.poll
 
         if self.orientation >= 360:
             self.orientation -= 360
         elif self.orientation < 0:
-            self.orientation += 355
+            self.orientation += 360
 
 if __name__ == "__main__":
     # enable debug logging
@@ -0,0 +1 @@
+from profiler.profiler import Profiler, phase, profile, profiler
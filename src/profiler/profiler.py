@@ -0,0 +1,205 @@
+"""Per-phase timing of a mission, to show which stage of navigation is worth optimising.
+
+Phases are timed with the `phase` context manager or the `profile` decorator,
+and each completed call is appended to a fixed-size ring buffer, so recording
+costs a couple of clock reads and a deque append whatever the mission length.
+Phases nest per thread, so every record also carries its call stack, from
+which `summary` reports per-phase totals and `folded` exports collapsed
+stacks for flame graph tools (e.g. flamegraph.pl or speedscope).
+
+Example:
+
+    @profile("spin")
+    def perform_spin(...):
+        ...
+
+    with phase("settle"):
+        time.sleep(0.3)
+
+    logging.info(profiler.summary())
+    profiler.export("profile.folded")
+"""
+
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+
+class _Phase:
+    """Context manager timing one call of a phase, see Profiler.phase."""
+
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            self.profiler._exit(self.name)
+        return False
+
+
+class Profiler:
+    """Record how long each phase of a mission takes, per call, in a ring buffer.
+
+    Constructor Arguments:
+        size: number of calls kept, the oldest are overwritten first
+        enabled: whether to record, when False phases cost a single attribute check
+
+    Methods:
+        phase: context manager timing a block as a named phase
+        profile: decorator timing every call of a function as a named phase
+        records: the recorded calls, oldest first
+        summary: per-phase table of calls, total, self, mean and max times
+        folded: collapsed stacks, one line per stack, for flame graphs
+        export: write the collapsed stacks to a file
+        reset: discard every recorded call
+    """
+
+    def __init__(self, size=16384, enabled=True):
+        self.enabled = enabled
+        self.buffer = deque(maxlen=size)  # (thread, stack, start_ns, duration_ns, self_ns)
+        self.dropped = 0
+        self.local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _enter(self, name):
+        # [name, start, time spent in nested phases]
+        self._stack().append([name, time.perf_counter_ns(), 0])
+
+    def _exit(self, name):
+        end = time.perf_counter_ns()
+        stack = self._stack()
+        if not stack or stack[-1][0] != name:
+            return  # profiling was enabled part way through this phase
+
+        _, start, children = stack.pop()
+        duration = end - start
+        if stack:
+            stack[-1][2] += duration
+
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        path = ";".join([frame[0] for frame in stack] + [name])
+        self.buffer.append((threading.current_thread().name, path, start, duration, duration - children))
+
+    def phase(self, name):
+        """Time a block as a named phase.
+
+        Args:
+            name (str): phase name, the same for every call of the phase
+
+        Returns:
+            context manager: timing the block it wraps
+        """
+        return _Phase(self, name)
+
+    def profile(self, name=None):
+        """Time every call of a function as a named phase.
+
+        Args:
+            name (str, optional): phase name, defaults to the function's name
+
+        Returns:
+            function: decorator for the function to time
+        """
+        def decorator(function):
+            label = name or function.__name__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                self._enter(label)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._exit(label)
+
+            return wrapper
+
+        return decorator
+
+    def records(self):
+        return list(self.buffer)
+
+    def totals(self):
+        """Aggregate the recorded calls by phase.
+
+        Returns:
+            dict: per phase name, calls, total_ns, self_ns and max_ns
+        """
+        totals = {}
+        for _, path, _, duration, own in self.records():
+            name = path.rsplit(";", 1)[-1]
+            total = totals.setdefault(name, {"calls": 0, "total_ns": 0, "self_ns": 0, "max_ns": 0})
+            total["calls"] += 1
+            total["total_ns"] += duration
+            total["self_ns"] += own
+            total["max_ns"] = max(total["max_ns"], duration)
+        return totals
+
+    def summary(self):
+        """Per-phase table, slowest total first, for logging after a mission.
+
+        Total time includes nested phases and self time excludes them, and
+        the share is of the wall time the records span, so phases on
+        different threads can add up to more than 100%.
+
+        Returns:
+            str: the table
+        """
+        records = self.records()
+        if not records:
+            return "No phases recorded"
+
+        wall = max(start + duration for _, _, start, duration, _ in records) - min(start for _, _, start, _, _ in records)
+        totals = self.totals()
+
+        lines = [f"{'phase':<24}{'calls':>8}{'total s':>10}{'self s':>10}{'mean ms':>10}{'max ms':>10}{'share':>8}"]
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["total_ns"]):
+            lines.append(
+                f"{name:<24}{total['calls']:>8}{total['total_ns'] / 1e9:>10.3f}{total['self_ns'] / 1e9:>10.3f}"
+                f"{total['total_ns'] / total['calls'] / 1e6:>10.2f}{total['max_ns'] / 1e6:>10.2f}"
+                f"{100 * total['total_ns'] / max(wall, 1):>7.1f}%"
+            )
+        lines.append(f"{len(records)} calls over {wall / 1e9:.3f}s" + (f", {self.dropped} oldest dropped" if self.dropped else ""))
+        return "\n".join(lines)
+
+    def folded(self):
+        """Collapsed stacks, rooted at the thread, with the self time of each in microseconds.
+
+        Returns:
+            str: one "thread;phase;nested_phase microseconds" line per stack
+        """
+        stacks = {}
+        for thread, path, _, _, own in self.records():
+            key = f"{thread};{path}"
+            stacks[key] = stacks.get(key, 0) + own
+        return "\n".join(f"{stack} {own // 1000}" for stack, own in sorted(stacks.items()))
+
+    def export(self, path):
+        with open(path, "w") as folded_file:
+            folded_file.write(self.folded() + "\n")
+
+    def reset(self):
+        self.buffer.clear()
+        self.dropped = 0
+
+
+# shared by every instrumented module, so one mission's phases end up in one buffer
+profiler = Profiler()
+phase = profiler.phase
+profile = profiler.profile
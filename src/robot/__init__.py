@@ -1,6 +1,7 @@
 """"Directory containing functionality for controlling robot
-Please see help pages for accelerometer, drive and gyroscope for more information.
+Please see help pages for accelerometer, drive, gyroscope and trajectory for more information.
 """
 from robot.accelerometer import perform_drive
 from robot.drive import follow, pathing
 from robot.gyroscope import perform_spin
+from robot.trajectory import follow_trajectory
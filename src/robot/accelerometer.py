@@ -10,19 +10,28 @@ import adafruit_mpu6050
 import board
 import ThunderBorg3 as ThunderBorg  # conversion for python 3
 
+from profiler import profile
+from robot.calibration import load_calibration
+
 import logging
 
 # Function to drive a distance in units
-def perform_drive(units, TB, mpu, max_power, logger):
+@profile("perform_drive")
+def perform_drive(units, TB, mpu, max_power, logger, cancel=None):
     """Drive a distance in units.
 
     Args:
         units (float): distance to drive in units.
+        cancel (threading.Event, optional): stop within one sample once set, defaults to None.
     """
 
+    if cancel is not None and cancel.is_set():
+        return  # preempted before starting
+
     logger.debug("------")
 
-    power = max_power*0.8
+    calibration = load_calibration()
+    power = max_power * calibration.drive_power
 
     if units < 0.0:
         # Reverse drive
@@ -34,10 +43,14 @@ def perform_drive(units, TB, mpu, max_power, logger):
         drive_left = +1.0
         drive_right = +1.0
 
+    # stop early by the distance the chassis coasts once the motors are off
+    units = max(units - calibration.drive_coast, 0)
+
     # Perform the motion
     # Set the motors running
-    TB.SetMotor1(drive_right * power)
-    TB.SetMotor2(drive_left * power)
+    left, right = calibration.motor_powers(drive_left, drive_right, power)
+    TB.SetMotor1(right)
+    TB.SetMotor2(left)
 
     # poll the gyroscope for acceleration
     # NOTE: sampling limited by real-time clock on system (0.1ms theoretical minimum, but experimentally encountered errors)
@@ -84,14 +97,23 @@ def perform_drive(units, TB, mpu, max_power, logger):
                 "Assuming constant velocity of Z:%.2f, sleeping for %.2f seconds to drive %.2f units"
                 % (velocity, sleep, (units - total_motion))
             )
-            time.sleep(sleep)
+            if cancel is not None:
+                cancel.wait(sleep)
+            else:
+                time.sleep(sleep)
 
             # NOTE: this will set total motion to target, which is only correct assuming rotation halts immediately and velocity remains constant
             # in non-demo system current orientation should be independently tracked, not adjusted using this approximation
             total_motion += velocity * sleep  # update final rotation for tracking
             break
 
-        time.sleep(sampling)
+        # wait for the next sample, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(sampling):
+                logging.debug("Preempted, stopping motors")
+                break
+        else:
+            time.sleep(sampling)
 
     # Turn the motors off
     TB.MotorsOff()
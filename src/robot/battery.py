@@ -0,0 +1,162 @@
+"""Battery monitoring, compensating motor power for the pack voltage as it drains.
+
+Motor speed follows the voltage applied to the motors, which is the commanded
+power times the battery voltage. Scaling max_power inversely with a smoothed
+battery reading keeps the applied voltage, and so the speed, constant through
+a mission, until the pack is too flat to compensate.
+"""
+
+import logging
+import time
+from threading import Lock, Thread
+
+import numpy as np
+
+
+class BatteryMonitor(Thread):
+    """Sample the ThunderBorg battery reading at a low rate in the background.
+
+    Constructor Arguments:
+        TB: ThunderBorg object
+        calibration: fitted models, whose limiter sets the target motor voltage, see robot.calibration
+        poll: pause between readings, in seconds
+        alpha: smoothing factor of the exponential moving average, 0 to 1
+        min_voltage: voltage below which the pack should not be run
+        logger: logger for voltage readings and drive speeds
+
+    Methods:
+        sample: read and smooth the battery voltage
+        max_power: power limit compensated for the smoothed battery voltage
+        record_drive: log the speed of a completed drive against the voltage
+        predicted_speed: drive speed expected at a voltage, from logged drives
+        remaining_time: estimate time to drive a distance, and time until the pack is flat
+    """
+
+    def __init__(self, TB, calibration, poll=5.0, alpha=0.3, min_voltage=9.0, logger=None):
+        Thread.__init__(self)
+
+        self.TB = TB
+        self.calibration = calibration
+        self.poll = poll
+        self.alpha = alpha
+        self.min_voltage = min_voltage
+        self.logger = logger
+
+        self.lock = Lock()
+        self.voltage = None
+        self.readings = []  # (time, smoothed voltage) pairs
+        self.drives = []    # (voltage, speed) pairs
+
+        self.terminated = False
+
+        self.sample()  # read once up front, so max_power is valid before the thread starts
+
+    def sample(self):
+        """Read and smooth the battery voltage, see robot.health for polling it alongside other checks."""
+        reading = self.TB.GetBatteryReading()
+        if reading is None:
+            return  # failed read, already reported by the ThunderBorg
+
+        with self.lock:
+            if self.voltage is None:
+                self.voltage = reading
+            else:
+                self.voltage = self.alpha * reading + (1 - self.alpha) * self.voltage
+            self.readings.append((time.time(), self.voltage))
+
+        if self.logger:
+            self.logger.debug(f"battery: {reading:.2f}V, smoothed {self.voltage:.2f}V")
+
+        if self.voltage < self.min_voltage:
+            logging.warning(f"Battery at {self.voltage:.2f}V, below {self.min_voltage}V")
+
+    def run(self):
+        next_sample = time.time() + self.poll
+        while not self.terminated:
+            if time.time() >= next_sample:
+                self.sample()
+                next_sample += self.poll
+            time.sleep(0.1)  # short sleeps, so the thread stops promptly when terminated
+
+    @property
+    def max_power(self):
+        """Power limit compensated for the smoothed battery voltage.
+
+        Returns:
+            float: maximum motor power, 0 to 1
+        """
+        with self.lock:
+            voltage = self.voltage
+
+        if voltage is None:
+            return self.calibration.max_power(12.0)
+
+        max_power = self.calibration.max_power(voltage)
+        if max_power >= 1.0 and 12.0 * self.calibration.limiter > voltage:
+            logging.debug(f"Battery at {voltage:.2f}V, too low to fully compensate motor power")
+        return max_power
+
+    def record_drive(self, distance, duration):
+        """Log the speed of a completed drive against the current voltage.
+
+        Args:
+            distance (float): distance driven, in units
+            duration (float): time the drive took, in seconds
+        """
+        if duration <= 0 or self.voltage is None:
+            return
+
+        speed = abs(distance) / duration
+        with self.lock:
+            self.drives.append((self.voltage, speed))
+
+        if self.logger:
+            self.logger.debug(f"drive: {speed:.3f} units/s at {self.voltage:.2f}V")
+
+    def predicted_speed(self, voltage=None):
+        """Drive speed expected at a voltage, fitted by least squares over logged drives.
+
+        Args:
+            voltage (float, optional): battery voltage, defaults to the current smoothed voltage
+
+        Returns:
+            float: speed in units per second, None if no drives have been logged
+        """
+        with self.lock:
+            drives = list(self.drives)
+            voltage = self.voltage if voltage is None else voltage
+
+        if not drives:
+            return None
+
+        voltages, speeds = np.array(drives).T
+        if len(drives) < 3 or np.ptp(voltages) < 0.05:
+            return float(np.mean(speeds))  # too little spread in voltage to fit a slope
+
+        slope, intercept = np.polyfit(voltages, speeds, 1)
+        return max(float(slope * voltage + intercept), 1e-3)
+
+    def remaining_time(self, distance):
+        """Estimate time to drive a distance, and time until the pack is flat.
+
+        Args:
+            distance (float): distance left to drive in the mission, in units
+
+        Returns:
+            tuple: seconds to drive the distance (None if no drives are logged), and
+                seconds until min_voltage at the current drain rate (None if unknown)
+        """
+        speed = self.predicted_speed()
+        drive_time = distance / speed if speed else None
+
+        with self.lock:
+            readings = list(self.readings)
+
+        battery_time = None
+        if len(readings) >= 3:
+            times, voltages = np.array(readings).T
+            drain, _ = np.polyfit(times - times[0], voltages, 1)  # volts per second
+            if drain < 0:
+                battery_time = max(float((voltages[-1] - self.min_voltage) / -drain), 0.0)
+
+        return drive_time, battery_time
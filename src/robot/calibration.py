@@ -0,0 +1,331 @@
+"""Fit and persist motor, spin and drive models from a set of excitation moves.
+
+Replaces hand-tuning (see testing/motor optimisation) with a designed sequence
+of moves: spins and drives at several power levels, and straight drives at
+several motor balances. Responses are measured with the MPU6050 and fitted by
+least squares, then saved to calibration.json for the controllers to use.
+
+Fitted models:
+    spin rate (deg/s) = spin_gain * (power - spin_deadband), per direction
+    drive speed (units/s) = drive_gain * (power - drive_deadband)
+    yaw rate when driving straight = 0 at motor balance `balance`
+    rotation / distance still travelled after the motors are turned off (coast)
+"""
+
+import json
+import logging
+import sys
+import time
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+
+CALIBRATION_PATH = join(dirname(dirname(abspath(__file__))), "calibration.json")
+
+
+def fit_linear_response(powers, responses, noise=1e-3):
+    """Fit response = gain * (power - deadband) by least squares.
+
+    Samples whose response is within noise of zero are below the deadband and ignored.
+
+    Args:
+        powers (list): motor powers commanded
+        responses (list): steady-state response measured at each power
+
+    Returns:
+        tuple: gain and deadband
+    """
+    powers = np.asarray(powers, dtype=float)
+    responses = np.abs(np.asarray(responses, dtype=float))
+    moving = responses > noise
+
+    if moving.sum() < 2:
+        raise ValueError("too few moves above the deadband to fit")
+
+    gain, intercept = np.polyfit(powers[moving], responses[moving], 1)
+    return float(gain), float(-intercept / gain)
+
+
+def fit_balance(balances, yaw_rates):
+    """Find the motor balance at which a straight drive has no yaw, by least squares.
+
+    Args:
+        balances (list): right to left motor power ratios driven
+        yaw_rates (list): mean yaw rate measured at each balance
+
+    Returns:
+        float: balance for a straight drive
+    """
+    slope, intercept = np.polyfit(np.asarray(balances, dtype=float), np.asarray(yaw_rates, dtype=float), 1)
+    return float(-intercept / slope)
+
+
+class Calibration:
+    """Fitted chassis models, as used by the controllers and time models.
+
+    Constructor Arguments:
+        balance: right to left motor power ratio that drives straight
+        spin_gain_cw: clockwise spin rate per unit power above the deadband, deg/s
+        spin_deadband_cw: lowest power that spins clockwise
+        spin_gain_ccw: anti-clockwise spin rate per unit power above the deadband, deg/s
+        spin_deadband_ccw: lowest power that spins anti-clockwise
+        drive_gain: drive speed per unit power above the deadband, units/s
+        drive_deadband: lowest power that drives
+        spin_coast: rotation after the motors are turned off, degrees
+        drive_coast: distance after the motors are turned off, units
+        spin_power: fraction of max_power to spin at
+        drive_power: fraction of max_power to drive at
+        limiter: fraction of the 12V motor rating to use
+
+    Methods:
+        load: read a calibration file, defaults if there is none
+        save: write a calibration file
+        motor_powers: balance left and right motor powers
+        spin_rate: predicted spin rate at a power
+        drive_speed: predicted drive speed at a power
+        max_power: power limit for a supply voltage
+    """
+
+    def __init__(self, balance=1.0, spin_gain_cw=200.0, spin_deadband_cw=0.4, spin_gain_ccw=200.0, spin_deadband_ccw=0.4, drive_gain=1.0, drive_deadband=0.4, spin_coast=0.0, drive_coast=0.0, spin_power=1.0, drive_power=0.8, limiter=1.0):
+        self.balance = balance
+        self.spin_gain_cw = spin_gain_cw
+        self.spin_deadband_cw = spin_deadband_cw
+        self.spin_gain_ccw = spin_gain_ccw
+        self.spin_deadband_ccw = spin_deadband_ccw
+        self.drive_gain = drive_gain
+        self.drive_deadband = drive_deadband
+        self.spin_coast = spin_coast
+        self.drive_coast = drive_coast
+        self.spin_power = spin_power
+        self.drive_power = drive_power
+        self.limiter = limiter
+
+    @classmethod
+    def load(cls, path=CALIBRATION_PATH):
+        """Read a calibration file.
+
+        Args:
+            path (str, optional): calibration file, defaults to src/calibration.json
+
+        Returns:
+            Calibration: fitted models, or defaults if the file does not exist
+        """
+        if not exists(path):
+            logging.warning(f"No calibration at {path}, using defaults")
+            return cls()
+
+        with open(path) as json_file:
+            return cls(**json.load(json_file))
+
+    def save(self, path=CALIBRATION_PATH):
+        """Write a calibration file.
+
+        Args:
+            path (str, optional): calibration file, defaults to src/calibration.json
+        """
+        with open(path, "w") as json_file:
+            json.dump(vars(self), json_file, indent=4)
+
+    def motor_powers(self, drive_left, drive_right, power):
+        """Balance left and right motor powers, so equal commands drive straight.
+
+        Args:
+            drive_left (float): left motor command, -1 to 1
+            drive_right (float): right motor command, -1 to 1
+            power (float): power to scale commands by
+
+        Returns:
+            tuple: left and right motor powers, the stronger side slowed to match
+        """
+        if self.balance < 1:
+            return drive_left * power, drive_right * power * self.balance
+        return drive_left * power / self.balance, drive_right * power
+
+    def spin_rate(self, power, delta=1):
+        """Predicted spin rate at a power.
+
+        Args:
+            power (float): motor power
+            delta (float, optional): spin direction, positive clockwise
+
+        Returns:
+            float: spin rate in degrees per second
+        """
+        if delta > 0:
+            return max(self.spin_gain_cw * (power - self.spin_deadband_cw), 0.0)
+        return max(self.spin_gain_ccw * (power - self.spin_deadband_ccw), 0.0)
+
+    def drive_speed(self, power):
+        """Predicted drive speed at a power.
+
+        Args:
+            power (float): motor power
+
+        Returns:
+            float: speed in units per second
+        """
+        return max(self.drive_gain * (power - self.drive_deadband), 0.0)
+
+    def max_power(self, voltage_in):
+        """Power limit for a supply voltage.
+
+        Args:
+            voltage_in (float): total battery voltage to the ThunderBorg
+
+        Returns:
+            float: maximum motor power, 0 to 1
+        """
+        voltage_out = 12.0 * self.limiter
+        if voltage_out > voltage_in:
+            return 1.0
+        return voltage_out / float(voltage_in)
+
+
+_loaded = None
+
+
+def load_calibration(path=CALIBRATION_PATH):
+    """Load the calibration once, shared by every controller.
+
+    Returns:
+        Calibration: fitted models, or defaults if there is no calibration file
+    """
+    global _loaded
+    if _loaded is None:
+        _loaded = Calibration.load(path)
+    return _loaded
+
+
+def _excite(TB, mpu, left, right, duration, sampling, settle=0.5, coast=1.0):
+    """Run the motors and record the steady-state yaw rate, speed and coast.
+
+    Returns:
+        tuple: mean yaw rate (deg/s, clockwise), mean speed (units/s),
+            rotation and distance after the motors are turned off
+    """
+    TB.SetMotor1(right)
+    TB.SetMotor2(left)
+
+    rates, speeds = [], []
+    velocity = 0
+    start = time.time()
+
+    while time.time() - start < duration:
+        time.sleep(sampling)
+        velocity += mpu.acceleration[2] * sampling
+        if time.time() - start > settle:
+            rates.append(-mpu.z)
+            speeds.append(velocity)
+
+    TB.MotorsOff()
+
+    # keep integrating while the chassis coasts to a stop
+    rotation, distance = 0, 0
+    start = time.time()
+    while time.time() - start < coast:
+        time.sleep(sampling)
+        velocity = max(velocity + mpu.acceleration[2] * sampling, 0)
+        rotation += -mpu.z * sampling
+        distance += velocity * sampling
+
+    time.sleep(1)  # let the chassis settle before the next move
+
+    return float(np.mean(rates)), float(np.mean(speeds)), rotation, distance
+
+
+def calibrate(TB, mpu, max_power, logger, powers=(0.3, 0.45, 0.6, 0.75, 0.9), balances=(0.85, 0.9, 0.95, 1.0, 1.05), duration=1.5):
+    """Run the excitation moves and fit every model.
+
+    Args:
+        TB (ThunderBorg): ThunderBorg object.
+        mpu (MPU6050): MPU6050 object.
+        max_power (float): maximum power to use.
+        logger (Logger): logger for each measured move.
+        powers (tuple, optional): fractions of max_power to spin and drive at
+        balances (tuple, optional): motor balances to drive straight at
+        duration (float, optional): length of each move in seconds
+
+    Returns:
+        Calibration: fitted models
+    """
+    sampling = 0.05
+    mpu.orientation_flag = True  # keep mpu.z updated during calibration
+
+    calibration = Calibration()
+
+    # straight drives at a range of balances, for the balance with no yaw
+    yaw_rates = []
+    for balance in balances:
+        calibration.balance = balance
+        left, right = calibration.motor_powers(1, 1, max_power * calibration.drive_power)
+        yaw_rate, _, _, _ = _excite(TB, mpu, left, right, duration, sampling)
+        logger.info(f"balance {balance}: yaw rate {yaw_rate:.2f} deg/s")
+        yaw_rates.append(yaw_rate)
+    calibration.balance = fit_balance(balances, yaw_rates)
+
+    # spins in both directions and drives, at a range of powers
+    cw, ccw, drives = [], [], []
+    spin_coasts, drive_coasts = [], []
+    for fraction in powers:
+        power = max_power * fraction
+
+        left, right = calibration.motor_powers(1, -1, power)
+        rate, _, rotation, _ = _excite(TB, mpu, left, right, duration, sampling)
+        cw.append(rate)
+        spin_coasts.append(abs(rotation))
+
+        left, right = calibration.motor_powers(-1, 1, power)
+        rate, _, rotation, _ = _excite(TB, mpu, left, right, duration, sampling)
+        ccw.append(rate)
+        spin_coasts.append(abs(rotation))
+
+        left, right = calibration.motor_powers(1, 1, power)
+        _, speed, _, distance = _excite(TB, mpu, left, right, duration, sampling)
+        drives.append(speed)
+        drive_coasts.append(distance)
+
+        logger.info(f"power {power:.2f}: cw {cw[-1]:.1f} deg/s, ccw {ccw[-1]:.1f} deg/s, drive {speed:.2f} units/s")
+
+    mpu.orientation_flag = False
+
+    commanded = [max_power * fraction for fraction in powers]
+    calibration.spin_gain_cw, calibration.spin_deadband_cw = fit_linear_response(commanded, cw)
+    calibration.spin_gain_ccw, calibration.spin_deadband_ccw = fit_linear_response(commanded, ccw)
+    calibration.drive_gain, calibration.drive_deadband = fit_linear_response(commanded, drives)
+    calibration.spin_coast = float(np.median(spin_coasts))
+    calibration.drive_coast = float(np.median(drive_coasts))
+
+    logger.info(f"calibration: {vars(calibration)}")
+
+    return calibration
+
+
+if __name__ == "__main__":
+    import ThunderBorg3 as ThunderBorg  # conversion for python 3
+    from mpu6050 import MPU6050
+
+    # enable debug logging
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.DEBUG)
+
+    # Setup the ThunderBorg
+    TB = ThunderBorg.ThunderBorg()
+    TB.Init()
+    if not TB.foundChip:
+        logging.warning("No ThunderBorg found, check you are attached :)")
+        sys.exit()
+    TB.SetCommsFailsafe(False)  # Disable the communications failsafe
+
+    mpu = MPU6050()
+    mpu.setName("MPU6050")
+    mpu.start()
+
+    # calibrate at the full power limit, so every fitted power is reachable
+    max_power = Calibration.load().max_power(TB.GetBatteryReading())
+
+    try:
+        calibration = calibrate(TB, mpu, max_power, logging.getLogger())
+        calibration.save()
+        logging.info(f"Saved calibration to {CALIBRATION_PATH}")
+    finally:
+        TB.MotorsOff()
+        mpu.join()
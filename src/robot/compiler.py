@@ -0,0 +1,279 @@
+"""Compiles a path into the quickest sequence of spin and drive instructions.
+
+Straight runs of cells are merged into a single drive, and the spin before each
+drive is chosen by a small dynamic programme over the headings the robot could
+be left facing, costed with a time model of the chassis. Each segment can be
+driven forwards or, when allowed, in reverse, so the state is (cell, heading).
+"""
+
+import math
+
+from robot.accelerometer import perform_drive
+from robot.drive import calculate_angle
+from robot.gyroscope import perform_spin, smallestAngle
+from robot.trajectory import perform_arc
+
+
+class TimeModel:
+    """Estimated duration of spin and drive instructions.
+
+    Constructor Arguments:
+        spin_rate_cw: clockwise spin rate in degrees per second
+        spin_rate_ccw: anti-clockwise spin rate in degrees per second
+        spin_settle: fixed time to start and stop a spin, in seconds
+        drive_speed: cruising speed in units per second
+        drive_settle: fixed time to accelerate and brake, in seconds
+        pause: pause between instructions, see robot.drive.follow
+        reverse_penalty: multiplier on the time to drive in reverse, since the ultrasonic\
+            sensor faces forwards and reversing is driven blind
+
+    Methods:
+        from_calibration: build from fitted chassis models
+        spin_time: estimated duration of a spin
+        drive_time: estimated duration of a drive
+    """
+
+    def __init__(self, spin_rate_cw=120.0, spin_rate_ccw=120.0, spin_settle=0.3, drive_speed=0.5, drive_settle=0.5, pause=0.5, reverse_penalty=1.25):
+        self.spin_rate_cw = spin_rate_cw
+        self.spin_rate_ccw = spin_rate_ccw
+        self.spin_settle = spin_settle
+        self.drive_speed = drive_speed
+        self.drive_settle = drive_settle
+        self.pause = pause
+        self.reverse_penalty = reverse_penalty
+
+    @classmethod
+    def from_calibration(cls, calibration, max_power, **kwargs):
+        """Build a time model from fitted chassis models.
+
+        Args:
+            calibration (Calibration): fitted models, see robot.calibration
+            max_power (float): maximum power the controllers are given
+
+        Returns:
+            TimeModel: time model at the powers perform_spin and perform_drive use
+        """
+        spin_power = max_power * calibration.spin_power
+        drive_power = max_power * calibration.drive_power
+        return cls(
+            spin_rate_cw=calibration.spin_rate(spin_power, 1) or 1e-3,
+            spin_rate_ccw=calibration.spin_rate(spin_power, -1) or 1e-3,
+            drive_speed=calibration.drive_speed(drive_power) or 1e-3,
+            **kwargs,
+        )
+
+    def spin_time(self, delta):
+        """Estimated duration of a spin.
+
+        Args:
+            delta (float): angle to spin in degrees, positive clockwise
+
+        Returns:
+            float: duration in seconds, 0 if there is nothing to spin
+        """
+        if delta == 0:
+            return 0.0
+        rate = self.spin_rate_cw if delta > 0 else self.spin_rate_ccw
+        return self.spin_settle + abs(delta) / rate + self.pause
+
+    def drive_time(self, distance):
+        """Estimated duration of a drive.
+
+        Args:
+            distance (float): distance to drive in units, negative for reverse
+
+        Returns:
+            float: duration in seconds
+        """
+        duration = self.drive_settle + abs(distance) / self.drive_speed
+        if distance < 0:
+            duration *= self.reverse_penalty
+        return duration + self.pause
+
+
+def best_spin(current, target, model):
+    """Choose the quickest direction to spin from one heading to another.
+
+    Args:
+        current (float): heading in degrees
+        target (float): heading in degrees
+        model (TimeModel): time model to cost each direction with
+
+    Returns:
+        tuple: angle to spin in degrees (positive clockwise) and its duration
+    """
+    delta = smallestAngle(current, target)
+    if delta == 0:
+        return 0, 0.0
+
+    # the long way round can be quicker if one direction spins much faster
+    other = delta - 360 if delta > 0 else delta + 360
+    return min(((d, model.spin_time(d)) for d in (delta, other)), key=lambda s: s[1])
+
+
+def merge_segments(path, unit_size):
+    """Merge consecutive steps in the same direction into straight segments.
+
+    Args:
+        path (list): a list of (x, y) coordinates, starting at the robot's cell
+        unit_size (float): the size of one grid cell, in drive units
+
+    Returns:
+        list: (heading, distance) pairs, heading in degrees within [-180, 180]
+    """
+    segments = []
+
+    for (x, y), (x_, y_) in zip(path, path[1:]):
+        if (x, y) == (x_, y_):
+            continue
+
+        heading = smallestAngle(0, calculate_angle((x_ - x, y - y_)))
+        distance = math.hypot(x_ - x, y_ - y) * unit_size
+
+        if segments and segments[-1][0] == heading:
+            segments[-1] = (heading, segments[-1][1] + distance)
+        else:
+            segments.append((heading, distance))
+
+    return segments
+
+
+def _options(heading, allow_reverse):
+    # (robot heading, drive direction) pairs able to drive a segment
+    if allow_reverse:
+        return [(heading, 1), (heading + 180, -1)]
+    return [(heading, 1)]
+
+
+def choose_direction(current, heading, distance, model=None, allow_reverse=True):
+    """Choose whether to drive a single segment forwards or in reverse.
+
+    Args:
+        current (float): heading the robot is facing, in degrees
+        heading (float): direction of the segment, in degrees
+        distance (float): length of the segment, in drive units
+        model (TimeModel, optional): time model, defaults to TimeModel()
+        allow_reverse (bool, optional): consider driving in reverse, defaults to True
+
+    Returns:
+        tuple: heading to face, angle to spin to face it, and drive direction (1 forwards, -1 reverse)
+    """
+    model = model or TimeModel()
+    choices = []
+
+    for facing, direction in _options(heading, allow_reverse):
+        facing = smallestAngle(0, facing)
+        delta, spin_time = best_spin(current, facing, model)
+        choices.append((spin_time + model.drive_time(direction * distance), facing, delta, direction))
+
+    _, facing, delta, direction = min(choices)
+    return facing, delta, direction
+
+
+def compile_path(path, unit_size, start_heading=0, final_heading=None, model=None, allow_reverse=False):
+    """Compile a path into the quickest spin and drive instructions.
+
+    Args:
+        path (list): a list of (x, y) coordinates, starting at the robot's cell
+        unit_size (float): the size of one grid cell, in drive units
+        start_heading (float, optional): heading the robot starts at, defaults to 0 (North)
+        final_heading (float, optional): heading to finish facing, defaults to None\
+            which leaves the robot facing along the last segment
+        model (TimeModel, optional): time model, defaults to TimeModel()
+        allow_reverse (bool, optional): consider driving segments in reverse, defaults to False.\
+            Only enable for paths through known free space, reversing is driven blind.
+
+    Returns:
+        list: instructions to be performed by the robot, see robot.drive.follow
+    """
+    model = model or TimeModel()
+    segments = merge_segments(path, unit_size)
+
+    # best[heading] = (time, instructions) to finish the segments so far facing heading
+    best = {smallestAngle(0, start_heading): (0.0, [])}
+
+    for heading, distance in segments:
+        step = {}
+        for facing, direction in _options(heading, allow_reverse):
+            facing = smallestAngle(0, facing)
+            for current, (elapsed, instructions) in best.items():
+                delta, spin_time = best_spin(current, facing, model)
+                total = elapsed + spin_time + model.drive_time(direction * distance)
+
+                if facing not in step or total < step[facing][0]:
+                    spin = [(perform_spin, (delta, facing))] if delta != 0 else []
+                    step[facing] = (
+                        total,
+                        instructions + spin + [(perform_drive, (direction * distance,))],
+                    )
+        best = step
+
+    if final_heading is not None:
+        final = smallestAngle(0, final_heading)
+        finished = {}
+        for current, (elapsed, instructions) in best.items():
+            delta, spin_time = best_spin(current, final, model)
+            spin = [(perform_spin, (delta, final))] if delta != 0 else []
+            finished[final] = min(
+                finished.get(final, (math.inf, None)),
+                (elapsed + spin_time, instructions + spin),
+                key=lambda f: f[0],
+            )
+        best = finished
+
+    return min(best.values(), key=lambda b: b[0])[1]
+
+
+def compile_lattice(steps, unit_size):
+    """Compile a lattice plan into spin, arc and drive instructions.
+
+    Consecutive straight runs in the same direction are merged into a single drive.
+
+    Args:
+        steps (list): primitives, as returned by algorithms.lattice.LatticePlanner.plan
+        unit_size (float): the size of one grid cell, in drive units
+
+    Returns:
+        list: instructions to be performed by the robot, see robot.drive.follow
+    """
+    instructions = []
+
+    for p in steps:
+        if p.kind == "spin":
+            target = smallestAngle(0, p.end_heading * 45)
+            instructions.append((perform_spin, (p.angle, target)))
+        elif p.kind == "arc":
+            instructions.append((perform_arc, (p.angle, unit_size)))
+        else:
+            distance = p.distance * unit_size
+            previous = instructions[-1] if instructions else None
+            if previous and previous[0] is perform_drive and (previous[1][0] > 0) == (distance > 0):
+                instructions[-1] = (perform_drive, (previous[1][0] + distance,))
+            else:
+                instructions.append((perform_drive, (distance,)))
+
+    return instructions
+
+
+def estimate_time(instructions, model=None):
+    """Estimate how long a list of instructions will take to perform.
+
+    Args:
+        instructions (list): instructions, as returned by compile_path or pathing
+        model (TimeModel, optional): time model, defaults to TimeModel()
+
+    Returns:
+        float: duration in seconds
+    """
+    model = model or TimeModel()
+    total = 0.0
+
+    for action, arg in instructions:
+        if action is perform_spin:
+            total += model.spin_time(arg[0])
+        elif action is perform_arc:
+            total += model.drive_time(math.pi / 2 * arg[1] * abs(arg[0]) / 90)
+        else:
+            total += model.drive_time(arg[0])
+
+    return total
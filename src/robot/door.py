@@ -0,0 +1,236 @@
+"""Door inspection, classifying each door against reference signatures learnt on earlier visits.
+
+Each ultrasonic sample is scored by how much more likely it is if the door is
+closed than if it is open, and sampling stops as soon as the running total is
+decisive (a sequential probability ratio test). Until a door has been seen in
+a state, that state is modelled as the original fixed rule: closed doors range
+under 60cm, open doors range further or not at all. Each confident decision
+refines that door's reference, so later checks need fewer samples.
+"""
+
+import json
+import logging
+import math
+import re
+import time
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+
+DOORS_PATH = join(dirname(dirname(abspath(__file__))), "doors")
+
+MAX_RANGE = 400         # cm, the HC-SR04's range
+CLOSED_THRESHOLD = 60   # cm, closed doors range under this without a reference
+
+
+class StateReference:
+    """Range distribution of a door in one state, updated as observations are made.
+
+    Constructor Arguments:
+        count: valid samples seen
+        mean: mean of valid samples, in cm
+        m2: sum of squared deviations from the mean, for the variance
+        invalid: samples with no echo or out of range
+        thumbnail: mean camera thumbnail, flattened, or None
+
+    Methods:
+        add: include a sample
+        likelihood: probability of a sample, None without enough samples to model it
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, invalid=0, thumbnail=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.invalid = invalid
+        self.thumbnail = thumbnail
+
+    def add(self, distance):
+        if distance <= 0 or distance > MAX_RANGE:
+            self.invalid += 1
+            return
+
+        # Welford's running mean and variance
+        self.count += 1
+        delta = distance - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (distance - self.mean)
+
+    def likelihood(self, distance, min_count=10, min_std=2.0, outlier=0.05):
+        total = self.count + self.invalid
+        if total < min_count:
+            return None
+
+        invalid = (self.invalid + 1) / (total + 2)  # smoothed, so neither outcome is ruled out
+        if distance <= 0 or distance > MAX_RANGE:
+            return invalid
+
+        std = max(math.sqrt(self.m2 / max(self.count - 1, 1)), min_std)
+        normal = math.exp(-0.5 * ((distance - self.mean) / std) ** 2) / (std * math.sqrt(2 * math.pi))
+        return (1 - invalid) * ((1 - outlier) * normal + outlier / MAX_RANGE)
+
+
+def default_likelihood(distance, closed):
+    """Probability of a sample without a reference, following the original 60cm rule."""
+    if distance <= 0 or distance > MAX_RANGE:
+        return 0.05 if closed else 0.5
+    if closed:
+        return 0.95 * (0.9 / CLOSED_THRESHOLD if distance < CLOSED_THRESHOLD else 0.1 / (MAX_RANGE - CLOSED_THRESHOLD))
+    return 0.5 * (0.1 / CLOSED_THRESHOLD if distance < CLOSED_THRESHOLD else 0.9 / (MAX_RANGE - CLOSED_THRESHOLD))
+
+
+def thumbnail(frame, size=(16, 12)):
+    """Small, brightness-normalised grayscale copy of a frame, for comparing views of a door.
+
+    Args:
+        frame (np.ndarray): RGB image, height x width x 3
+
+    Returns:
+        np.ndarray: flattened thumbnail
+    """
+    gray = np.asarray(frame, dtype=float).mean(axis=2)
+    height, width = gray.shape
+    rows, columns = size[1], size[0]
+    gray = gray[:height - height % rows, :width - width % columns]
+    small = gray.reshape(rows, gray.shape[0] // rows, columns, gray.shape[1] // columns).mean(axis=(1, 3)).ravel()
+    return (small - small.mean()) / (small.std() + 1e-6)
+
+
+class DoorInspector:
+    """Decide whether each door is open or closed, with as few samples as the evidence allows.
+
+    Constructor Arguments:
+        ranger: background ultrasonic ranger, see hcsr04.Ranger
+        capture: function returning an RGB camera frame, see vision.PiCameraCapture, None for ultrasonic only
+        path: directory of per-door reference files
+        audit_path: JSON lines file each inspection is appended to
+        error: accepted chance of a wrong decision, for each state
+        min_samples: samples to take before deciding, however decisive
+        max_samples: samples after which to decide on the evidence so far
+        thumbnail_weight: largest log-likelihood the camera can add, either way
+        logger: logger for each decision
+
+    Methods:
+        inspect: classify a door, updating its reference
+    """
+
+    def __init__(self, ranger, capture=None, path=DOORS_PATH, audit_path="door_audit.jsonl", error=0.01, min_samples=3, max_samples=20, thumbnail_weight=2.0, logger=None):
+        self.ranger = ranger
+        self.capture = capture
+        self.path = path
+        self.audit_path = audit_path
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.thumbnail_weight = thumbnail_weight
+        self.logger = logger
+
+        # stop once the log-likelihood ratio passes either bound
+        self.upper = math.log((1 - error) / error)
+        self.lower = -self.upper
+
+    def _file(self, door):
+        return join(self.path, re.sub(r"[^A-Za-z0-9_-]", "_", str(door)) + ".json")
+
+    def load(self, door):
+        """Reference signatures for a door.
+
+        Args:
+            door (str): door name
+
+        Returns:
+            dict: StateReference for "closed" and "open", empty if the door has not been seen
+        """
+        if not exists(self._file(door)):
+            return {"closed": StateReference(), "open": StateReference()}
+
+        with open(self._file(door)) as json_file:
+            data = json.load(json_file)
+        return {state: StateReference(**data[state]) for state in ("closed", "open")}
+
+    def save(self, door, references):
+        makedirs(self.path, exist_ok=True)
+        with open(self._file(door), "w") as json_file:
+            json.dump({state: vars(reference) for state, reference in references.items()}, json_file, indent=4)
+
+    def _llr(self, distance, references):
+        closed = references["closed"].likelihood(distance)
+        opened = references["open"].likelihood(distance)
+        closed = default_likelihood(distance, True) if closed is None else closed
+        opened = default_likelihood(distance, False) if opened is None else opened
+        return math.log(max(closed, 1e-12)) - math.log(max(opened, 1e-12))
+
+    def _thumbnail_vote(self, view, references):
+        closed, opened = references["closed"].thumbnail, references["open"].thumbnail
+        if view is None or closed is None or opened is None:
+            return 0.0
+
+        # closer to the closed view than the open one votes closed, bounded so the camera cannot decide alone
+        difference = np.abs(view - np.asarray(opened)).mean() - np.abs(view - np.asarray(closed)).mean()
+        return float(np.clip(difference * self.thumbnail_weight, -self.thumbnail_weight, self.thumbnail_weight))
+
+    def inspect(self, door, since_ns=0):
+        """Classify a door, facing it, sampling only until the decision is confident.
+
+        Args:
+            door (str): door name, the same on every visit to the door
+            since_ns (int): ignore ranger samples taken before this time.time_ns() timestamp
+
+        Returns:
+            bool: whether the door is closed
+        """
+        start = time.time()
+        references = self.load(door)
+
+        view = thumbnail(self.capture()) if self.capture else None
+        vote = self._thumbnail_vote(view, references)
+        llr = vote
+
+        samples = []
+        while len(samples) < self.max_samples:
+            sample = self.ranger.next_sample(since_ns)
+            if sample is None:
+                break  # ranger stopped returning samples, decide on what there is
+            since_ns, distance = sample[0] + 1, sample[1]
+
+            samples.append(distance)
+            llr += self._llr(distance, references)
+
+            if len(samples) >= self.min_samples and (llr >= self.upper or llr <= self.lower):
+                break
+
+        closed = llr > 0
+        confident = llr >= self.upper or llr <= self.lower
+
+        # only confident decisions refine the reference, so a mistake is not learnt
+        if confident:
+            state = references["closed" if closed else "open"]
+            for distance in samples:
+                state.add(distance)
+            if view is not None:
+                state.thumbnail = (view if state.thumbnail is None else 0.7 * np.asarray(state.thumbnail) + 0.3 * view).tolist()
+            self.save(door, references)
+
+        record = {
+            "time": time.time(),
+            "door": door,
+            "closed": closed,
+            "confident": confident,
+            "llr": round(llr, 3),
+            "thumbnail_vote": round(vote, 3),
+            "samples": samples,
+            "duration": round(time.time() - start, 3),
+            "references": {state: reference.count + reference.invalid for state, reference in references.items()},
+        }
+        with open(self.audit_path, "a") as audit_file:
+            audit_file.write(json.dumps(record) + "\n")
+
+        message = f"Door {door} {'closed' if closed else 'open'} after {len(samples)} samples (llr {llr:.2f})"
+        if confident:
+            logging.info(message)
+        else:
+            logging.warning(message + ", not confident")
+        if self.logger:
+            self.logger.info(record)
+
+        return closed
@@ -3,7 +3,7 @@
 import math
 
 from robot.accelerometer import perform_drive
-from robot.gyroscope import perform_spin
+from robot.gyroscope import perform_spin, smallestAngle
 
 import time
 import logging
@@ -73,15 +73,20 @@ def get_move_string(y, x):
     return out
 
 
-def pathing(path, unit_size, origin=False, curr_angle=0):
+def pathing(path, unit_size, origin=False, curr_angle=0, final_heading=0):
     """Drives the robot to the given path
 
+    See robot.compiler.compile_path for a version which merges straight runs and\
+        minimises the time taken.
+
     Args:
         path (list): a list of tuples representing the path
         unit_size (int): the size of the unit the robot is moving in
         origin (bool, optional): whether or not the robot is starting at the origin,\
             defaults to False
         curr_angle (int, optional): the angle the robot is starting at, defaults to 0
+        final_heading (int, optional): the angle to finish facing, defaults to 0 (North),\
+            None to skip the final reorientation
 
     Returns:
         list: a list of instructions to be performed by the robot
@@ -112,9 +117,9 @@ def pathing(path, unit_size, origin=False, curr_angle=0):
 
         target_angle = calculate_angle(unit_target_vector)
 
-        delta_angle = (
-            target_angle - curr_angle
-        )  # calculate the difference in between the current and the target angle
+        delta_angle = smallestAngle(
+            curr_angle, target_angle
+        )  # calculate the shortest turn between the current and the target angle
 
         if abs(delta_angle) > 0:
             instructions.append(
@@ -135,30 +140,45 @@ def pathing(path, unit_size, origin=False, curr_angle=0):
 
         x, y = x_, y_
 
-    
-    # reorient to face north
-    delta_angle = (
-        0 - curr_angle
-    )  # calculate the difference in between the current and the target angle
-
-    instructions.append(
-        (perform_spin, (delta_angle, 0))
-    )  # rotate the car to match the target angle by rotating the remaining distance
-    
+    if final_heading is not None:
+        # reorient to face the final heading (North by default)
+        delta_angle = smallestAngle(
+            curr_angle, final_heading
+        )  # calculate the shortest turn between the current and the target angle
+
+        if abs(delta_angle) > 0:
+            instructions.append(
+                (perform_spin, (delta_angle, final_heading))
+            )  # rotate the car to match the target angle by rotating the remaining distance
 
     return instructions
 
 
-def follow(instructions, TB, mpu, max_power):
+def follow(instructions, TB, mpu, max_power, logger=None, cancel=None):
     """Follows a list of instructions
 
     Args:
         instructions (list): a list of instructions to be performed by the robot
+        logger (Logger, optional): logger passed to each action, defaults to the root logger
+        cancel (threading.Event, optional): abandon the remaining instructions once set,\
+            stopping the running one within a control tick, defaults to None
+
+    Returns:
+        bool: whether every instruction was completed
     """
+    logger = logger or logging.getLogger()
 
     for action, arg in instructions:
-        action(*arg, TB, mpu, max_power)
-        time.sleep(0.5)
+        action(*arg, TB, mpu, max_power, logger, cancel=cancel)
+
+        # pause between actions, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(0.5):
+                return False
+        else:
+            time.sleep(0.5)
+
+    return True
 
 
 if __name__ == "__main__":
@@ -181,10 +201,10 @@ if __name__ == "__main__":
     end_node = (3, 0)
     
     # define dummy functions
-    def perform_spin(delta, target, TB, mpu, max_power):
+    def perform_spin(delta, target, TB, mpu, max_power, logger, cancel=None):
         print(f"spin: {delta} deg")
     
-    def perform_drive(meters, TB, mpu, max_power):
+    def perform_drive(meters, TB, mpu, max_power, logger, cancel=None):
         print(f"drive: {meters} m")
 
     def a_star(matrix, start_node, end_node):
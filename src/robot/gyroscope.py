@@ -11,6 +11,9 @@ import adafruit_mpu6050
 import board
 import ThunderBorg3 as ThunderBorg  # conversion for python 3
 
+from profiler import profile
+from robot.calibration import load_calibration
+
 
 def smallestAngle(currentAngle, targetAngle):
     # Subtract the angles, constraining the value to [0, 360)
@@ -24,7 +27,8 @@ def smallestAngle(currentAngle, targetAngle):
     return diff
 
 # Function to spin an angle in degrees
-def perform_spin(delta, target, TB, mpu, max_power, logger):
+@profile("perform_spin")
+def perform_spin(delta, target, TB, mpu, max_power, logger, cancel=None):
     """Spin an angle in degrees.
 
     Args:
@@ -33,8 +37,12 @@ def perform_spin(delta, target, TB, mpu, max_power, logger):
         TB (ThunderBorg): ThunderBorg object.
         mpu (MPU6050): MPU6050 object.
         max_power (float): maximum power to use.
+        cancel (threading.Event, optional): stop within one sample once set, defaults to None.
     """
 
+    if cancel is not None and cancel.is_set():
+        return  # preempted before starting
+
     logger.debug("------")
 
     #delta = smallestAngle(mpu.orientation, target)
@@ -43,8 +51,11 @@ def perform_spin(delta, target, TB, mpu, max_power, logger):
     #logging.debug(f"DELTA: {delta}")
     print(f"DELTA: {delta}")
 
-    power = max_power * 1
-    
+    calibration = load_calibration()
+    power = max_power * calibration.spin_power
+
+    # stop early by the rotation the chassis coasts through once the motors are off
+    coast = calibration.spin_coast
     
     if delta < 0.0:
         # Left turn
@@ -58,11 +69,14 @@ def perform_spin(delta, target, TB, mpu, max_power, logger):
         drive_right = -1.0
         print("RIGHT")
     
+    delta = max(delta - coast, 0)
+
     mpu.orientation_flag = True
     
     # Set the motors running
-    TB.SetMotor1(drive_right * power)
-    TB.SetMotor2(drive_left * power)
+    left, right = calibration.motor_powers(drive_left, drive_right, power)
+    TB.SetMotor1(right)
+    TB.SetMotor2(left)
 
     # poll the gyroscope for rotation
     # NOTE: sampling limited by real-time clock on system \
@@ -102,7 +116,10 @@ def perform_spin(delta, target, TB, mpu, max_power, logger):
                 "Assuming constant rotation of Z:%.2f, sleeping for %.2f seconds to rotate %.2f degrees"
                 % (abs_z, sleep, (delta - total_rotation))
             )
-            time.sleep(sleep)
+            if cancel is not None:
+                cancel.wait(sleep)
+            else:
+                time.sleep(sleep)
 
             # NOTE: this will set total rotation to target, which is only correct \
             # assuming rotation halts immediately and rotational velocity remains constant
@@ -113,7 +130,13 @@ def perform_spin(delta, target, TB, mpu, max_power, logger):
             total_rotation += abs_z * sleep  # update final rotation for tracking
             break
 
-        time.sleep(sampling)
+        # wait for the next sample, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(sampling):
+                logging.debug("Preempted, stopping motors")
+                break
+        else:
+            time.sleep(sampling)
 
     # Turn the motors off
     TB.MotorsOff()
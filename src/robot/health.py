@@ -0,0 +1,185 @@
+"""Motor driver health monitoring, raising events as soon as a fault or stall is seen.
+
+The monitor polls the ThunderBorg fault registers, the commanded motor powers
+and the battery on a schedule, and watches the MPU6050 for motion. It reads
+one transaction at a time, so motor commands can go between them: through a
+bus manager its reads queue behind motor commands, and otherwise it skips the
+rest of a poll when the bus is busy rather than blocking the control loop. On
+a fault or stall it sets the cancel events it was given so running motions
+stop within a control tick.
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from queue import Empty, Queue
+from threading import Thread
+
+
+class HealthEvent:
+    """A fault, stall or low battery seen by the health monitor.
+
+    Constructor Arguments:
+        kind: "fault", "stall" or "battery"
+        detail: human readable description
+    """
+
+    def __init__(self, kind, detail):
+        self.kind = kind
+        self.detail = detail
+        self.time_ns = time.time_ns()
+
+    def __repr__(self):
+        return f"HealthEvent({self.kind}, {self.detail})"
+
+
+class HealthMonitor(Thread):
+    """Poll motor faults and battery, and detect stalls, in the background.
+
+    Constructor Arguments:
+        TB: ThunderBorg object
+        mpu: MPU6050 object
+        battery: battery monitor to sample on the same schedule, see robot.battery
+        cancel: events to set on a fault or stall, e.g. the motion queue's cancel event
+        poll: pause between motor checks, in seconds
+        battery_period: pause between battery readings, in seconds
+        stall_power: commanded power above which the motors should move the chassis
+        stall_time: how long the motors may be driven without motion before a stall
+        gyro_threshold: rotation rate counted as motion, in degrees per second
+        vibration_threshold: standard deviation of acceleration counted as motion, in m/s^2
+        logger: logger for every event
+
+    Methods:
+        events: take every event raised since the last call
+    """
+
+    def __init__(self, TB, mpu, battery=None, cancel=(), poll=0.1, battery_period=5.0, stall_power=0.3, stall_time=1.0, gyro_threshold=5.0, vibration_threshold=0.15, logger=None):
+        Thread.__init__(self)
+
+        self.TB = TB
+        self.mpu = mpu
+        self.battery = battery
+        self.cancel = list(cancel)
+
+        self.poll = poll
+        self.battery_period = battery_period
+        self.stall_power = stall_power
+        self.stall_time = stall_time
+        self.gyro_threshold = gyro_threshold
+        self.vibration_threshold = vibration_threshold
+        self.logger = logger
+
+        self.queue = Queue()
+        self.faulted = False        # last fault state, so a fault is only raised once
+        self.driving_since = None   # when the motors were first seen commanded
+        self.motion = deque(maxlen=max(int(stall_time / poll), 2))  # recent acceleration magnitudes
+
+        self.skipped = 0  # polls skipped because the bus was busy
+        self.terminated = False
+
+    def _raise(self, kind, detail):
+        event = HealthEvent(kind, detail)
+        logging.warning(f"Health: {event}")
+        if self.logger:
+            self.logger.warning(event)
+
+        self.queue.put(event)
+        if kind != "battery":
+            for cancel in self.cancel:
+                cancel.set()  # stop the running motion straight away
+
+    def events(self):
+        """Take every event raised since the last call.
+
+        Returns:
+            list: HealthEvent objects, oldest first
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except Empty:
+                return events
+
+    def _read(self, read):
+        # the bus manager already orders transactions by priority, motor commands first
+        if self.TB.busManager:
+            return True, read()
+
+        # never block the control loop, only take the bus for one transaction while it is free
+        if not self.TB.busLock.acquire(blocking=False):
+            return False, None
+        try:
+            return True, read()
+        finally:
+            self.TB.busLock.release()
+
+    def _read_bus(self, read_battery):
+        reads = [self.TB.GetDriveFault1, self.TB.GetDriveFault2, self.TB.GetMotor1, self.TB.GetMotor2]
+        if read_battery and self.battery:
+            reads.append(self.battery.sample)
+
+        readings = []
+        for read in reads:
+            done, reading = self._read(read)
+            if not done:
+                self.skipped += 1  # skip the rest of this poll while the bus is busy
+                return None
+            readings.append(reading)
+
+        fault1, fault2, motor1, motor2 = readings[:4]
+        return fault1, fault2, motor1 or 0.0, motor2 or 0.0
+
+    def _moving(self):
+        gyro = self.mpu.gyro
+        acceleration = self.mpu.acceleration
+        if gyro is None or acceleration is None:
+            return True  # no readings yet, assume moving rather than raise a false stall
+
+        self.motion.append(math.sqrt(sum(a * a for a in acceleration)))
+
+        rotating = abs(math.degrees(gyro[2])) > self.gyro_threshold
+
+        mean = sum(self.motion) / len(self.motion)
+        vibration = math.sqrt(sum((a - mean) ** 2 for a in self.motion) / len(self.motion))
+
+        return rotating or vibration > self.vibration_threshold
+
+    def run(self):
+        next_battery = time.time()
+
+        while not self.terminated:
+            read_battery = time.time() >= next_battery
+            reading = self._read_bus(read_battery)
+
+            if reading is not None:
+                if read_battery:
+                    next_battery += self.battery_period
+                    if self.battery and self.battery.voltage and self.battery.voltage < self.battery.min_voltage:
+                        self._raise("battery", f"{self.battery.voltage:.2f}V")
+
+                fault1, fault2, motor1, motor2 = reading
+
+                faulted = bool(fault1) or bool(fault2)
+                if faulted and not self.faulted:
+                    self._raise("fault", f"motor 1 fault: {fault1}, motor 2 fault: {fault2}")
+                self.faulted = faulted
+
+                # stall, motors driven hard enough to move but the IMU sees no motion
+                moving = self._moving()
+                if max(abs(motor1), abs(motor2)) > self.stall_power:
+                    if self.driving_since is None:
+                        self.driving_since = time.time()
+                        self.motion.clear()
+                    elif moving:
+                        self.driving_since = time.time()
+                    elif time.time() - self.driving_since > self.stall_time:
+                        self._raise("stall", f"motors at {motor1:.2f}, {motor2:.2f} with no motion")
+                        self.driving_since = None
+                else:
+                    self.driving_since = None
+
+            time.sleep(self.poll)
+
+        logging.debug(f"Health monitor stopped, skipped {self.skipped} polls on a busy bus")
@@ -0,0 +1,194 @@
+"""Concurrent stages for navigation, so sensing, planning and driving overlap.
+
+The motion queue executes spin/drive actions on its own thread, and the planner
+worker recomputes the next step of the D* Lite path on another, so the robot
+plans its next cell while the motors are still driving it to the current one.
+"""
+
+import logging
+import time
+from queue import Empty, Queue
+from threading import Condition, Event, Lock, Thread
+
+
+class MotionQueue(Thread):
+    """Execute motion actions in order on a dedicated thread.
+
+    Actions are called with a `cancel` keyword argument, an Event which is set
+    when the queue is preempted, see perform_spin and perform_drive. An action
+    that raises is re-raised from the next wait, rather than stopping the thread.
+
+    Methods:
+        submit: queue an action to be performed
+        wait: block until every queued action is finished
+        preempt: abandon queued actions and stop the running one
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True  # never holds up exit, e.g. after an exception in navigate
+
+        self.actions = Queue()
+        self.pending = 0
+        self.pending_lock = Lock()
+        self.idle = Event()
+        self.idle.set()
+        self.cancel = Event()
+
+        self.finished_ns = time.time_ns()  # when the last action completed
+        self.error = None  # raised by an action, until re-raised by wait
+        self.terminated = False
+
+    def submit(self, action, args):
+        """Queue an action to be performed.
+
+        Args:
+            action (function): motion function, e.g. perform_spin or perform_drive
+            args (tuple): every argument to call the action with
+        """
+        with self.pending_lock:
+            self.pending += 1
+            self.idle.clear()
+        self.actions.put((action, args))
+
+    def wait(self):
+        """Block until every queued action is finished, re-raising any error an action raised."""
+        self.idle.wait()
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def preempt(self):
+        """Abandon queued actions and stop the running one within a control tick.
+
+        Returns once the motors are stopped, so a new plan can be submitted straight away.
+        """
+        with self.pending_lock:
+            while True:
+                try:
+                    self.actions.get_nowait()
+                except Empty:
+                    break
+                self.pending -= 1
+
+            if self.pending == 0:
+                self.idle.set()
+            self.cancel.set()
+
+        self.idle.wait()
+        self.cancel.clear()
+
+    def run(self):
+        while not self.terminated:
+            try:
+                action, args = self.actions.get(timeout=0.1)
+            except Empty:
+                continue
+
+            try:
+                action(*args, cancel=self.cancel)
+            except Exception as e:
+                logging.exception(f"Motion {getattr(action, '__name__', action)} failed")
+                self.error = self.error or e
+            finally:
+                self.finished_ns = time.time_ns()
+                with self.pending_lock:
+                    self.pending -= 1
+                    if self.pending == 0:
+                        self.idle.set()
+
+
+class PlannerWorker(Thread):
+    """Replan the D* Lite path in the background whenever the robot moves or the map changes.
+
+    Callers must hold `lock` while changing the graph or queue, e.g. to add an obstacle.
+    A plan that fails, including finding no path, is re-raised from next_step.
+
+    Methods:
+        replan: request a new next step from the given node
+        next_step: block until the latest requested plan is ready and return it
+    """
+
+    def __init__(self, graph, queue, d_star_lite, k_m, s_start, d_star_log=None):
+        Thread.__init__(self)
+        self.daemon = True  # never holds up exit, e.g. after an exception in navigate
+
+        self.graph = graph
+        self.queue = queue
+        self.d_star_lite = d_star_lite
+        self.k_m = k_m
+        self.s_last = s_start
+
+        self.d_star_log = d_star_log
+
+        self.lock = Lock()
+        self.requests = Queue()
+        self.plan_ready = Condition()
+
+        self.generation = 0  # increments on every request, so stale plans are never returned
+        self.plan = (0, None)
+        self.error = None  # raised planning the latest request, until re-raised by next_step
+        self.terminated = False
+
+    def replan(self, s_current):
+        """Request a new next step from the given node.
+
+        Args:
+            s_current (str): the node the robot is (or is about to be) in
+        """
+        with self.plan_ready:
+            self.generation += 1
+            self.requests.put((self.generation, s_current))
+
+    def next_step(self, timeout=None):
+        """Block until the latest requested plan is ready.
+
+        Returns:
+            str: the next node in the shortest path
+        """
+        with self.plan_ready:
+            self.plan_ready.wait_for(lambda: self.plan[0] == self.generation, timeout)
+
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            return self.plan[1]
+
+    def run(self):
+        while not self.terminated:
+            try:
+                generation, s_current = self.requests.get(timeout=0.1)
+            except Empty:
+                continue
+
+            # skip straight to the newest request, older ones are obsolete
+            while not self.requests.empty():
+                generation, s_current = self.requests.get()
+
+            error = None
+            s_next = None
+            try:
+                with self.lock:
+                    self.k_m += self.d_star_lite.heuristic_from_s(self.graph, self.s_last, s_current)
+                    self.d_star_lite.computeShortestPath(self.graph, self.queue, s_current, self.k_m)
+                    self.d_star_lite.updateObsticles(self.graph, self.queue, s_current, self.k_m, 2)
+                    self.d_star_lite.computeShortestPath(self.graph, self.queue, s_current, self.k_m)
+                    s_next = self.d_star_lite.nextInShortestPath(self.graph, s_current)
+                    self.s_last = s_current
+
+                if s_next is None:
+                    raise ValueError(f"no path from {s_current} to the goal")
+            except Exception as e:
+                logging.exception(f"Planning from {s_current} failed")
+                error = e
+
+            if self.d_star_log:
+                self.d_star_log.debug(f"{s_current} -> {s_next}")
+
+            with self.plan_ready:
+                self.plan = (generation, s_next)
+                self.error = error
+                self.plan_ready.notify_all()
+
+        logging.debug("Planner worker stopped")
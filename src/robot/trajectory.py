@@ -0,0 +1,247 @@
+"""Continuous-curvature path following, tracked using gyroscope and accelerometer.
+
+Instead of stopping to spin in place at every corner, a planned path is smoothed
+into a spline and driven by a pure-pursuit controller, which sets differential
+motor power every tick so that corners become arcs.
+"""
+
+import logging
+import math
+import time
+
+import numpy as np
+
+from robot.calibration import load_calibration
+from robot.gyroscope import perform_spin, smallestAngle
+
+MIN_SPEED = 0.1  # units/s, floor on the calibrated speed when bounding how long a motion may take
+
+
+def smooth_path(path, unit_size, samples=10):
+    """Smooth a grid path into a Catmull-Rom spline through each cell centre.
+
+    Args:
+        path (list): a list of (x, y) grid coordinates
+        unit_size (float): the size of one grid cell, in drive units
+        samples (int, optional): points generated per path segment, defaults to 10
+
+    Returns:
+        np.ndarray: (n, 2) array of points along the spline, in drive units
+    """
+    points = np.asarray(path, dtype=float) * unit_size
+
+    if len(points) < 2:
+        return points
+
+    # repeat the end points so the spline passes through every waypoint
+    padded = np.vstack([points[0], points, points[-1]])
+
+    t = np.linspace(0.0, 1.0, samples, endpoint=False)[:, None]
+    t2, t3 = t * t, t * t * t
+
+    smoothed = []
+    for i in range(1, len(padded) - 2):
+        p0, p1, p2, p3 = padded[i - 1], padded[i], padded[i + 1], padded[i + 2]
+        smoothed.append(
+            0.5 * (
+                2 * p1
+                + (p2 - p0) * t
+                + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2
+                + (3 * p1 - p0 - 3 * p2 + p3) * t3
+            )
+        )
+    smoothed.append(points[-1:])
+
+    return np.vstack(smoothed)
+
+
+def pure_pursuit(pose, trajectory, start_index, lookahead):
+    """Find the curvature that steers from the pose onto the trajectory.
+
+    Args:
+        pose (tuple): x, y in drive units and heading in degrees (clockwise from North)
+        trajectory (np.ndarray): (n, 2) array of points to follow
+        start_index (int): index of the closest point found on the previous tick
+        lookahead (float): distance ahead on the trajectory to steer towards
+
+    Returns:
+        tuple: curvature (positive turns clockwise), closest index, and distance to the end
+    """
+    x, y, heading = pose
+    position = np.array([x, y])
+
+    # only search forwards, so the robot never doubles back along the path
+    distances = np.hypot(*(trajectory[start_index:] - position).T)
+    closest = start_index + int(np.argmin(distances))
+
+    ahead = np.nonzero(distances[closest - start_index:] >= lookahead)[0]
+    target = trajectory[closest + ahead[0]] if len(ahead) else trajectory[-1]
+
+    dx, dy = target - position
+    # angle from the heading to the target, positive clockwise, with North as decreasing y
+    alpha = math.radians(smallestAngle(heading, math.degrees(math.atan2(dx, -dy))))
+    distance = max(math.hypot(dx, dy), 1e-6)
+
+    curvature = 2 * math.sin(alpha) / distance
+    remaining = float(np.hypot(*(trajectory[-1] - position)))
+
+    return curvature, closest, remaining
+
+
+def perform_arc(angle, radius, TB, mpu, max_power, logger, cancel=None, track_width=0.5, margin=2.0):
+    """Drive forwards along a circular arc, tracked using gyroscope.
+
+    Args:
+        angle (float): angle to turn through in degrees, positive clockwise.
+        radius (float): radius of the arc in drive units.
+        TB (ThunderBorg): ThunderBorg object.
+        mpu (MPU6050): MPU6050 object.
+        max_power (float): maximum power to use.
+        logger (Logger): logger for the rotation.
+        cancel (threading.Event, optional): stop within one sample once set, defaults to None.
+        track_width (float, optional): distance between the wheels in drive units
+        margin (float, optional): multiple of the expected arc time after which to give up
+    """
+    if cancel is not None and cancel.is_set():
+        return  # preempted before starting
+
+    calibration = load_calibration()
+    power = max_power * calibration.drive_power
+    curvature = math.copysign(1.0 / radius, angle)
+
+    # differential drive, clockwise curvature speeds up the left wheels
+    drive_left = 1 + curvature * track_width / 2
+    drive_right = 1 - curvature * track_width / 2
+    scale = max(abs(drive_left), abs(drive_right))
+
+    mpu.orientation_flag = True  # keep mpu.z updated while turning
+
+    left, right = calibration.motor_powers(drive_left / scale, drive_right / scale, power)
+    TB.SetMotor1(right)
+    TB.SetMotor2(left)
+
+    # a stalled wheel or silent gyroscope would otherwise turn forever
+    speed = calibration.drive_speed(power) * (abs(drive_left) + abs(drive_right)) / (2 * scale)
+    time_limit = margin * abs(math.radians(angle)) * radius / max(speed, MIN_SPEED)
+    start = time.time()
+
+    sampling = 0.05
+    total_rotation = 0
+
+    while abs(total_rotation) < abs(angle):
+        if time.time() - start > time_limit:
+            logging.warning(f"Arc not finished within {time_limit:.1f}s, stopping motors")
+            break
+
+        if cancel is not None:
+            if cancel.wait(sampling):
+                logging.debug("Preempted, stopping motors")
+                break
+        else:
+            time.sleep(sampling)
+
+        total_rotation += -mpu.z * sampling
+        logger.debug(f"arc rotation: {total_rotation:.1f}")
+
+    # Turn the motors off
+    TB.MotorsOff()
+
+    mpu.orientation_flag = False
+
+    logging.debug(f"total rotation: {total_rotation}")
+
+
+def follow_trajectory(path, unit_size, TB, mpu, max_power, logger, cancel=None, curr_angle=0, lookahead=0.8, track_width=0.5, tolerance=0.15, margin=2.0):
+    """Drive a grid path continuously, without stopping at each cell.
+
+    Args:
+        path (list): a list of (x, y) grid coordinates, starting at the robot's cell
+        unit_size (float): the size of one grid cell, in drive units
+        TB (ThunderBorg): ThunderBorg object.
+        mpu (MPU6050): MPU6050 object.
+        max_power (float): maximum power to use.
+        logger (Logger): logger for the tracked pose.
+        cancel (threading.Event, optional): stop within one tick once set, defaults to None.
+        curr_angle (float, optional): heading the robot starts at, defaults to 0 (North)
+        lookahead (float, optional): pure-pursuit lookahead distance in drive units
+        track_width (float, optional): distance between the wheels in drive units
+        tolerance (float, optional): distance from the end of the path counted as arrived
+        margin (float, optional): multiple of the expected driving time after which to give up
+
+    Returns:
+        tuple: final x, y (in drive units) and heading, as tracked by dead reckoning
+    """
+    trajectory = smooth_path(path, unit_size)
+    if len(trajectory) < 2:
+        return (*trajectory[0], curr_angle) if len(trajectory) else (0.0, 0.0, curr_angle)
+
+    x, y = trajectory[0]
+    heading = curr_angle
+
+    # a target behind the robot would have it circle round, so face the path first
+    dx, dy = trajectory[min(len(trajectory) - 1, 5)] - trajectory[0]
+    delta = smallestAngle(heading, math.degrees(math.atan2(dx, -dy)))
+    if abs(delta) > 60:
+        perform_spin(delta, heading + delta, TB, mpu, max_power, logger, cancel=cancel)
+        heading += delta
+
+    calibration = load_calibration()
+    power = max_power * calibration.drive_power
+    sampling = 0.05
+    index = 0
+    velocity = 0
+
+    # dead reckoning may never come within tolerance of the end, so give up after the
+    # time the path should take at the slowest speed driven, on the approach to the end
+    length = float(np.sum(np.hypot(*np.diff(trajectory, axis=0).T)))
+    time_limit = margin * length / max(calibration.drive_speed(power * 0.4), MIN_SPEED)
+    start = time.time()
+
+    mpu.orientation_flag = True  # keep mpu.z updated while following
+
+    while True:
+        if cancel is not None and cancel.is_set():
+            logging.debug("Preempted, stopping motors")
+            break
+
+        if time.time() - start > time_limit:
+            logging.warning(f"Trajectory not finished within {time_limit:.1f}s, stopping motors")
+            break
+
+        curvature, index, remaining = pure_pursuit((x, y, heading), trajectory, index, lookahead)
+
+        if remaining < tolerance:
+            break
+
+        # slow down on the approach to the end of the path
+        speed = power * min(1.0, 0.4 + remaining / lookahead)
+
+        # differential drive, clockwise curvature speeds up the left wheels
+        drive_left = speed * (1 + curvature * track_width / 2)
+        drive_right = speed * (1 - curvature * track_width / 2)
+
+        # keep within the power limit without changing the ratio between sides
+        scale = max(abs(drive_left), abs(drive_right), power) / power
+        left, right = calibration.motor_powers(drive_left / scale, drive_right / scale, 1)
+        TB.SetMotor1(right)
+        TB.SetMotor2(left)
+
+        time.sleep(sampling)
+
+        # dead reckoning, heading from the gyroscope and speed from the accelerometer
+        # NOTE: as in perform_drive, z-axis is forward acceleration and (negated) rotation
+        heading += -mpu.z * sampling
+        x_, y_, z = mpu.acceleration
+        velocity = max(0.0, velocity + z * sampling)
+        rad = math.radians(heading)
+        x += math.sin(rad) * velocity * sampling
+        y += -math.cos(rad) * velocity * sampling
+
+        logger.debug(f"x: {x:.2f} y: {y:.2f} heading: {heading:.1f} curvature: {curvature:.2f}")
+
+    # Turn the motors off
+    TB.MotorsOff()
+
+    mpu.orientation_flag = False
+
+    return float(x), float(y), heading
@@ -0,0 +1,2 @@
+from vision.camera import PiCameraCapture
+from vision.floor import FloorSegmenter, GroundProjection, ObstacleWorker
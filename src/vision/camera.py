@@ -0,0 +1,33 @@
+"""Pi camera frame capture for the vision worker."""
+
+from threading import Lock
+
+import numpy as np
+import picamera
+
+
+class PiCameraCapture:
+    """Capture RGB frames from the Pi camera's video port, for the vision worker.
+
+    Constructor Arguments:
+        resolution: (width, height) of frames, width a multiple of 32 and height of 16
+        rotation: camera rotation in degrees, 180 when mounted upside down
+        framerate: video port frame rate
+
+    Methods:
+        close: release the camera
+    """
+
+    def __init__(self, resolution=(320, 240), rotation=180, framerate=10):
+        self.camera = picamera.PiCamera(resolution=resolution, framerate=framerate)
+        self.camera.rotation = rotation  # rotated by the camera, not per frame
+        self.frame = np.empty((resolution[1], resolution[0], 3), dtype=np.uint8)
+        self.lock = Lock()  # shared by the vision worker and door inspection
+
+    def __call__(self):
+        with self.lock:
+            self.camera.capture(self.frame, format="rgb", use_video_port=True)
+            return self.frame.copy()
+
+    def close(self):
+        self.camera.close()
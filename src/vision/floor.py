@@ -0,0 +1,402 @@
+"""Camera obstacle detection, by floor segmentation and ground-plane projection.
+
+Pixels are classed as floor by their colour, learnt from the patch of floor
+just ahead of the robot. Scanning each image column up from the bottom, the
+first run of non-floor pixels is the base of whatever stands on the floor
+there. Projecting grid cells a few cells ahead onto the image then shows
+which cells are open floor, which hold the base of an obstacle, and which are
+hidden behind one, so obstacles are found well before the ultrasonic sensor
+would reach them.
+"""
+
+import logging
+import math
+import time
+from queue import Empty, Queue
+from threading import Thread
+
+import numpy as np
+
+
+class GroundProjection:
+    """Pinhole camera model mapping points on the floor to pixels.
+
+    Constructor Arguments:
+        image_size: (width, height) of captured frames, in pixels
+        height: camera height above the floor, in metres
+        pitch: downward tilt of the camera, in degrees
+        hfov: horizontal field of view, in degrees, 62.2 for the Pi camera v2
+        vfov: vertical field of view, in degrees, 48.8 for the Pi camera v2
+        offset: distance of the camera ahead of the robot's centre, in metres
+
+    Methods:
+        project: pixel coordinates of floor points
+        unproject: floor points seen at pixels
+    """
+
+    def __init__(self, image_size=(320, 240), height=0.15, pitch=20.0, hfov=62.2, vfov=48.8, offset=0.1):
+        self.width, self.height_px = image_size
+        self.camera_height = height
+        self.pitch = math.radians(pitch)
+        self.offset = offset
+
+        self.fx = (self.width / 2) / math.tan(math.radians(hfov) / 2)
+        self.fy = (self.height_px / 2) / math.tan(math.radians(vfov) / 2)
+        self.cx = self.width / 2
+        self.cy = self.height_px / 2
+
+    def project(self, forward, right):
+        """Pixel coordinates of points on the floor.
+
+        Args:
+            forward (np.ndarray): distance ahead of the robot's centre, in metres
+            right (np.ndarray): distance to the robot's right, in metres
+
+        Returns:
+            tuple: column and row of each point, and whether it falls within the image
+        """
+        forward = np.asarray(forward, dtype=float) - self.offset
+        right = np.asarray(right, dtype=float)
+
+        # camera axes: x right, y down the image, z along the optical axis, tilted down by pitch
+        sin, cos = math.sin(self.pitch), math.cos(self.pitch)
+        z = forward * cos + self.camera_height * sin
+        y = -forward * sin + self.camera_height * cos
+
+        ahead = z > 1e-6
+        z = np.where(ahead, z, 1.0)
+        u = self.cx + self.fx * right / z
+        v = self.cy + self.fy * y / z
+
+        visible = ahead & (u >= 0) & (u < self.width) & (v >= 0) & (v < self.height_px)
+        return u.astype(int), v.astype(int), visible
+
+    def unproject(self, u, v):
+        """Floor points seen at pixels, the inverse of project.
+
+        Args:
+            u (np.ndarray): pixel columns
+            v (np.ndarray): pixel rows
+
+        Returns:
+            tuple: distance ahead of the robot's centre and to its right (metres),\
+                and whether each pixel looks down at the floor rather than above the horizon
+        """
+        x = (np.asarray(u, dtype=float) - self.cx) / self.fx
+        y = (np.asarray(v, dtype=float) - self.cy) / self.fy
+
+        # ray direction ahead, right and up, for a camera tilted down by pitch
+        sin, cos = math.sin(self.pitch), math.cos(self.pitch)
+        ahead = cos - y * sin
+        up = -sin - y * cos
+
+        floor = up < -1e-6
+        t = np.where(floor, self.camera_height / np.where(floor, -up, 1.0), 0.0)
+        return self.offset + t * ahead, t * x, floor
+
+
+class FloorSegmenter:
+    """Class pixels as floor by colour, learning the floor from the patch just ahead of the robot.
+
+    Colour is binned by chromaticity and coarse brightness, so shading and
+    shadows change a pixel's bin less than a change of material does.
+
+    Constructor Arguments:
+        bins: chromaticity bins per channel
+        brightness_bins: brightness bins
+        reference: (rows, columns) fractions of the image, from the bottom and centre,\
+            assumed to be floor and used to learn its colour
+        threshold: fraction of the most common floor bin's frequency counted as floor
+        alpha: weight of each new frame in the learnt floor colour, 0 to 1
+        min_run: rows of non-floor pixels that mark an obstacle, so specks are ignored
+        smoothing: side of the window pixels are classed by majority over, odd
+
+    Methods:
+        learn: update the floor colour from a frame
+        segment: floor mask of a frame
+        boundary: row of the nearest obstacle base in each column
+    """
+
+    def __init__(self, bins=16, brightness_bins=4, reference=(0.15, 0.4), threshold=0.05, alpha=0.3, min_run=3, smoothing=5):
+        self.bins = bins
+        self.brightness_bins = brightness_bins
+        self.reference = reference
+        self.threshold = threshold
+        self.alpha = alpha
+        self.min_run = min_run
+        self.smoothing = smoothing
+
+        self.histogram = None
+
+    def _bins(self, frame):
+        frame = frame.astype(np.float32)
+        total = frame.sum(axis=2) + 1e-6
+        r = np.minimum((frame[..., 0] / total * self.bins).astype(int), self.bins - 1)
+        g = np.minimum((frame[..., 1] / total * self.bins).astype(int), self.bins - 1)
+        brightness = np.minimum((total / (3 * 256) * self.brightness_bins).astype(int), self.brightness_bins - 1)
+        return (r * self.bins + g) * self.brightness_bins + brightness
+
+    def learn(self, frame):
+        """Update the floor colour from the reference patch of a frame.
+
+        Args:
+            frame (np.ndarray): RGB image, height x width x 3
+        """
+        height, width = frame.shape[:2]
+        rows = max(int(height * self.reference[0]), 1)
+        columns = max(int(width * self.reference[1]), 1)
+        left = (width - columns) // 2
+        patch = frame[height - rows:, left:left + columns]
+
+        histogram = np.bincount(self._bins(patch).ravel(), minlength=self.bins * self.bins * self.brightness_bins)
+
+        # spread each bin to its chromaticity neighbours, so floor colours just missing from the patch still count
+        histogram = histogram.reshape(self.bins, self.bins, self.brightness_bins)
+        padded = np.pad(histogram, ((1, 1), (1, 1), (0, 0)))
+        histogram = np.max(
+            [padded[1 + i:1 + i + self.bins, 1 + j:1 + j + self.bins] for i in (-1, 0, 1) for j in (-1, 0, 1)], axis=0
+        ).ravel()
+        histogram = histogram / histogram.max()
+
+        if self.histogram is None:
+            self.histogram = histogram
+        else:
+            self.histogram = self.alpha * histogram + (1 - self.alpha) * self.histogram
+
+    def segment(self, frame):
+        """Floor mask of a frame.
+
+        Args:
+            frame (np.ndarray): RGB image, height x width x 3
+
+        Returns:
+            np.ndarray: True where a pixel looks like floor
+        """
+        if self.histogram is None:
+            self.learn(frame)
+        floor = self.histogram[self._bins(frame)] >= self.threshold
+
+        # majority over a small window, so isolated misclassified pixels do not read as obstacles
+        k = self.smoothing
+        padded = np.pad(floor.astype(np.int32), ((k // 2 + 1, k // 2), (k // 2 + 1, k // 2)), mode="edge")
+        padded[0, :] = 0
+        padded[:, 0] = 0
+        total = padded.cumsum(axis=0).cumsum(axis=1)
+        window = total[k:, k:] - total[:-k, k:] - total[k:, :-k] + total[:-k, :-k]
+        return window * 2 > k * k
+
+    def boundary(self, floor):
+        """Row of the nearest obstacle base in each column.
+
+        Args:
+            floor (np.ndarray): floor mask, see segment
+
+        Returns:
+            np.ndarray: for each column, the lowest row starting a run of min_run\
+                non-floor pixels, -1 where the column is floor to the top
+        """
+        height, width = floor.shape
+        obstacle = ~floor[::-1].astype(bool)  # scan from the bottom of the image up
+
+        # a row starts a run if it and the min_run - 1 rows above it are all non-floor
+        run = obstacle[:height - self.min_run + 1].copy()
+        for i in range(1, self.min_run):
+            run &= obstacle[i:height - self.min_run + 1 + i]
+
+        found = run.any(axis=0)
+        first = run.argmax(axis=0)
+        return np.where(found, height - 1 - first, -1)
+
+
+class ObstacleWorker(Thread):
+    """Classify the cells ahead of the robot from camera frames, in the background.
+
+    Frames are only used while a pose is set, so the owner clears it whenever
+    the robot moves. Cells must be seen blocked in `confirm` frames before they
+    are reported, and a frame seeing them as floor resets the count.
+
+    Constructor Arguments:
+        capture: function returning an RGB frame, see vision.camera
+        projection: GroundProjection for the camera
+        segmenter: FloorSegmenter, defaults to a new one
+        cell_size: size of a grid cell, in metres
+        max_range: furthest cell to classify, in cells
+        samples: points sampled per side of each cell
+        min_columns: image columns an obstacle base must span to block a cell
+        min_share: fraction of a cell's width in the image an obstacle base must span to block it
+        poll: pause between frames, in seconds
+        confirm: frames a cell must be seen blocked in before it is reported
+        logger: logger for each reported cell
+
+    Methods:
+        observe: classify the cells ahead in one frame
+        obstacles: take every cell reported blocked since the last call
+        free_cells: take every cell reported free since the last call
+    """
+
+    def __init__(self, capture, projection, segmenter=None, cell_size=0.5, max_range=4, samples=4, min_columns=3, min_share=0.2, poll=0.3, confirm=2, logger=None):
+        Thread.__init__(self)
+
+        self.capture = capture
+        self.projection = projection
+        self.segmenter = segmenter or FloorSegmenter()
+        self.cell_size = cell_size
+        self.max_range = max_range
+        self.min_columns = min_columns
+        self.min_share = min_share
+        self.poll = poll
+        self.confirm = confirm
+        self.logger = logger
+
+        # sample points within a cell, as offsets from its centre, in cells
+        offsets = (np.arange(samples) + 0.5) / samples - 0.5
+        self.offsets = np.array([(dx, dy) for dx in offsets for dy in offsets]) * 0.9
+
+        self.pose = None    # (x, y, heading) while the robot is stationary, None while it moves
+        self.counts = {}    # consecutive frames each cell has been seen blocked
+        self.clear_counts = {}  # consecutive frames each cell has been seen free
+        self.reported = set()   # reported blocked, and not seen free since
+        self.freed = set()      # reported free, and not seen blocked since
+        self.queue = Queue()
+        self.free = Queue()
+
+        self.terminated = False
+
+    @staticmethod
+    def _axes(heading):
+        theta = math.radians(heading)
+        forward = np.array([math.sin(theta), -math.cos(theta)])  # heading 0 is North, decreasing y
+        right = np.array([math.cos(theta), math.sin(theta)])
+        return forward, right
+
+    def _cells_ahead(self, x, y, heading):
+        # every cell within range, with its sample points in the robot's frame (metres)
+        forward, right = self._axes(heading)
+
+        cells = [
+            (x + i, y + j)
+            for i in range(-self.max_range, self.max_range + 1)
+            for j in range(-self.max_range, self.max_range + 1)
+            if (i, j) != (0, 0) and (i * forward[0] + j * forward[1]) > 0
+        ]
+        points = (np.array(cells, dtype=float)[:, None, :] + self.offsets[None, :, :]) - (x, y)
+        points *= self.cell_size
+        return cells, points @ forward, points @ right
+
+    def observe(self, frame, pose):
+        """Classify the cells ahead in one frame.
+
+        Args:
+            frame (np.ndarray): RGB image from the camera
+            pose (tuple): cell x, y and heading (degrees, clockwise from North) when it was taken
+
+        Returns:
+            tuple: sets of (x, y) cells seen blocked and seen free
+        """
+        floor = self.segmenter.segment(frame)
+        boundary = self.segmenter.boundary(floor)
+        margin = self.segmenter.min_run
+        x, y, heading = pose
+        forward_axis, right_axis = self._axes(heading)
+
+        # blocked, the cells holding each column's obstacle base, projected back onto the floor
+        columns = np.nonzero(boundary >= 0)[0]
+        ahead, right, on_floor = self.projection.unproject(columns, boundary[columns])
+        ahead, right = ahead[on_floor], right[on_floor]
+        length = np.maximum(np.hypot(ahead, right), 1e-6)
+        nudge = 0.05 * self.cell_size / length  # just past the base, into the obstacle's cell
+        points = np.outer(ahead * (1 + nudge), forward_axis) + np.outer(right * (1 + nudge), right_axis)
+        hits = {}
+        for cell_x, cell_y in np.rint(points / self.cell_size + (x, y)).astype(int):
+            if max(abs(cell_x - x), abs(cell_y - y)) <= self.max_range:
+                hits[(int(cell_x), int(cell_y))] = hits.get((int(cell_x), int(cell_y)), 0) + 1
+        # a cell is only blocked if the base spans a fair share of the cell's width in the image,
+        # so a base grazing the corner of a neighbouring cell does not block it
+        blocked = set()
+        for (cell_x, cell_y), count in hits.items():
+            distance = max(math.hypot(cell_x - x, cell_y - y) * self.cell_size - self.projection.offset, self.cell_size)
+            width = self.projection.fx * self.cell_size / distance
+            if count >= max(self.min_columns, self.min_share * width):
+                blocked.add((cell_x, cell_y))
+
+        # free, cells whose visible floor is all below the boundary, so open floor
+        cells, forward, right = self._cells_ahead(x, y, heading)
+        u, v, visible = self.projection.project(forward, right)
+        edge = boundary[np.clip(u, 0, len(boundary) - 1)]
+        free = visible & ((edge < 0) | (v > edge + margin))
+
+        clear = set()
+        samples = self.offsets.shape[0]
+        for cell, cell_free, cell_visible in zip(cells, free, visible):
+            if cell not in blocked and cell_visible.sum() >= samples / 2 and cell_free.sum() == cell_visible.sum():
+                clear.add(cell)
+
+        # the cell just ahead is open floor, so keep the floor colour current with the lighting
+        theta = math.radians(pose[2])
+        ahead = (pose[0] + int(round(math.sin(theta))), pose[1] - int(round(math.cos(theta))))
+        if ahead in clear:
+            self.segmenter.learn(frame)
+
+        return blocked, clear
+
+    @staticmethod
+    def _drain(queue):
+        cells = []
+        while True:
+            try:
+                cells.append(queue.get_nowait())
+            except Empty:
+                return cells
+
+    def obstacles(self):
+        """Take every cell reported blocked since the last call.
+
+        Returns:
+            list: (x, y) cells, oldest first
+        """
+        return self._drain(self.queue)
+
+    def free_cells(self):
+        """Take every cell reported free since the last call, e.g. to reopen cells wrongly blocked.
+
+        Returns:
+            list: (x, y) cells, oldest first
+        """
+        return self._drain(self.free)
+
+    def run(self):
+        while not self.terminated:
+            pose = self.pose
+            if pose is None:
+                time.sleep(0.05)
+                continue
+
+            try:
+                frame = self.capture()
+                if self.pose is not pose:
+                    continue  # moved while capturing, the frame does not match the pose
+
+                blocked, clear = self.observe(frame, pose)
+            except Exception as e:
+                logging.warning(f"Vision failed to capture or classify frame: {e}")
+                time.sleep(self.poll)
+                continue
+
+            for cell in clear:
+                self.counts.pop(cell, None)
+                self.clear_counts[cell] = self.clear_counts.get(cell, 0) + 1
+                if self.clear_counts[cell] >= self.confirm and cell not in self.freed:
+                    self.freed.add(cell)
+                    self.reported.discard(cell)  # may be reported blocked again
+                    self.free.put(cell)
+            for cell in blocked:
+                self.clear_counts.pop(cell, None)
+                self.freed.discard(cell)
+                self.counts[cell] = self.counts.get(cell, 0) + 1
+                if self.counts[cell] >= self.confirm and cell not in self.reported:
+                    self.reported.add(cell)
+                    self.queue.put(cell)
+                    if self.logger:
+                        self.logger.info(f"vision: obstacle at {cell} seen from {pose}")
+
+            time.sleep(self.poll)
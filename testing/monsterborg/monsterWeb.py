@@ -23,6 +23,8 @@ displayRate = 10                        # Number of images to request per second
 photoDirectory = '/home/pi'             # Directory to save photos to
 flippedCamera = True                    # Swap between True and False if the camera image is rotated by 180
 jpegQuality = 80                        # JPEG quality level, smaller is faster, higher looks better (0 to 100)
+encodeBudget = 0.3                      # Fraction of each frame interval the JPEG encode may take, the rest is left for driving
+minJpegQuality = 30                     # Lowest quality the encode budget may reduce jpegQuality to
 
 # Global values
 global TB
@@ -101,9 +103,18 @@ class StreamProcessor(threading.Thread):
         self.stream = picamera.array.PiRGBArray(camera)
         self.event = threading.Event()
         self.terminated = False
+        self.quality = jpegQuality
         self.start()
         self.begin = 0
 
+    def AdaptQuality(self, encodeTime):
+        # Trade quality for encode time, keeping within the encode budget of each frame interval
+        budget = encodeBudget / frameRate
+        if encodeTime > budget and self.quality > minJpegQuality:
+            self.quality = max(self.quality - 5, minJpegQuality)
+        elif encodeTime < budget * 0.5 and self.quality < jpegQuality:
+            self.quality = min(self.quality + 1, jpegQuality)
+
     def run(self):
         global lastFrame
         global lockFrame
@@ -114,12 +125,10 @@ class StreamProcessor(threading.Thread):
                 try:
                     # Read the image and save globally
                     self.stream.seek(0)
-                    if flippedCamera:
-                        flippedArray = cv2.flip(self.stream.array, -1) # Flips X and Y
-                        retval, thisFrame = cv2.imencode('.jpg', flippedArray, [cv2.IMWRITE_JPEG_QUALITY, jpegQuality])
-                        del flippedArray
-                    else:
-                        retval, thisFrame = cv2.imencode('.jpg', self.stream.array, [cv2.IMWRITE_JPEG_QUALITY, jpegQuality])
+                    # The camera rotates the image itself, see camera.rotation below
+                    encodeStart = time.time()
+                    retval, thisFrame = cv2.imencode('.jpg', self.stream.array, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    self.AdaptQuality(time.time() - encodeStart)
                     lockFrame.acquire()
                     lastFrame = thisFrame
                     lockFrame.release()
@@ -452,6 +461,8 @@ print 'Setup camera'
 camera = picamera.PiCamera()
 camera.resolution = (imageWidth, imageHeight)
 camera.framerate = frameRate
+if flippedCamera:
+    camera.rotation = 180               # Rotated by the camera, rather than flipping a copy of every frame
 
 print 'Setup the stream processing thread'
 processor = StreamProcessor()
@@ -0,0 +1,218 @@
+"""Compact binary protocol for streaming the map and robot pose to the web UI.
+
+Every message starts with a type byte and a map sequence number, then:
+
+    SNAPSHOT  width, height, then (length, value) runs covering every cell row by row
+    DELTA     run count, then (start index, length, value) runs of changed cells
+    POSES     pose count, then (milliseconds, x, y, heading) of each pose since the last batch
+
+All fields are little-endian, see the struct formats below and the decoder in
+public/index.html. Dashboards apply a delta only if its sequence number
+follows the last map message they applied, and otherwise send a mapRequest
+for a new snapshot. The server answers those from its cache of the latest
+snapshot and the deltas since, so the robot sends each message once however
+many dashboards are watching.
+"""
+
+import asyncio
+import struct
+import time
+
+SNAPSHOT = 1
+DELTA = 2
+POSES = 3
+
+HEADER = struct.Struct("<BI")  # type, sequence number
+SIZE = struct.Struct("<HH")  # width, height
+SNAPSHOT_RUN = struct.Struct("<HB")  # length, value
+COUNT = struct.Struct("<H")
+DELTA_RUN = struct.Struct("<IHB")  # start index (row major), length, value
+POSE_COUNT = struct.Struct("<B")
+POSE = struct.Struct("<Ihhh")  # milliseconds (wrapping), x, y, heading in degrees
+
+MAX_RUN = 0xFFFF
+MAX_POSES = 0xFF
+
+
+def runs(indexed):
+    """Run-length encode equal values at consecutive indices.
+
+    Args:
+        indexed (iterable): (index, value) pairs in increasing index order, values 0-255
+
+    Returns:
+        list: (start index, length, value) of each run, no longer than MAX_RUN
+    """
+    encoded = []
+    for index, value in indexed:
+        last = encoded[-1] if encoded else None
+        if last and last[2] == value and last[0] + last[1] == index and last[1] < MAX_RUN:
+            last[1] += 1
+        else:
+            encoded.append([index, 1, value])
+    return [tuple(run) for run in encoded]
+
+
+def encode_snapshot(seq, cells):
+    """Every cell of the map, row by row.
+
+    Args:
+        seq (int): map sequence number
+        cells (list): map indexed cells[y][x], values 0-255
+
+    Returns:
+        bytes: the message
+    """
+    height, width = len(cells), len(cells[0])
+    flat = (value & 0xFF for row in cells for value in row)
+    return b"".join(
+        [HEADER.pack(SNAPSHOT, seq), SIZE.pack(width, height)]
+        + [SNAPSHOT_RUN.pack(length, value) for _, length, value in runs(enumerate(flat))]
+    )
+
+
+def encode_delta(seq, changes, width):
+    """Changed cells, merged into runs where consecutive cells share a value.
+
+    Args:
+        seq (int): map sequence number, one more than the previous map message
+        changes (dict): new value of each changed cell, by (x, y)
+        width (int): map width in cells
+
+    Returns:
+        bytes: the message
+    """
+    encoded = runs(sorted((y * width + x, value & 0xFF) for (x, y), value in changes.items()))
+    return b"".join(
+        [HEADER.pack(DELTA, seq), COUNT.pack(len(encoded))]
+        + [DELTA_RUN.pack(*run) for run in encoded]
+    )
+
+
+def encode_poses(seq, poses):
+    """A batch of poses, oldest first.
+
+    Args:
+        seq (int): map sequence number the poses refer to
+        poses (list): (milliseconds, x, y, heading) of each pose, at most MAX_POSES
+
+    Returns:
+        bytes: the message
+    """
+    return b"".join(
+        [HEADER.pack(POSES, seq), POSE_COUNT.pack(len(poses))]
+        + [POSE.pack(ms & 0xFFFFFFFF, x, y, round(heading) % 360) for ms, x, y, heading in poses]
+    )
+
+
+def decode(data):
+    """Decode a message, the inverse of the encode functions, e.g. for logging or tests.
+
+    Returns:
+        dict: the type, seq and fields of the message
+    """
+    kind, seq = HEADER.unpack_from(data)
+    offset = HEADER.size
+
+    if kind == SNAPSHOT:
+        width, height = SIZE.unpack_from(data, offset)
+        offset += SIZE.size
+        flat = []
+        while offset < len(data):
+            length, value = SNAPSHOT_RUN.unpack_from(data, offset)
+            offset += SNAPSHOT_RUN.size
+            flat.extend([value] * length)
+        cells = [flat[y * width:(y + 1) * width] for y in range(height)]
+        return {"type": SNAPSHOT, "seq": seq, "cells": cells}
+
+    if kind == DELTA:
+        (count,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        cell_runs = [DELTA_RUN.unpack_from(data, offset + i * DELTA_RUN.size) for i in range(count)]
+        return {"type": DELTA, "seq": seq, "runs": cell_runs}
+
+    if kind == POSES:
+        (count,) = POSE_COUNT.unpack_from(data, offset)
+        offset += POSE_COUNT.size
+        poses = [POSE.unpack_from(data, offset + i * POSE.size) for i in range(count)]
+        return {"type": POSES, "seq": seq, "poses": poses}
+
+    raise ValueError(f"Unknown message type {kind}")
+
+
+class UiStream:
+    """Publish the map and robot pose to the UI, sending only what changed at a capped rate.
+
+    Cell changes and poses are collected between flushes: a cell changed
+    several times is sent once with its latest value, or not at all if it
+    ends up as last sent, and the poses since the last flush go in one batch.
+
+    Constructor Arguments:
+        cells: map indexed cells[y][x], values 0-255
+        send: coroutine function sending a message to the server
+        rate: most flushes per second
+        max_poses: poses kept between flushes, the oldest are dropped first
+
+    Methods:
+        send_snapshot: send every cell, e.g. on connecting or when a dashboard is out of step
+        set_cells: change cells, sent as a delta on the next flush
+        pose: record a pose, sent in a batch on the next flush
+        flush: send any pending delta and poses now
+        run: flush at the capped rate until cancelled
+    """
+
+    def __init__(self, cells, send, rate=5.0, max_poses=32):
+        self.cells = [list(row) for row in cells]  # as last sent
+        self.send = send
+        self.period = 1.0 / rate
+        self.max_poses = min(max_poses, MAX_POSES)
+
+        self.seq = 0
+        self.pending = {}  # (x, y): value, changed since the last flush
+        self.poses = []
+        self.start = time.monotonic()
+        self.sent_bytes = 0
+
+    async def _send(self, message):
+        self.sent_bytes += len(message)
+        await self.send(message)
+
+    async def send_snapshot(self):
+        # pending changes are included, so must not be sent again as a delta
+        for (x, y), value in self.pending.items():
+            self.cells[y][x] = value
+        self.pending = {}
+
+        self.seq += 1
+        await self._send(encode_snapshot(self.seq, self.cells))
+
+    def set_cells(self, changes):
+        """Change cells, to be sent on the next flush.
+
+        Args:
+            changes (list): (x, y, value) of each cell
+        """
+        for x, y, value in changes:
+            self.pending[(x, y)] = value
+
+    def pose(self, x, y, heading):
+        self.poses.append((int((time.monotonic() - self.start) * 1000), x, y, heading))
+        del self.poses[:-self.max_poses]
+
+    async def flush(self):
+        changes = {cell: value for cell, value in self.pending.items() if self.cells[cell[1]][cell[0]] != value}
+        self.pending = {}
+        if changes:
+            for (x, y), value in changes.items():
+                self.cells[y][x] = value
+            self.seq += 1
+            await self._send(encode_delta(self.seq, changes, len(self.cells[0])))
+
+        if self.poses:
+            poses, self.poses = self.poses, []
+            await self._send(encode_poses(self.seq, poses))
+
+    async def run(self):
+        while True:
+            await self.flush()
+            await asyncio.sleep(self.period)
@@ -119,6 +119,15 @@ window.addEventListener('keydown', function (e) {
             cursor = rotation_ascii(angle);
             box.update(cursor);
             break;
+        case 'x':
+            // toggle a wall under the cursor, the robot sends the change back to every dashboard
+            if (mapCells && box.x < mapWidth && box.y < mapHeight) {
+                socket.emit('json', JSON.stringify({
+                    'idKey': 'mapEdit',
+                    'cells': [[box.x, box.y, mapCells[box.y * mapWidth + box.x] > 0 ? 0 : 1]]
+                }));
+            }
+            break;
         case 'e':
             angle += 5;
             if (angle >= 360) {
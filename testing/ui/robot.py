@@ -1,25 +1,23 @@
 import asyncio
 import json
 import logging
-import queue
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import adafruit_mpu6050
 import board
 import socketio
 
-import pygame
-import threading
-
 import ThunderBorg3 as ThunderBorg  # conversion for python 3
 from algorithms.algorithm import Algorithm
 
-from pathfinding.core.grid import Grid
+from protocol import UiStream
 
 from robot.accelerometer import perform_drive
 from robot.gyroscope import perform_spin
-from robot.drive import follow, pathing, get_move_string, calculate_angle
+from robot.drive import pathing, get_move_string, calculate_angle
 
 from mpu6050 import MPU6050
 
@@ -72,14 +70,30 @@ else:
 # asyncio
 sio = socketio.AsyncClient()
 
-curr_position = (0, 0)
+curr_position = [0, 0]
 matrix = [[1, 0, 1, 1], [1, 0, 1, 0], [1, 0, 1, 1], [1, 0, 0, 1], [1, 1, 1, 1]]
 
-instruction_queue = queue.Queue()
-emitQueue = queue.Queue()
+# blocking I2C/GPIO calls run here, bounded so they cannot pile up behind a slow bus
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="io")
+
+# created in main(), once the event loop is running
+instruction_queue = None
+emit_queue = None  # (event, data) pairs
+ui = None  # map and pose stream to the dashboards, see protocol
+idle = None  # set while no action is running, so plans start from where the last one stopped
+
+# set to stop the running action within one control tick, when a new plan arrives
+cancel = threading.Event()
+plan_generation = 0  # instructions from older plans are discarded
+curr_angle = 0
+
+TELEMETRY_PERIOD = 5.0  # seconds between battery/orientation updates
+UI_RATE = 5.0  # most map/pose updates per second, however often the robot moves
+
 
 @sio.on("*")
 async def catch_all(event, data):
+    global plan_generation
     logging.info(data)
     json_data = json.loads(data)
 
@@ -88,35 +102,49 @@ async def catch_all(event, data):
         destination = json_data["dest"]
         angle = json_data["angle"]
 
-        # calculate movement to new position
-        alg = Algorithm(matrix, curr_position, destination)
-        path = alg.use_a_star()
-        instructions = pathing(path, 1)
-
-        # add instructions to movement queue
-
+        # replace any instructions not yet started with the new plan, and stop the running one
+        plan_generation += 1
+        generation = plan_generation
+        cancel.set()
         while not instruction_queue.empty():
-            instruction_queue.get()
+            instruction_queue.get_nowait()
             instruction_queue.task_done()
+        await idle.wait()  # the running action has stopped and recorded how far it got
+
+        # calculate movement to new position
+        alg = Algorithm(matrix, tuple(curr_position), destination)
+        path = alg.use_a_star()
+        instructions = pathing(list(path), 1, curr_angle=curr_angle)
 
-        for path, instruction in list(zip(path, instructions)):
-            instruction_queue.put((path, instruction))
+        for instruction in instructions:
+            instruction_queue.put_nowait((generation, instruction))
 
         print(instruction_queue.qsize())
 
+    elif "idKey" in json_data and json_data["idKey"] == "mapEdit":
+        # cells edited on a dashboard, later plans use the new map and every dashboard is sent the change
+        changes = [
+            (x, y, value) for x, y, value in json_data["cells"]
+            if 0 <= y < len(matrix) and 0 <= x < len(matrix[0])
+        ]
+        for x, y, value in changes:
+            matrix[y][x] = value
+        ui.set_cells(changes)
+
     elif "idKey" in json_data and json_data["idKey"] == "mapRequest":
-        grid = Grid(matrix=matrix)
-        emitQueue.put(json.dumps({'idKey': 'mapUpdate', 'map': grid.grid_str()}))
+        # only reaches the robot when the server has no snapshot cached to answer with
+        await ui.send_snapshot()
 
 
 @sio.event
-async def disconnect():
-    logging.warning("disconnected from server")
+async def connect():
+    # the server may have restarted, so start its cache afresh
+    await ui.send_snapshot()
 
 
 @sio.event
-async def send_json(data):
-    await sio.emit("json", json.dumps())
+async def disconnect():
+    logging.warning("disconnected from server")
 
 
 async def listen():
@@ -124,63 +152,97 @@ async def listen():
 
 
 async def talk():
-    while 1:
-        if not emitQueue.empty():
-            data = emitQueue.get()  # poll queue for instruction
-
-            await sio.emit(
-                "json", data,
-            )  # emit new location to server
-            emitQueue.task_done()
+    """Emit queued messages to the server as soon as they are queued."""
+    while True:
+        event, data = await emit_queue.get()
+        await sio.emit(event, data)
+        emit_queue.task_done()
+
+
+async def emit_ui(message):
+    await emit_queue.put(("ui", message))  # binary, see protocol
+
+
+async def follow():
+    """Execute queued instructions, offloading the blocking motor loops to the executor.
+
+    Each action is preemptible: a new plan sets `cancel`, and the action stops its
+    motors at its next sample instead of running to completion. A preempted spin
+    leaves the heading tracked by the gyroscope, and a preempted drive the nearest
+    cell, for the new plan to start from.
+    """
+    global curr_angle
+    loop = asyncio.get_running_loop()
+    print('Waiting for instructions..')
+
+    while True:
+        generation, instruction = await instruction_queue.get()
+
+        if generation != plan_generation:  # superseded while waiting
+            instruction_queue.task_done()
+            continue
+        cancel.clear()
+
+        # drive instructions carry the cell they end in, spins do not
+        if isinstance(instruction[0], tuple):
+            position, (action, arg) = instruction
         else:
-            print("sleep")
-            await asyncio.sleep(0.5)
+            position, (action, arg) = None, instruction
+        print("Action: ", action, arg)
+
+        idle.clear()
+        result = await loop.run_in_executor(executor, partial(action, *arg, TB, mpu, max_power, cancel=cancel))
+
+        if not cancel.is_set():
+            if action is perform_spin:
+                curr_angle = arg[1]
+            if position:
+                curr_position[:] = position
+        elif action is perform_spin:
+            curr_angle = mpu.orientation  # preempted part way round
+        elif position and result >= arg[0] / 2:
+            curr_position[:] = position  # preempted nearer the next cell than the last
+
+        idle.set()
+        ui.pose(curr_position[0], curr_position[1], curr_angle)  # sent in the next batch
+        instruction_queue.task_done()
+
+
+async def sense():
+    """Report battery level and orientation at a fixed telemetry rate."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        voltage = await loop.run_in_executor(executor, TB.GetBatteryReading)
+        await emit_queue.put(
+            ("json", json.dumps({'idKey': 'sensorUpdate', 'battery': voltage, 'orientation': mpu.orientation}))
+        )
+        await asyncio.sleep(TELEMETRY_PERIOD)
+
 
 async def main(url):
+    global instruction_queue, emit_queue, ui, idle
+    instruction_queue = asyncio.Queue()
+    emit_queue = asyncio.Queue()
+    idle = asyncio.Event()
+    idle.set()
+    ui = UiStream(matrix, emit_ui, rate=UI_RATE)
+
     await sio.connect(url)
 
-    coroutines = [listen(), talk()]
+    coroutines = [listen(), talk(), follow(), sense(), ui.run()]
     res = await asyncio.gather(*coroutines, return_exceptions=True)
 
     return res
 
-class Follow(threading.Thread):
-    def __init__(self):
-        super(Follow, self).__init__()
-        self.terminated = False
-        self.start()
- 
-    def run(self):
-        print('Waiting for instructions..')
-        while not self.terminated:
-            if not instruction_queue.empty():
-                (x, y), (action, arg) = instruction_queue.get()  # poll queue for instruction
-                print("Action: ", action, arg)
-
-                action(*arg, TB, mpu, max_power)  # execute instruction
-
-                curr_position[:] = (x, y)
-
-                emitQueue.put(
-                    json.dumps(
-                        {'idKey': 'robotUpdate', 'x': x, 'y': y}
-                    )
-                )  # emit new location to server
-                instruction_queue.task_done()
-            else:
-                print("sleep")
-                time.sleep(0.5)
-
 
 if __name__ == "__main__":
     try:
         logging.basicConfig(level=logging.DEBUG)
 
-        followthread = Follow()
-
         url = sys.argv[1]
 
-        res1, res2 = asyncio.get_event_loop().run_until_complete(main(url))
+        asyncio.run(main(url))
     except:
         TB.SetCommsFailsafe(False)
         TB.SetLeds(0,0,0)
@@ -188,8 +250,8 @@ if __name__ == "__main__":
 
         # end sensor thread
         mpu.join()
-        followthread.join()
+        executor.shutdown(wait=False)
 
         # exit program
         logging.debug("Stopped")
-        sys.exit()
\ No newline at end of file
+        sys.exit()
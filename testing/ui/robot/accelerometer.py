@@ -13,12 +13,20 @@ import ThunderBorg3 as ThunderBorg  # conversion for python 3
 import logging
 
 # Function to drive a distance in meters
-def perform_drive(meters, TB, mpu, max_power):
+def perform_drive(meters, TB, mpu, max_power, cancel=None):
     """Drive a distance in meters.
 
     Args:
         meters (float): distance to drive in meters.
+        cancel (threading.Event, optional): stop within one sample once set, defaults to None.
+
+    Returns:
+        float: distance driven in meters, short of the target if preempted.
     """
+
+    if cancel is not None and cancel.is_set():
+        return 0.0  # preempted before starting
+
     power = max_power*0.75
 
     if meters < 0.0:
@@ -79,20 +87,31 @@ def perform_drive(meters, TB, mpu, max_power):
                 "Assuming constant velocity of Z:%.2f, sleeping for %.2f seconds to drive %.2f meters"
                 % (velocity, sleep, (meters - total_motion))
             )
-            time.sleep(sleep)
+            if cancel is not None:
+                cancel.wait(sleep)
+            else:
+                time.sleep(sleep)
 
             # NOTE: this will set total motion to target, which is only correct assuming rotation halts immediately and velocity remains constant
             # in non-demo system current orientation should be independently tracked, not adjusted using this approximation
             total_motion += velocity * sleep  # update final rotation for tracking
             break
 
-        time.sleep(sampling)
+        # wait for the next sample, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(sampling):
+                logging.debug("Preempted, stopping motors")
+                break
+        else:
+            time.sleep(sampling)
 
     # Turn the motors off
     TB.MotorsOff()
 
     logging.debug(f"total motion: {total_motion}")
 
+    return total_motion
+
 
 if __name__ == "__main__":
     # enable debug logging
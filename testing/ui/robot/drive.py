@@ -3,7 +3,7 @@
 import math
 
 from robot.accelerometer import perform_drive
-from robot.gyroscope import perform_spin
+from robot.gyroscope import perform_spin, smallestAngle
 
 import time
 import logging
@@ -76,9 +76,10 @@ def pathing(path, unit_size, origin=False, curr_angle=0, final_angle=0):
     Args:
         path (list): a list of tuples representing the path
         unit_size (int): the size of the unit the robot is moving in
-        origin (bool, optional): whether or not the robot is starting at the origin,\
-            defaults to False
+        origin (tuple, optional): the cell the robot is starting in, defaults to False\
+            to start from the first cell of the path
         curr_angle (int, optional): the angle the robot is starting at, defaults to 0
+        final_angle (int, optional): the angle to finish facing, defaults to 0 (North)
 
     Returns:
         list: a list of instructions to be performed by the robot
@@ -88,7 +89,7 @@ def pathing(path, unit_size, origin=False, curr_angle=0, final_angle=0):
 
     instructions = []
 
-    x, y = (0, 0)
+    x, y = origin
 
     for coord in path:
         logging.debug(coord)
@@ -109,9 +110,9 @@ def pathing(path, unit_size, origin=False, curr_angle=0, final_angle=0):
 
         target_angle = calculate_angle(unit_target_vector)
 
-        delta_angle = (
-            target_angle - curr_angle
-        )  # calculate the difference in between the current and the target angle
+        delta_angle = smallestAngle(
+            curr_angle, target_angle
+        )  # calculate the shortest turn between the current and the target angle
 
         if abs(delta_angle) > 0:
             instructions.append(
@@ -143,28 +144,41 @@ def pathing(path, unit_size, origin=False, curr_angle=0, final_angle=0):
     )  # rotate the car to match the target angle by rotating the remaining distance
     """
 
-    delta_angle = (
-        final_angle - curr_angle
-    )  # calculate the difference in between the current and the target angle
+    delta_angle = smallestAngle(
+        curr_angle, final_angle
+    )  # calculate the shortest turn between the current and the final angle
 
     if abs(delta_angle) > 0:
         instructions.append(
-            (perform_spin, (delta_angle, target_angle))
+            (perform_spin, (delta_angle, final_angle))
         )  # rotate the car to match the target angle by rotating the remaining distance
 
     return instructions
 
 
-def follow(instructions, TB, mpu, max_power):
+def follow(instructions, TB, mpu, max_power, cancel=None):
     """Follows a list of instructions
 
     Args:
         instructions (list): a list of instructions to be performed by the robot
+        cancel (threading.Event, optional): abandon the remaining instructions once set,\
+            stopping the running one within a control tick, defaults to None
+
+    Returns:
+        bool: whether every instruction was completed
     """
 
     for action, arg in instructions:
-        action(*arg, TB, mpu, max_power)
-        time.sleep(0.5)
+        action(*arg, TB, mpu, max_power, cancel=cancel)
+
+        # pause between actions, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(0.5):
+                return False
+        else:
+            time.sleep(0.5)
+
+    return True
 
 
 if __name__ == "__main__":
@@ -187,10 +201,10 @@ if __name__ == "__main__":
     end_node = (3, 0)
     
     # define dummy functions
-    def perform_spin(delta, target, TB, mpu, max_power):
+    def perform_spin(delta, target, TB, mpu, max_power, cancel=None):
         print(f"spin: {delta} deg")
     
-    def perform_drive(meters, TB, mpu, max_power):
+    def perform_drive(meters, TB, mpu, max_power, cancel=None):
         print(f"drive: {meters} m")
 
     def a_star(matrix, start_node, end_node):
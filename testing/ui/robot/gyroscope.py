@@ -13,16 +13,36 @@ import ThunderBorg3 as ThunderBorg  # conversion for python 3
 import logging
 
 
+def smallestAngle(currentAngle, targetAngle):
+    # Subtract the angles, constraining the value to [0, 360)
+    diff = ( targetAngle - currentAngle) % 360
+
+    # If we are more than 180 we're taking the long way around.
+    # Let's instead go in the shorter, negative direction
+    if diff > 180 :
+        diff = -(360 - diff)
+
+    return diff
+
+
 # Function to spin an angle in degrees
-def perform_spin(delta, target, TB, mpu, max_power):
+def perform_spin(delta, target, TB, mpu, max_power, cancel=None):
     """Spin an angle in degrees.
 
     Args:
         delta (float): angle to spin in degrees.
+        target (float): heading to finish facing, the spin is corrected by the heading actually tracked.
+        cancel (threading.Event, optional): stop within one sample once set, defaults to None.
     """
 
+    if cancel is not None and cancel.is_set():
+        return  # preempted before starting
+
     power = max_power * 0.75
 
+    # turn from the heading tracked by the gyroscope, so earlier over or undershoot is corrected
+    delta = smallestAngle(mpu.orientation, target)
+
     if delta < 0.0:
         # Left turn
         drive_left = -1.0
@@ -33,8 +53,7 @@ def perform_spin(delta, target, TB, mpu, max_power):
         drive_left = +1.0
         drive_right = -1.0
 
-    offset = (mpu.orientation + delta) - (target + delta)   # calculate offset from target+delta versus actual+delta
-    delta += offset # update delta with offset to align according to actual initial angle
+    mpu.orientation_flag = True  # track the heading while spinning, read back if preempted
 
     # Set the motors running
     TB.SetMotor1(drive_right * power)
@@ -53,7 +72,7 @@ def perform_spin(delta, target, TB, mpu, max_power):
         sample = mpu.abs_z * sampling
 
         # print("Gyro X:%.2f, Y: %.2f, Z: %.2f rad/s" % (x, y, z))
-        if logging.isEnabledFor(logging.DEBUG):
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
             x, y, z = mpu.gyro
             x, y, z = math.degrees(x), math.degrees(y), math.degrees(z)
             logging.debug(
@@ -80,7 +99,10 @@ def perform_spin(delta, target, TB, mpu, max_power):
                 "Assuming constant rotation of Z:%.2f, sleeping for %.2f seconds to rotate %.2f degrees"
                 % (abs_z, sleep, (delta - total_rotation))
             )
-            time.sleep(sleep)
+            if cancel is not None:
+                cancel.wait(sleep)
+            else:
+                time.sleep(sleep)
 
             # NOTE: this will set total rotation to target, which is only correct \
             # assuming rotation halts immediately and rotational velocity remains constant
@@ -91,10 +113,17 @@ def perform_spin(delta, target, TB, mpu, max_power):
             total_rotation += abs_z * sleep  # update final rotation for tracking
             break
 
-        time.sleep(sampling)
+        # wait for the next sample, waking immediately if preempted
+        if cancel is not None:
+            if cancel.wait(sampling):
+                logging.debug("Preempted, stopping motors")
+                break
+        else:
+            time.sleep(sampling)
 
     # Turn the motors off
     TB.MotorsOff()
+    mpu.orientation_flag = False
 
     logging.debug(f"total rotation: {total_rotation}")
 
@@ -5,6 +5,24 @@ const server = http.createServer(app);
 const { Server } = require("socket.io");
 const io = new Server(server);
 
+// binary UI message types, see protocol.py
+const SNAPSHOT = 1;
+const DELTA = 2;
+const POSES = 3;
+
+// the latest map snapshot and the deltas since, so dashboards joining late
+// catch up from here instead of asking the robot to send the map again
+const MAX_DELTAS = 256;
+let mapCache = [];
+let lastPoses = null;
+
+function replay(socket) {
+  mapCache.forEach((message) => socket.emit('ui', message));
+  if (lastPoses) {
+    socket.emit('ui', lastPoses);
+  }
+}
+
 app.get('/', (req, res) => {
   console.log(__dirname)
   console.log(req.url)
@@ -15,16 +33,51 @@ app.use(express.static('public'))
 
 io.on('connection', (socket) => {
   console.log('a user connected');
+  replay(socket);
+
   socket.on('disconnect', () => {
     console.log('user disconnected');
   });
 
   socket.on('json', (data) => {
     console.log('message: ' + data);
+
+    let message;
+    try {
+      message = JSON.parse(data);
+    }
+    catch (e) {
+      console.log('ignoring malformed message: ' + e.message);
+      return;
+    }
+
+    if (message && message.idKey == 'mapRequest' && mapCache.length > 0) {
+      replay(socket);  // answer from the cache, the robot's uplink is the scarce one
+      return;
+    }
     socket.broadcast.emit('mirror', data);
   });
+
+  socket.on('ui', (data) => {
+    const type = data[0];
+
+    if (type == SNAPSHOT) {
+      mapCache = [data];
+    }
+    else if (type == DELTA && mapCache.length > 0) {
+      mapCache.push(data);
+      if (mapCache.length > MAX_DELTAS) {
+        mapCache = [];  // late joiners will request a fresh snapshot instead
+      }
+    }
+    else if (type == POSES) {
+      lastPoses = data;
+    }
+
+    socket.broadcast.emit('ui', data);
+  });
 });
 
 server.listen(3000, () => {
   console.log('listening on *:3000');
-});
\ No newline at end of file
+});
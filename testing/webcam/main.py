@@ -2,12 +2,15 @@
 # Source code from the official PiCamera package
 # http://picamera.readthedocs.io/en/latest/recipes2.html#web-streaming
 
+import asyncio
+import concurrent.futures
 import io
+import json
 import picamera
 import logging
-import socketserver
-from threading import Condition
-from http import server
+import statistics
+import time
+from threading import Condition, Lock, Thread
 import cv2
 import numpy
 import os
@@ -17,6 +20,7 @@ import os
 #    PAGE = f.read()
 
 
+# the stream is shown untouched, detections are drawn over it from /faces.json
 PAGE = """\
 <html>
 
@@ -28,8 +32,34 @@ PAGE = """\
     <center>
         <h1>Ferret front-facing camera</h1>
         <p>Wave and say hi!</p>
+        <p id="count"></p>
     </center>
-    <center><img src="stream.mjpg" width="640" height="480"></center>
+    <center>
+        <div style="position: relative; width: 640px; height: 480px;">
+            <img src="stream.mjpg" width="640" height="480" style="position: absolute; left: 0; top: 0;">
+            <canvas id="overlay" width="640" height="480" style="position: absolute; left: 0; top: 0;"></canvas>
+        </div>
+    </center>
+    <script>
+        const canvas = document.getElementById("overlay");
+        const ctx = canvas.getContext("2d");
+
+        async function overlay() {
+            try {
+                const result = await (await fetch("faces.json")).json();
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                ctx.strokeStyle = "#00ffff";
+                ctx.lineWidth = 2;
+                const scale = result.size ? canvas.width / result.size[0] : 1;  // stream resolution may change
+                for (const [x, y, w, h] of result.faces) {
+                    ctx.strokeRect(x * scale, y * scale, w * scale, h * scale);
+                }
+                document.getElementById("count").innerText = `${result.faces.length} faces found.`;
+            } catch (e) {}
+            setTimeout(overlay, 200);
+        }
+        overlay();
+    </script>
 </body>
 
 </html>
@@ -41,126 +71,486 @@ haarcascade_frontalface_alt_path = (
 CASCADE = cv2.CascadeClassifier(haarcascade_frontalface_alt_path)
 
 class StreamingOutput(object):
-    def __init__(self):
-        self.frame = None
+    def __init__(self, broadcaster, detector=None):
         self.buffer = io.BytesIO()
-        self.condition = Condition()
+        self.broadcaster = broadcaster
+        self.detector = detector
+        self.frames = 0
+        self.bytes = 0
 
     def write(self, buf):
         if buf.startswith(b"\xff\xd8"):
-            # New frame, copy the existing buffer's content and notify all
-            # clients it's available
+            # New frame, copy the existing buffer's content and hand it to every
+            # client, the same bytes are shared by every client and the detector
             self.buffer.truncate()
-            with self.condition:
-                # perform FR
-                self.frame = FR(self.buffer.getvalue())
-
-                # self.frame = self.buffer.getvalue()
-                self.condition.notify_all()
+            frame = self.buffer.getvalue()
+            self.frames += 1
+            self.bytes += len(frame)
+            self.broadcaster.publish(frame)
+            if self.detector:
+                self.detector.submit(frame)  # never waits on detection
             self.buffer.seek(0)
         return self.buffer.write(buf)
 
 
-class StreamingHandler(server.BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/":
-            self.send_response(301)
-            self.send_header("Location", "/index.html")
-            self.end_headers()
-        elif self.path == "/index.html":
-            content = PAGE.encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.send_header("Content-Length", len(content))
-            self.end_headers()
-            self.wfile.write(content)
-        elif self.path == "/stream.mjpg":
-            self.send_response(200)
-            self.send_header("Age", 0)
-            self.send_header("Cache-Control", "no-cache, private")
-            self.send_header("Pragma", "no-cache")
-            self.send_header(
-                "Content-Type", "multipart/x-mixed-replace; boundary=FRAME"
+class MotionGate(object):
+    """Decide how much of each frame needs a detection, from a cheap frame difference.
+
+    Frames are compared at a low resolution. A static scene reuses the last
+    detections, a changed scene is searched only around the changed pixels and
+    the last detections, and the whole frame is searched every full_scan seconds
+    so nothing is missed for long.
+
+    Constructor Arguments:
+        size: (width, height) frames are reduced to for differencing
+        threshold: grey level change counted as motion, 0 to 255
+        min_changed: fraction of pixels that must change to count the scene as moving
+        margin: fraction of a region's size to grow it by before searching
+        full_scan: longest time between whole frame searches, in seconds
+        max_roi: fraction of the frame above which a whole frame search is cheaper
+    """
+
+    def __init__(self, size=(80, 60), threshold=20, min_changed=0.002, margin=0.5, full_scan=5.0, max_roi=0.5):
+        self.size = size
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.margin = margin
+        self.full_scan = full_scan
+        self.max_roi = max_roi
+
+        self.previous = None
+        self.last_full = 0
+        self.counts = {"static": 0, "roi": 0, "full": 0}
+
+    def _grow(self, region, width, height):
+        x, y, w, h = region
+        dx, dy = int(w * self.margin), int(h * self.margin)
+        x0, y0 = max(x - dx, 0), max(y - dy, 0)
+        x1, y1 = min(x + w + dx, width), min(y + h + dy, height)
+        return [x0, y0, x1 - x0, y1 - y0]
+
+    def _merge(self, regions):
+        # union overlapping regions until none overlap, so no area is searched twice
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    if overlaps(regions[i], regions[j]):
+                        (ax, ay, aw, ah), (bx, by, bw, bh) = regions[i], regions[j]
+                        x0, y0 = min(ax, bx), min(ay, by)
+                        x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+                        regions[i] = [x0, y0, x1 - x0, y1 - y0]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def update(self, gray, faces):
+        """Compare a frame with the last, and choose what to search.
+
+        Args:
+            gray (numpy.ndarray): grayscale frame
+            faces (list): last detections, in gray's coordinates
+
+        Returns:
+            tuple: "static", "roi" or "full", and the regions to search (x, y, w, h)
+        """
+        height, width = gray.shape
+        small = cv2.GaussianBlur(cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA), (3, 3), 0)
+        previous, self.previous = self.previous, small
+
+        now = time.time()
+        if previous is None or now - self.last_full >= self.full_scan:
+            self.last_full = now
+            self.counts["full"] += 1
+            return "full", [[0, 0, width, height]]
+
+        mask = (cv2.absdiff(small, previous) > self.threshold).astype(numpy.uint8)
+        if mask.mean() < self.min_changed:
+            self.counts["static"] += 1
+            return "static", []
+
+        # bounding boxes of the changed pixels, scaled up to the frame
+        sx, sy = width / self.size[0], height / self.size[1]
+        contours, _ = cv2.findContours(cv2.dilate(mask, None), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        regions = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            regions.append([int(x * sx), int(y * sy), int(w * sx) + 1, int(h * sy) + 1])
+        regions.extend(list(face) for face in faces)  # a face may have moved out of a changed region
+
+        regions = self._merge([self._grow(region, width, height) for region in regions])
+
+        if sum(w * h for _, _, w, h in regions) > self.max_roi * width * height:
+            self.last_full = now
+            self.counts["full"] += 1
+            return "full", [[0, 0, width, height]]
+
+        self.counts["roi"] += 1
+        return "roi", regions
+
+
+def overlaps(a, b):
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a, b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+class DetectionWorker(Thread):
+    """Detect faces on the newest frame only, so detection never holds up streaming.
+
+    Frames arriving while a detection runs replace the pending frame, so a slow
+    detection skips frames rather than falling behind.
+
+    Constructor Arguments:
+        scale: JPEG decode reduction, 1, 2, 4 or 8, detection runs on the smaller image
+        gate: MotionGate choosing what to search, None to search every whole frame
+    """
+
+    def __init__(self, scale=2, gate=None):
+        Thread.__init__(self)
+        self.daemon = True
+
+        self.scale = scale
+        self.decode_flag = {
+            1: cv2.IMREAD_GRAYSCALE,
+            2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+        }[scale]
+
+        self.condition = Condition()
+        self.pending = None     # newest frame not yet detected, and when it arrived
+        self.dropped = 0        # frames replaced before detection reached them
+
+        self.gate = gate
+        self.faces = []         # last detections, in decoded image coordinates
+
+        self.lock = Lock()
+        self.result = {"faces": [], "time": None, "latency": None, "dropped": 0, "gate": {}}
+
+        self.terminated = False
+
+    def submit(self, frame):
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (frame, time.time())
+            self.condition.notify()
+
+    def latest(self):
+        with self.lock:
+            return dict(self.result)
+
+    def run(self):
+        while not self.terminated:
+            with self.condition:
+                while self.pending is None and not self.terminated:
+                    self.condition.wait(0.5)
+                if self.terminated:
+                    break
+                frame, received = self.pending
+                self.pending = None
+
+            gray = decode(frame, self.decode_flag)
+            if gray is None:
+                continue
+
+            if self.gate is None:
+                self.faces = FR(gray)
+            else:
+                mode, regions = self.gate.update(gray, self.faces)
+                if mode != "static":
+                    # keep detections outside the searched regions, the scene there has not changed
+                    kept = [face for face in self.faces if not any(overlaps(face, region) for region in regions)]
+                    self.faces = kept + FR(gray, regions)
+
+            with self.lock:
+                self.result = {
+                    "faces": [[v * self.scale for v in face] for face in self.faces],  # full resolution frame coordinates
+                    "time": time.time(),
+                    "latency": time.time() - received,
+                    "dropped": self.dropped,
+                    "gate": dict(self.gate.counts) if self.gate else {},
+                    "size": [gray.shape[1] * self.scale, gray.shape[0] * self.scale],
+                }
+
+
+class Client(object):
+    """A streaming viewer, holding only the newest frame it has not been sent yet."""
+
+    def __init__(self, address):
+        self.address = address
+        self.pending = None
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.bytes = 0
+
+
+class Broadcaster(object):
+    """Fan each camera frame out to every streaming client from one event loop.
+
+    Every client shares the same frame bytes. A client still sending when the
+    next frame arrives has its pending frame replaced, so a slow viewer drops
+    frames instead of queueing them or holding up anyone else.
+
+    Constructor Arguments:
+        loop: event loop the clients are served from
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.clients = set()
+
+    def publish(self, frame):
+        # called from the camera thread
+        self.loop.call_soon_threadsafe(self._fan_out, frame)
+
+    def counters(self, timeout=1.0):
+        """Frames sent and dropped for each client, read on the loop so safe from any thread.
+
+        Returns:
+            dict: (sent, dropped) for each client
+        """
+        future = concurrent.futures.Future()
+        # clients are only added and removed on the loop, so snapshot them there
+        self.loop.call_soon_threadsafe(
+            lambda: future.set_result({client: (client.sent, client.dropped) for client in self.clients})
+        )
+        return future.result(timeout)
+
+    def _fan_out(self, frame):
+        # part header built once per frame, not once per client
+        part = (
+            b"--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame),
+            frame,
+        )
+        for client in self.clients:
+            if client.pending is not None:
+                client.dropped += 1
+            client.pending = part
+            client.ready.set()
+
+    async def stream(self, writer):
+        client = Client(writer.get_extra_info("peername"))
+        self.clients.add(client)
+
+        # keep the socket buffer to about a frame, so drain waits rather than buffering a backlog
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            b"Age: 0\r\n"
+            b"Cache-Control: no-cache, private\r\n"
+            b"Pragma: no-cache\r\n"
+            b"Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\n\r\n"
+        )
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                header, frame = client.pending
+                client.pending = None
+
+                writer.writelines((header, frame, b"\r\n"))
+                await writer.drain()
+                client.sent += 1
+                client.bytes += len(header) + len(frame) + 2
+        except ConnectionError as e:
+            logging.warning(
+                "Removed streaming client %s after %d frames, %d dropped: %s",
+                client.address, client.sent, client.dropped, str(e),
             )
-            self.end_headers()
+        finally:
+            self.clients.discard(client)
+
+
+class EncoderController(Thread):
+    """Step stream quality, resolution and frame rate up or down to fit CPU and bandwidth.
+
+    The camera's hardware encoder does the JPEG work, so the CPU measured is this
+    process's share of the machine, mostly detection. Bandwidth is judged by how
+    many frames viewers receive, a viewer whose link cannot keep up drops frames.
+    Steps down happen straight away, steps up only after several good periods.
+
+    Constructor Arguments:
+        camera: PiCamera, recording into output
+        output: StreamingOutput the camera records into
+        broadcaster: Broadcaster serving the viewers
+        cpu_budget: fraction of all cores the stream and detection may use, the rest is left for planning
+        min_delivered: fraction of frames the median viewer must receive
+        period: time between adjustments, in seconds
+        patience: good periods needed before stepping up
+    """
+
+    # (resolution, frame rate, JPEG quality), best first
+    LADDER = [
+        ((640, 480), 24, 85),
+        ((640, 480), 15, 75),
+        ((480, 368), 15, 70),
+        ((320, 240), 12, 60),
+        ((320, 240), 8, 50),
+    ]
+
+    def __init__(self, camera, output, broadcaster, cpu_budget=0.5, min_delivered=0.9, period=2.0, patience=3):
+        Thread.__init__(self)
+        self.daemon = True
+
+        self.camera = camera
+        self.output = output
+        self.broadcaster = broadcaster
+        self.cpu_budget = cpu_budget
+        self.min_delivered = min_delivered
+        self.period = period
+        self.patience = patience
+
+        self.level = 0
+        self.good = 0
+        self.terminated = False
+
+    def apply(self, level):
+        resolution, framerate, quality = self.LADDER[level]
+        self.camera.stop_recording()
+        self.camera.resolution = resolution
+        self.camera.framerate = framerate
+        self.camera.start_recording(self.output, format="mjpeg", quality=quality)
+        self.level = level
+        logging.info("Stream set to %dx%d at %dfps, quality %d", *resolution, framerate, quality)
+
+    def measure(self, cpu, wall, frames, frame_bytes, clients, clients_now):
+        # CPU as a fraction of every core, and the median viewer's share of frames since the last period
+        cpu_now, wall_now = time.process_time(), time.time()
+        usage = (cpu_now - cpu) / ((wall_now - wall) * (os.cpu_count() or 1))
+
+        delivered = []
+        for client, (sent_now, dropped_now) in clients_now.items():
+            sent, dropped = clients.get(client, (0, 0))
+            total = (sent_now - sent) + (dropped_now - dropped)
+            if total:
+                delivered.append((sent_now - sent) / total)
+
+        new_frames = self.output.frames - frames
+        frame_size = (self.output.bytes - frame_bytes) / new_frames if new_frames else 0
+        return usage, statistics.median(delivered) if delivered else 1.0, frame_size
+
+    def run(self):
+        cpu, wall = time.process_time(), time.time()
+        frames, frame_bytes = self.output.frames, self.output.bytes
+        clients = {}
+
+        while not self.terminated:
+            time.sleep(self.period)
+
             try:
-                while True:
-                    with output.condition:
-                        output.condition.wait()
-                        frame = output.frame
-                    self.wfile.write(b"--FRAME\r\n")
-                    self.send_header("Content-Type", "image/jpeg")
-                    self.send_header("Content-Length", len(frame))
-                    self.end_headers()
-                    self.wfile.write(frame)
-                    self.wfile.write(b"\r\n")
-            except Exception as e:
-                logging.warning(
-                    "Removed streaming client %s: %s", self.client_address, str(e)
-                )
-        else:
-            self.send_error(404)
-            self.end_headers()
+                clients_now = self.broadcaster.counters()
+            except concurrent.futures.TimeoutError:
+                continue  # the loop is too busy to answer, measure over a longer period
 
+            usage, delivered, frame_size = self.measure(cpu, wall, frames, frame_bytes, clients, clients_now)
+            cpu, wall = time.process_time(), time.time()
+            frames, frame_bytes = self.output.frames, self.output.bytes
+            clients = clients_now
 
-class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+            logging.debug("Stream cpu %.2f, delivered %.2f, frame %d bytes", usage, delivered, frame_size)
 
+            if usage > self.cpu_budget or delivered < self.min_delivered:
+                self.good = 0
+                if self.level < len(self.LADDER) - 1:
+                    self.apply(self.level + 1)
+            elif usage < self.cpu_budget * 0.7 and delivered > 0.98:
+                # only step up with headroom to spare, to avoid oscillating between levels
+                self.good += 1
+                if self.good >= self.patience and self.level > 0:
+                    self.good = 0
+                    self.apply(self.level - 1)
+            else:
+                self.good = 0
 
-def FR(buff_val):
-    # Convert the picture into a numpy array
-    buff = numpy.frombuffer(buff_val, dtype=numpy.uint8)
 
-    if buff.size > 0:
+def respond(writer, status, content_type, content, headers=b""):
+    writer.write(
+        b"HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s\r\n"
+        % (status, content_type, len(content), headers)
+    )
+    writer.write(content)
 
-        # Now creates an OpenCV image
-        image = cv2.imdecode(buff, 1)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+async def handle(reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # headers are not needed
+        parts = request.split()
+        path = parts[1].decode() if len(parts) > 1 else ""
 
-        # Look for faces in the image using the loaded cascade file
-        faces = CASCADE.detectMultiScale(gray, 1.1, 5)
+        if path == "/":
+            writer.write(b"HTTP/1.0 301 Moved Permanently\r\nLocation: /index.html\r\n\r\n")
+        elif path == "/index.html":
+            respond(writer, b"200 OK", b"text/html", PAGE.encode("utf-8"))
+        elif path == "/faces.json":
+            content = json.dumps(detector.latest()).encode("utf-8")
+            respond(writer, b"200 OK", b"application/json", content, b"Cache-Control: no-cache, private\r\n")
+        elif path == "/stream.mjpg":
+            await broadcaster.stream(writer)
+        else:
+            respond(writer, b"404 Not Found", b"text/plain", b"Not found")
 
-        # write number of faces detected to image
-        cv2.putText(image, 
-            f"{len(faces)} faces found.",   # text
-            (20, 30),   # position
-            cv2.FONT_HERSHEY_SIMPLEX,   # font
-            1,  # font scale
-            (0, 0, 0),  # color (black)
-            1,  # thickness
-            1,  # line type
-        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(address):
+    server = await asyncio.start_server(handle, *address, reuse_address=True)
+    async with server:
+        await server.serve_forever()
+
+
+def decode(buff_val, decode_flag=cv2.IMREAD_REDUCED_GRAYSCALE_2):
+    # Convert the picture into a numpy array, without copying the frame
+    buff = numpy.frombuffer(buff_val, dtype=numpy.uint8)
 
-        # Draw a rectangle around every found face
-        for (x, y, w, h) in faces:
-            cv2.rectangle(image, (x, y), (x + w, y + h), (255, 255, 0), 2)
+    if buff.size == 0:
+        return None
 
-        # encode as JPG
-        buff = cv2.imencode(".jpg", image)
+    # Decode straight to a downscaled grayscale image, much cheaper than a full colour decode
+    return cv2.imdecode(buff, decode_flag)
 
-        # convert to bytes
-        buff = buff[1].tobytes()
 
-        # return modified frame buffer
-        return buff
+def FR(gray, regions=None):
+    # Look for faces using the loaded cascade file, in the whole image or only within regions
+    if regions is None:
+        return [[int(v) for v in face] for face in CASCADE.detectMultiScale(gray, 1.1, 5)]
 
-    else:
-        return buff_val
+    faces = []
+    for x, y, w, h in regions:
+        for fx, fy, fw, fh in CASCADE.detectMultiScale(gray[y:y + h, x:x + w], 1.1, 5):
+            faces.append([int(fx) + x, int(fy) + y, int(fw), int(fh)])  # back to whole image coordinates
+    return faces
 
 
 with picamera.PiCamera(
-    resolution="640x480", framerate=5
-) as camera:  # needs a hi-res in order to perform facial detection, but low-fps in order to stay close to realtime
-    output = StreamingOutput()
+    resolution=EncoderController.LADDER[0][0], framerate=EncoderController.LADDER[0][1]
+) as camera:  # streaming no longer waits on detection, so the frame rate is not limited by it
+    detector = DetectionWorker(gate=MotionGate())
+    detector.start()
+    loop = asyncio.new_event_loop()
+    broadcaster = Broadcaster(loop)
+    output = StreamingOutput(broadcaster, detector)
     # Uncomment the next line to change your Pi's Camera rotation (in degrees)
     camera.rotation = 180
-    camera.start_recording(output, format="mjpeg")
+    camera.start_recording(output, format="mjpeg", quality=EncoderController.LADDER[0][2])
+    controller = EncoderController(camera, output, broadcaster)
+    controller.start()
     try:
         address = ("", 8000)
-        server = StreamingServer(address, StreamingHandler)
-        server.serve_forever()
+        loop.run_until_complete(serve(address))
     finally:
+        controller.terminated = True
         camera.stop_recording()
+        detector.terminated = True
+        detector.join()